@@ -0,0 +1,96 @@
+import os
+import asyncio
+import logging
+
+from .reader import FileFollower
+
+
+_logger = logging.getLogger('akita')
+
+
+async def wait_readable(fileobj, timeout=None):
+    """
+    Wait until a file object or descriptor has data to read, without
+    blocking the event loop. Returns False if the timeout expired first.
+    """
+    loop = asyncio.get_event_loop()
+    future = loop.create_future()
+
+    def on_readable():
+        if not future.done():
+            future.set_result(True)
+
+    loop.add_reader(fileobj, on_readable)
+    try:
+        return await asyncio.wait_for(future, timeout)
+    except asyncio.TimeoutError:
+        return False
+    finally:
+        loop.remove_reader(fileobj)
+
+
+async def wait_for_data(reader, timeout=1.0):
+    """
+    The asyncio version of reader.wait(), waits on the pipe or the inotify
+    descriptor if the reader has one, otherwise polls.
+    """
+    fd = reader.selectable()
+    if fd is None:
+        await asyncio.sleep(min(timeout, reader.poll_interval))
+    elif await wait_readable(fd, timeout):
+        # Consume the inotify events, this doesn't block
+        reader.wait(0)
+
+
+async def follow(reader, on_chunk, on_idle=None, wait=None):
+    """
+    Read chunks from a log reader until the stream is closed, regular files
+    are followed forever.
+
+    Params:
+        reader (ChunkedLineReader or FileFollower): The source to read.
+        on_chunk (coroutine function): Called with each chunk of raw bytes.
+        on_idle (coroutine function): Called each time the reader catches
+            up to the end of the file, before waiting for more data.
+        wait (coroutine function): Waits for more data, defaults to
+            wait_for_data(reader).
+    """
+    fd = reader.selectable()
+    if fd is not None and not isinstance(reader, FileFollower):
+        # Reading from a pipe would otherwise block the whole event loop
+        os.set_blocking(fd, False)
+
+    while True:
+        chunk = reader.read_chunk()
+        if chunk is not None:
+            await on_chunk(chunk)
+            # Give the other sources a turn when this one is busy
+            await asyncio.sleep(0)
+        elif reader.closed:
+            chunk = reader.flush_chunk()
+            if chunk is not None:
+                await on_chunk(chunk)
+            if on_idle:
+                await on_idle()
+            _logger.info('Reached the end of %s', reader.name)
+            return
+        elif reader.at_eof:
+            if on_idle:
+                await on_idle()
+            if wait:
+                await wait()
+            else:
+                await wait_for_data(reader)
+
+
+async def receive(receiver, poll_interval=0.1):
+    """
+    Handle the deltas sent to a DeltaReceiver as they arrive.
+    """
+    fd = receiver.fileno()
+    while True:
+        if fd is None:
+            receiver.poll(0)
+            await asyncio.sleep(poll_interval)
+        elif await wait_readable(fd):
+            receiver.poll(0)
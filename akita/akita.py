@@ -1,39 +1,246 @@
 import os
+import sys
+import glob
+import math
 import time
+import select
+import signal
+import asyncio
 import logging
 import argparse
 from weakref import proxy
-from threading import Thread
+from threading import Thread, RLock
 from datetime import datetime
-from collections import deque
+from itertools import groupby
+from collections import deque, Counter
 
 from . import LOGO
 from .__version__ import __version__
-from .parser import HTTPLogParser
-from .display import Display
+from .parser import _is_digits
+from .logformat import create_parser, LOG_FORMATS
+from .reader import open_reader, LogFileSet
+from .replay import Replay, format_report
+from .pipeline import ParallelParser, summarize_chunk
+from .aio import follow, receive, wait_readable
+from .network import Agent, DeltaReceiver, delta_to_summary
+from .display import Display, OutputMeter
+from .stats import PipelineStats, format_stats
+from .sampling import LoadShedder
+from .export import MetricsExporter, MetricsServer
 from .metrics import AlertMetric, TaggedCounterMetric, CounterMetric
+from .metrics import TopKCounterMetric, QuantileMetric
+from .metrics import StatusMetric, ErrorRateAlertMetric, ReservoirSample
+from .metrics import RollupMetric
 
 
 _logger = logging.getLogger('akita')
 
 
-def parse_cmdline():
+def parse_cmdline(argv=None):
     parser = argparse.ArgumentParser(
         prog='akita', description=LOGO,
-        usage='akita [--help] [--version] FILE',
+        usage='akita [--help] [--version] [--replay] FILE [FILE ...]\n'
+              '       akita agent [--help] FILE ADDRESS\n'
+              '       akita collect [--help] ADDRESS\n'
+              '       akita bench [--help] {generate,run}',
         formatter_class=argparse.RawDescriptionHelpFormatter)
     parser.add_argument(
-        'logfile', metavar='FILE', type=argparse.FileType(errors='replace'),
-        help='A log file to watch, use "-" to pipe from stdin')
+        'logfiles', metavar='FILE', nargs='+',
+        help='A log file to watch, use "-" to pipe from stdin. Multiple '
+             'files or quoted glob patterns like "/var/log/nginx/*.log" '
+             'can be given to also follow files that are created later')
     parser.add_argument(
         '--alert-threshold', type=int, default=10,
         help='High traffic alert threshold, requests/second')
     parser.add_argument(
         '--alert-window', type=int, default=120,
         help='High traffic alert window, in seconds')
+    parser.add_argument(
+        '--error-threshold', type=float, default=5.0, metavar='PERCENT',
+        help='Server error alert threshold, the percentage of responses '
+             'with a 5xx status code')
+    parser.add_argument(
+        '--error-window', type=int, default=60,
+        help='Server error alert window, in seconds')
+    parser.add_argument(
+        '--chunk-size', type=int, default=1024 * 1024,
+        help='Maximum number of bytes to read from the log file at once')
+    parser.add_argument(
+        '--workers', type=int, default=0,
+        help='Parse the log file using a pool of worker processes')
+    parser.add_argument(
+        '--event-time', action='store_true',
+        help='Bin requests using the log timestamps instead of arrival time')
+    parser.add_argument(
+        '--allowed-lateness', type=float, default=None,
+        help='Drop requests that are more than this many seconds late, '
+             'in --event-time mode')
+    parser.add_argument(
+        '--top-k', type=int, default=None, metavar='CAPACITY',
+        help='Track URL sections with a fixed-size approximate counter, '
+             'to bound memory when there are many distinct sections')
+    parser.add_argument(
+        '--percentiles', action='store_true',
+        help='Show the p50/p95/p99 request times and response sizes, and '
+             'the bytes served by each section. Request times are read from '
+             'a number after the quoted fields (Apache %%D or nginx '
+             '$request_time)')
+    parser.add_argument(
+        '--log-format', default=None, metavar='FORMAT',
+        help='An Apache LogFormat or nginx log_format string, or one of {}. '
+             'Use "json" for JSON lines, optionally followed by the keys, '
+             'e.g. json:path=uri,status=code,request_time=took:ms. '
+             'Defaults to the Combined Log Format'.format(
+                 ', '.join(sorted(LOG_FORMATS))))
+    parser.add_argument(
+        '--backfill', action='store_true',
+        help='Start by reading the rotated log files (FILE.1, FILE.2.gz, '
+             '...) and FILE from the beginning, implies --event-time')
+    parser.add_argument(
+        '--asyncio', action='store_true',
+        help='Read the log file and draw the UI on a single asyncio event '
+             'loop instead of using a reader thread')
+    parser.add_argument(
+        '--term-stats', action='store_true',
+        help='Show the number of bytes written to the terminal per second')
+    parser.add_argument(
+        '--stats', action='store_true',
+        help='Show the pipeline panel with the time spent reading, parsing, '
+             'aggregating and drawing (toggle it with the "p" key), and '
+             'print a summary of them on exit')
+    parser.add_argument(
+        '--shed-load', action='store_true',
+        help='When Akita falls behind the log, only parse 1 in N lines and '
+             'scale up the counts, so the numbers stay live at the cost of '
+             'some accuracy')
+    parser.add_argument(
+        '--max-lag', type=float, default=10.0, metavar='SECONDS',
+        help='With --shed-load, start sampling when the newest log '
+             'timestamp is this far behind the clock, in --event-time mode')
+    parser.add_argument(
+        '--max-backlog', type=float, default=16.0, metavar='MB',
+        help='With --shed-load, start sampling when this much of the log '
+             'hasn\'t been read yet')
+    parser.add_argument(
+        '--headless', action='store_true',
+        help='Run without the UI and serve the metrics over HTTP instead, '
+             'at /metrics (Prometheus) and /metrics.json')
+    parser.add_argument(
+        '--http', default='127.0.0.1:9180', metavar='ADDRESS',
+        help='The address for the --headless HTTP server')
+    parser.add_argument(
+        '--replay', action='store_true',
+        help='Process the whole file from the beginning without the UI, '
+             'and print a summary report')
+    parser.add_argument(
+        '--output', choices=['text', 'json'], default='text',
+        help='The format of the --replay report')
     parser.add_argument(
         '-V', '--version', action='version', version='akita ' + __version__)
-    return parser.parse_args()
+    args = parser.parse_args(argv)
+
+    # A single file is opened right away so errors are reported up front,
+    # anything else is watched as a set of files
+    args.logfile = None
+    path = args.logfiles[0]
+    if len(args.logfiles) == 1 and glob.escape(path) == path:
+        try:
+            args.logfile = argparse.FileType('rb')(path)
+        except argparse.ArgumentTypeError as e:
+            parser.error(str(e))
+    elif args.replay:
+        parser.error('--replay only supports a single FILE')
+    elif '-' in args.logfiles:
+        parser.error('stdin can only be watched by itself')
+
+    if args.percentiles and args.workers:
+        parser.error('--percentiles is not supported with --workers')
+    if args.shed_load and args.replay:
+        parser.error('--shed-load can\'t be used with --replay')
+    return args
+
+
+def parse_agent_cmdline(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='akita agent',
+        description='Watch a log file and publish the aggregated metrics '
+                    'to an Akita collector')
+    parser.add_argument(
+        'logfile', metavar='FILE', type=argparse.FileType('rb'),
+        help='A log file to watch, use "-" to pipe from stdin')
+    parser.add_argument(
+        'address', metavar='ADDRESS',
+        help='The collector address, e.g. udp://host:port, tcp://host:port '
+             'or unix:///path/to/socket')
+    parser.add_argument(
+        '--interval', type=float, default=1.0,
+        help='How often to publish metrics, in seconds')
+    parser.add_argument(
+        '--name', default=None,
+        help='The name that identifies this agent, defaults to HOST:FILE')
+    parser.add_argument(
+        '--event-time', action='store_true',
+        help='Bin requests using the log timestamps instead of arrival time')
+    parser.add_argument(
+        '--log-format', default=None, metavar='FORMAT',
+        help='An Apache LogFormat or nginx log_format string, or one of {}. '
+             'Use "json" for JSON lines, optionally followed by the keys, '
+             'e.g. json:path=uri,status=code,request_time=took:ms. '
+             'Defaults to the Combined Log Format'.format(
+                 ', '.join(sorted(LOG_FORMATS))))
+    parser.add_argument(
+        '--max-sections', type=int, default=100,
+        help='The maximum number of URL sections to publish per second')
+    parser.add_argument(
+        '--chunk-size', type=int, default=1024 * 1024,
+        help='Maximum number of bytes to read from the log file at once')
+    return parser.parse_args(argv)
+
+
+def parse_collect_cmdline(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='akita collect',
+        description='Receive metrics from Akita agents and display the '
+                    'combined view')
+    parser.add_argument(
+        'address', metavar='ADDRESS',
+        help='The address to listen on, e.g. udp://0.0.0.0:8125, '
+             'tcp://0.0.0.0:8125 or unix:///path/to/socket')
+    parser.add_argument(
+        '--alert-threshold', type=int, default=10,
+        help='High traffic alert threshold, requests/second')
+    parser.add_argument(
+        '--alert-window', type=int, default=120,
+        help='High traffic alert window, in seconds')
+    parser.add_argument(
+        '--error-threshold', type=float, default=5.0, metavar='PERCENT',
+        help='Server error alert threshold, the percentage of responses '
+             'with a 5xx status code')
+    parser.add_argument(
+        '--error-window', type=int, default=60,
+        help='Server error alert window, in seconds')
+    parser.add_argument(
+        '--allowed-lateness', type=float, default=None,
+        help='Drop requests that are more than this many seconds late')
+    parser.add_argument(
+        '--top-k', type=int, default=None, metavar='CAPACITY',
+        help='Track URL sections with a fixed-size approximate counter, '
+             'to bound memory when there are many distinct sections')
+    parser.add_argument(
+        '--asyncio', action='store_true',
+        help='Receive deltas and draw the UI on a single asyncio event loop '
+             'instead of using a receiver thread')
+    parser.add_argument(
+        '--term-stats', action='store_true',
+        help='Show the number of bytes written to the terminal per second')
+    parser.add_argument(
+        '--headless', action='store_true',
+        help='Run without the UI and serve the metrics over HTTP instead, '
+             'at /metrics (Prometheus) and /metrics.json')
+    parser.add_argument(
+        '--http', default='127.0.0.1:9180', metavar='ADDRESS',
+        help='The address for the --headless HTTP server')
+    return parser.parse_args(argv)
 
 
 class CursesLogHandler(logging.Handler):
@@ -41,12 +248,48 @@ class CursesLogHandler(logging.Handler):
     Custom logger that sends messages to a queue instead of writing them
     to a file or stream.
     """
-    def __init__(self, message_queue):
+    def __init__(self, message_queue, wakeup=None):
         super().__init__()
         self.message_queue = message_queue
+        self.wakeup = wakeup
 
     def emit(self, record):
         self.message_queue.append(record)
+        if self.wakeup:
+            self.wakeup.set()
+
+
+class Wakeup:
+    """
+    A self-pipe that other threads (and signal handlers) can write to in
+    order to interrupt a select() call in the UI loop.
+    """
+
+    def __init__(self):
+        self._read_fd, self._write_fd = os.pipe()
+        os.set_blocking(self._read_fd, False)
+        os.set_blocking(self._write_fd, False)
+
+    def fileno(self):
+        return self._read_fd
+
+    def set(self):
+        try:
+            os.write(self._write_fd, b'\0')
+        except BlockingIOError:
+            # The pipe is full, so a wakeup is already pending
+            pass
+
+    def clear(self):
+        try:
+            while os.read(self._read_fd, 4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def close(self):
+        os.close(self._read_fd)
+        os.close(self._write_fd)
 
 
 class MetricsAggregator:
@@ -54,37 +297,444 @@ class MetricsAggregator:
     Aggregates all of the metrics and alerts used in Akita.
     """
 
-    def __init__(self, alert_threshold, alert_window):
+    # The fields that need to be extracted from each log line
+    fields = ('subpath', 'status')
+
+    # The attribute names of all of the sliding window metrics
+    metric_names = ('subpath_counter', 'traffic_counter', 'alert_metric',
+                    'status_counter', 'error_alert', 'sample_variance')
+
+    # The number of rejected lines to keep for the errors panel
+    n_error_samples = 20
+
+    def __init__(self, alert_threshold, alert_window, event_time=False,
+                 allowed_lateness=None, top_k=None, sources=False,
+                 percentiles=False, error_threshold=0.05, error_window=60,
+                 follow_clock=False):
+        """
+        Params:
+            alert_threshold (int): High traffic alert threshold, requests/sec.
+            alert_window (int): High traffic alert window, in seconds.
+            event_time (bool): Bin each point using the timestamp from the
+                log line instead of the time that the line was read.
+            allowed_lateness (float): In event time mode, the number of
+                seconds that a point can lag behind the newest window before
+                it's dropped.
+            top_k (int): If set, track the URL sections using a fixed-size
+                heavy hitters sketch with this capacity, instead of counting
+                every distinct section exactly.
+            sources (bool): Also count the hits from each log file, when
+                watching more than one.
+            percentiles (bool): Track the distribution of the request times
+                and response sizes, and the bytes served by each section.
+            error_threshold (float): Server error alert threshold, as the
+                fraction of responses with a 5xx status code.
+            error_window (int): Server error alert window, in seconds.
+            follow_clock (bool): In event time mode, also roll the windows
+                over to the wall clock (less the allowed lateness) when no
+                new points arrive. Only for sources that are always live,
+                like the collector's agents, a backfilled log would be
+                dropped.
+        """
         self.hit_total = 0
         self.miss_total = 0
+        self.skipped_total = 0
         self.last_seen = None
+
+        # The 1 in N sampling step of the latest batch, see LoadShedder
+        self.sample_step = 1
+
+        # The number of lines rejected for each reason (see parser.py), and
+        # a random sample of the (reason, line) pairs to show in the UI
+        self.error_reasons = Counter()
+        self.error_samples = ReservoirSample(self.n_error_samples)
         self.last_flush = None
 
-        self.subpath_counter = TaggedCounterMetric(1, 10)
-        self.traffic_counter = CounterMetric(1, 240)
-        self.alert_metric = AlertMetric(1, alert_window, alert_threshold)
+        # The reader thread adds points and (in event time mode) rolls the
+        # windows over while the UI thread is drawing them, so anything that
+        # touches more than a single number needs to hold this lock
+        self.lock = RLock()
+
+        self.event_time = event_time
+        self.watermark = None
+        self.follow_clock = follow_clock
+        self.allowed_lateness = allowed_lateness
+
+        # Functions that will be called with (alert, alert_metric) whenever
+        # the traffic alert or the error rate alert starts or stops
+        self.alert_listeners = []
+        if event_time:
+            self.fields = self.fields + ('timestamp',)
+
+        if top_k:
+            self.subpath_counter = TopKCounterMetric(
+                1, 10, top_k, allowed_lateness)
+        else:
+            self.subpath_counter = TaggedCounterMetric(
+                1, 10, allowed_lateness)
+        # 5 minutes at full resolution, and a week at coarser ones
+        self.traffic_counter = RollupMetric(1, 300, allowed_lateness)
+        self.alert_metric = AlertMetric(
+            1, alert_window, alert_threshold, allowed_lateness)
+        self.status_counter = StatusMetric(1, 10, allowed_lateness)
+        # The variance that sampling added to the hits in each window, for
+        # the error bounds on the estimated counts
+        self.sample_variance = CounterMetric(1, 10, allowed_lateness)
+        self.error_alert = ErrorRateAlertMetric(
+            1, error_window, error_threshold,
+            allowed_lateness=allowed_lateness)
+
+        self.source_counter = None
+        if sources:
+            self.source_counter = TaggedCounterMetric(1, 10, allowed_lateness)
+            self.metric_names = self.metric_names + ('source_counter',)
+
+        self.percentiles = percentiles
+        self.latency_metric = self.size_metric = self.bytes_counter = None
+        if percentiles:
+            self.fields = self.fields + ('size', 'request_time')
+            # 1 microsecond to ~3 hours, and 1 byte to 1 TB
+            self.latency_metric = QuantileMetric(
+                1, 10, 1e-6, 1e4, allowed_lateness=allowed_lateness)
+            self.size_metric = QuantileMetric(
+                1, 10, 1, 1e12, allowed_lateness=allowed_lateness)
+            if top_k:
+                self.bytes_counter = TopKCounterMetric(
+                    1, 10, top_k, allowed_lateness)
+            else:
+                self.bytes_counter = TaggedCounterMetric(
+                    1, 10, allowed_lateness)
+            self.metric_names = self.metric_names + (
+                'latency_metric', 'size_metric', 'bytes_counter')
+
+    @property
+    def late_total(self):
+        """
+        The number of points that arrived too late to be counted.
+        """
+        return self.traffic_counter.dropped
 
     def add_point(self, http_data):
-        self.hit_total += 1
-        self.last_seen = datetime.now()
+        with self.lock:
+            self.hit_total += 1
+            self.last_seen = datetime.now()
 
-        self.alert_metric.add_point()
-        self.traffic_counter.add_point()
-        self.subpath_counter.add_point(tags=[http_data['subpath']])
+            timestamp = None
+            if self.event_time:
+                timestamp = http_data['timestamp']
+                self._update_watermark(timestamp)
 
-    def add_error(self):
-        self.miss_total += 1
+            self.alert_metric.add_point(timestamp=timestamp)
+            self.traffic_counter.add_point(timestamp=timestamp)
+            self.subpath_counter.add_point(
+                tags=[http_data['subpath']], timestamp=timestamp)
+
+            self._add_statuses({http_data['status']: 1}, timestamp)
+
+    def add_points(self, points, source=None, weight=1):
+        """
+        Add a batch of parsed lines at once, this is equivalent to calling
+        add_point() for each item but avoids most of the per-line overhead.
+
+        All of the points in a batch come from the same log file, so the
+        source is tagged once per batch instead of on every point. If the
+        lines were sampled 1 in N, each point counts as ``weight`` hits.
+        """
+        with self.lock:
+            self.sample_step = weight
+            if not points:
+                return
+
+            self.hit_total += len(points)
+            self.last_seen = datetime.now()
+
+            if self.event_time:
+                self._add_event_points(points, source, weight)
+                return
+
+            count = len(points) * weight
+            self.alert_metric.add_point(count)
+            self.traffic_counter.add_point(count)
+            self.subpath_counter.add_points([p['subpath'] for p in points],
+                                            weight=weight)
+            self._add_codes(points, weight=weight)
+            self._add_source(source, count)
+            self._add_variance(len(points), weight)
+            if self.percentiles:
+                self._add_responses(points, weight=weight)
+
+    def _add_source(self, source, count, timestamp=None):
+        if self.source_counter is not None and source is not None:
+            self.source_counter.add_point([source], count, timestamp)
+
+    def _add_codes(self, points, timestamp=None, weight=1):
+        # A batch only has a handful of distinct codes, so they're tallied
+        # once and the metrics only need to do a few array increments
+        tally = Counter([p['status'] for p in points])
+        self._add_statuses(self._scale(tally, weight), timestamp)
+
+    @staticmethod
+    def _scale(counter, weight):
+        if weight == 1:
+            return counter
+        return Counter({key: count * weight for key, count in counter.items()})
+
+    def _add_variance(self, n_points, weight, timestamp=None):
+        """
+        Each point in a 1 in N sample stands in for N hits, give or take.
+        Treating the sample like a binomial draw, the variance of the
+        estimated count is N * (N - 1) for every point that was kept.
+        """
+        if weight > 1:
+            self.sample_variance.add_point(
+                n_points * weight * (weight - 1), timestamp)
+
+    def error_bound(self, count, z=1.96):
+        """
+        The margin of error for a count over the last 10 windows, like the
+        counts in the Most Visited panel, that was estimated from a sample.
+        Defaults to a ~95% confidence interval, and is 0 when every line
+        was parsed.
+
+        The count's share of the sampling variance is assumed to be the
+        same as its share of the hits.
+        """
+        variance = self.sample_variance.total
+        total = self.subpath_counter.total[None]
+        if not variance or not total:
+            return 0.0
+        return z * math.sqrt(variance * min(count, total) / total)
+
+    def _add_statuses(self, tally, timestamp=None):
+        self.status_counter.add_counts(tally, timestamp)
+        self.error_alert.add_counts(tally, timestamp)
+
+    @staticmethod
+    def _to_seconds(request_time):
+        """
+        nginx logs the request time in seconds with millisecond resolution,
+        Apache's %D is a whole number of microseconds. Parsers for a custom
+        log format already know the units and return float seconds.
+        """
+        if isinstance(request_time, float):
+            return request_time
+        if '.' in request_time:
+            return float(request_time)
+        return int(request_time) / 1e6
+
+    def _add_responses(self, points, timestamp=None, weight=1):
+        """
+        Add the request times and response sizes, only lines that include a
+        request time are added to the latency metric. Sampling doesn't
+        change the percentiles, so only the bytes served are scaled up.
+        """
+        latencies = []
+        sizes = []
+        served = Counter()
+        for point in points:
+            request_time = point['request_time']
+            if request_time is not None:
+                latencies.append(self._to_seconds(request_time))
+
+            # The size is "-" when there's no response body, the JSON
+            # parser has already converted it
+            size = point['size']
+            if isinstance(size, str):
+                size = int(size) if _is_digits(size) else 0
+            sizes.append(size)
+            served[point['subpath']] += size
+
+        served[None] = sum(sizes)
+        if latencies:
+            self.latency_metric.add_values(latencies, timestamp)
+        self.size_metric.add_values(sizes, timestamp)
+        self.bytes_counter.add_counter(self._scale(served, weight), timestamp)
+
+    def _add_event_points(self, points, source=None, weight=1):
+        """
+        Log lines are almost always in chronological order, so consecutive
+        points that share a window can be added together.
+        """
+        size = self.traffic_counter.window_size
+
+        def key(point):
+            return point['timestamp'] - point['timestamp'] % size
+
+        for window, group in groupby(points, key=key):
+            group = list(group)
+            self._update_watermark(window)
+
+            count = len(group) * weight
+            self.alert_metric.add_point(count, timestamp=window)
+            self.traffic_counter.add_point(count, timestamp=window)
+            self.subpath_counter.add_points(
+                [p['subpath'] for p in group], timestamp=window,
+                weight=weight)
+            self._add_codes(group, window, weight)
+            self._add_source(source, count, window)
+            self._add_variance(len(group), weight, window)
+            if self.percentiles:
+                self._add_responses(group, window, weight)
+
+    def _update_watermark(self, timestamp):
+        """
+        In event time mode, the metrics are flushed whenever the newest
+        timestamp crosses into a new window so the alerts are evaluated
+        against the log's own clock.
+        """
+        if self.watermark is not None and timestamp <= self.watermark:
+            return
+
+        self.watermark = timestamp
+        head = self.alert_metric.head
+        if head is None or timestamp >= head + self.alert_metric.window_size:
+            self._flush_metrics(timestamp)
+
+    def add_summary(self, summary, source=None):
+        """
+        Add the partial aggregates for a batch of lines that was parsed by a
+        worker process, see pipeline.BatchSummary.
+        """
+        with self.lock:
+            self.add_error(summary.n_errors)
+            self.error_reasons.update(summary.error_reasons)
+            self.error_samples.extend(summary.error_samples)
+            self.skipped_total += summary.n_skipped
+            self.sample_step = weight = summary.weight
+            if not summary.windows:
+                return
+
+            self.hit_total += summary.n_points
+            self.last_seen = datetime.now()
+
+            for window, hits, subpaths, statuses in summary.windows:
+                if window is not None:
+                    self._update_watermark(window)
+
+                count = hits * weight
+                self.alert_metric.add_point(count, timestamp=window)
+                self.traffic_counter.add_point(count, timestamp=window)
+                self.subpath_counter.add_counter(
+                    self._scale(subpaths, weight), timestamp=window)
+                self._add_statuses(self._scale(statuses, weight), window)
+                self._add_source(source, count, window)
+                self._add_variance(hits, weight, window)
+
+    def add_error(self, count=1):
+        with self.lock:
+            self.miss_total += count
+
+    def add_skipped(self, count):
+        """
+        Count the lines that were skipped over by the load shedder.
+        """
+        with self.lock:
+            self.skipped_total += count
+
+    def add_rejects(self, rejects):
+        """
+        Add the lines that a parser rejected, as a list of (reason, line)
+        tuples from parse_batch().
+        """
+        with self.lock:
+            self.miss_total += len(rejects)
+            self.error_reasons.update([reason for reason, _ in rejects])
+            self.error_samples.extend(rejects)
+
+    def snapshot(self):
+        """
+        Return the state of all of the metrics as a JSON serializable dict,
+        which can be saved with metrics.encode_snapshot() and restored later.
+        """
+        with self.lock:
+            return {
+                'hit_total': self.hit_total,
+                'miss_total': self.miss_total,
+                'skipped_total': self.skipped_total,
+                'error_reasons': dict(self.error_reasons),
+                'watermark': self.watermark,
+                'metrics': {name: getattr(self, name).snapshot()
+                            for name in self.metric_names},
+            }
+
+    def restore(self, data):
+        """
+        Load the state from a dict that was returned by snapshot().
+        """
+        with self.lock:
+            self.hit_total = data['hit_total']
+            self.miss_total = data['miss_total']
+            self.skipped_total = data['skipped_total']
+            self.error_reasons = Counter(data['error_reasons'])
+            self.watermark = data['watermark']
+            for name in self.metric_names:
+                getattr(self, name).restore(data['metrics'][name])
+
+    def merge(self, other):
+        """
+        Combine the metrics from another aggregator, e.g. one that was
+        populated by a different process or a different host.
+        """
+        with self.lock:
+            self.hit_total += other.hit_total
+            self.miss_total += other.miss_total
+            self.skipped_total += other.skipped_total
+            self.error_reasons.update(other.error_reasons)
+            self.error_samples.extend(other.error_samples.items)
+            watermark = other.watermark
+            if watermark is not None and (
+                    self.watermark is None or watermark > self.watermark):
+                self.watermark = watermark
+            for name in self.metric_names:
+                getattr(self, name).merge(getattr(other, name))
+
+    def time_to_next_window(self, timestamp=None):
+        """
+        The number of seconds until the metrics will roll over to the next
+        window, which is the next time that the display needs to change if
+        no new data arrives.
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+        window_size = self.traffic_counter.window_size
+        return window_size - timestamp % window_size
 
     def flush(self):
-        timestamp = time.time()
-        if self.last_flush and timestamp - self.last_flush > 1:
-            # If we're not keeping up with at least 1 flush/second, the
-            # process is probably maxed out on resources.
-            _logger.warning('Warning: Unable to keep up with log file')
-        self.last_flush = timestamp
+        with self.lock:
+            timestamp = time.time()
+            if self.last_flush and timestamp - self.last_flush > 1:
+                # If we're not keeping up with at least 1 flush/second, the
+                # process is probably maxed out on resources.
+                _logger.warning('Warning: Unable to keep up with log file')
+            self.last_flush = timestamp
+            if self.event_time:
+                # The windows follow the log's own clock (see
+                # _update_watermark), moving them to the wall clock would
+                # drop anything behind it
+                if self.follow_clock:
+                    self._flush_idle(timestamp - (self.allowed_lateness or 0))
+                return
+            self._flush_metrics(timestamp)
 
+    def _flush_idle(self, timestamp):
+        """
+        Roll the windows over when the sources have gone quiet, otherwise
+        the charts would freeze and an alert would never clear.
+        """
+        head, size = self.alert_metric.head, self.alert_metric.window_size
+        if head is not None and timestamp >= head + size:
+            self._flush_metrics(timestamp)
+
+    def _flush_metrics(self, timestamp):
         self.traffic_counter.flush(timestamp=timestamp)
         self.subpath_counter.flush(timestamp=timestamp)
+        self.status_counter.flush(timestamp=timestamp)
+        self.sample_variance.flush(timestamp=timestamp)
+        if self.source_counter is not None:
+            self.source_counter.flush(timestamp=timestamp)
+        if self.percentiles:
+            self.latency_metric.flush(timestamp=timestamp)
+            self.size_metric.flush(timestamp=timestamp)
+            self.bytes_counter.flush(timestamp=timestamp)
 
         alert = self.alert_metric.flush(timestamp=timestamp)
         if alert == AlertMetric.ALERT_START:
@@ -94,32 +744,102 @@ class MetricsAggregator:
             _logger.debug('Traffic has recovered from alert - hits = %.2f/s',
                           self.alert_metric.triggered_rate)
 
+        if alert:
+            for listener in self.alert_listeners:
+                listener(alert, self.alert_metric)
+
+        error = self.error_alert.flush(timestamp=timestamp)
+        if error == ErrorRateAlertMetric.ALERT_START:
+            _logger.error('High error rate generated an alert - 5xx = %.1f%%',
+                          self.error_alert.triggered_rate * 100)
+        elif error == ErrorRateAlertMetric.ALERT_STOP:
+            _logger.debug('Error rate has recovered from alert - 5xx = %.1f%%',
+                          self.error_alert.triggered_rate * 100)
+
+        if error:
+            for listener in self.alert_listeners:
+                listener(error, self.error_alert)
+        return alert
+
 
 class Akita:
 
-    def __init__(self, log_file, metrics):
+    # Redraws triggered by new log lines are limited to this many per second
+    max_fps = 5
+
+    def __init__(self, log_file, metrics, chunk_size=1024 * 1024, workers=0,
+                 backfill=False, log_format=None, shedder=None):
+
+        if backfill and not metrics.event_time:
+            # The UI flushes the metrics to the wall clock in processing
+            # time mode, which would drop the old lines as they're read
+            raise ValueError('Backfilling requires event time metrics')
 
         self.log_file = log_file
+        self.reader = None
+        if log_file is not None:
+            self.reader = open_reader(
+                log_file, chunk_size=chunk_size, backfill=backfill)
         self.start_time = None
         self.metrics = metrics
+        self.stats = PipelineStats()
 
-        self.http_parser = HTTPLogParser()
+        # Samples the lines when we fall behind the log, see --shed-load
+        self.shedder = shedder
+
+        self.http_parser = create_parser(metrics.fields, log_format)
+        self.pipeline = None
+        if workers:
+            self.pipeline = ParallelParser(
+                metrics.fields, workers, log_format=log_format)
         self.display = Display(proxy(self))
 
         self.message_queue = deque(maxlen=200)
 
+        # Wakes up the UI loop when there's something new to draw
+        self.wakeup = Wakeup()
+        self._last_notify = 0
+        self._resized = False
+
         self._stream_thread = Thread(target=self._run_stream_thread)
         self._stream_thread.daemon = True
 
         self._setup_logger()
 
+    @property
+    def source_name(self):
+        """
+        A description of where the data is coming from.
+        """
+        return self.reader.name
+
+    def update_stats(self):
+        """
+        Refresh the pipeline stats with how far behind the log we are.
+        Returns the stats version, for the display panel's state.
+        """
+        return self.stats.update(*self._backlog())
+
+    def _backlog(self):
+        """
+        How many seconds the newest log timestamp is behind the clock (only
+        known in event time mode), and the bytes that haven't been read.
+        """
+        lag = None
+        if self.metrics.watermark is not None:
+            lag = max(0.0, time.time() - self.metrics.watermark)
+        return lag, self._bytes_behind()
+
+    def _bytes_behind(self):
+        return self.reader.bytes_behind()
+
     def _setup_logger(self):
         """
         Send application log messages to our custom event queue, so they
         can be displayed in the terminal window.
         """
         self.logger = logging.getLogger('akita')
-        handler = CursesLogHandler(self.message_queue)
+        handler = CursesLogHandler(self.message_queue, self.wakeup)
         self.logger.addHandler(handler)
         self.logger.setLevel(logging.DEBUG)
 
@@ -131,47 +851,582 @@ class Akita:
         self._stream_thread.start()
 
         self.logger.info('Starting stream monitor')
+        signal.signal(signal.SIGWINCH, self._on_resize)
         with self.display.curses_session():
             while True:
                 self.metrics.flush()
                 self.display.draw()
-                time.sleep(0.2)
+                self._wait_for_event()
+
+    def _wait_for_event(self):
+        """
+        Sleep until the next window boundary, new data arrives, a message is
+        logged, or a key is pressed, whichever happens first.
+        """
+        inputs = [self.wakeup]
+        if sys.stdin.isatty():
+            # Don't steal log lines when reading from a pipe
+            inputs.append(sys.stdin)
+
+        timeout = self.metrics.time_to_next_window()
+        readable, _, _ = select.select(inputs, [], [], timeout)
+
+        if self.wakeup in readable:
+            self.wakeup.clear()
+        if sys.stdin in readable:
+            self.display.handle_input()
+        if self._resized:
+            self._resized = False
+            self.display.resize()
+
+    def run_headless(self, address):
+        """
+        Run without the curses UI, and serve the metrics over HTTP.
+
+        Params:
+            address (str): The address for the HTTP server, host:port.
+        """
+        self.start_time = time.time()
+        self._stream_thread.start()
+
+        self.logger.info('Starting stream monitor')
+        server = self._start_server(address)
+        try:
+            while True:
+                self._export(server.exporter)
+                time.sleep(self.metrics.time_to_next_window())
+        finally:
+            server.stop()
+
+    def _start_server(self, address):
+        server = MetricsServer(address, MetricsExporter(self.metrics))
+        server.start()
+        self.logger.info('Serving metrics on http://%s/metrics',
+                         server.address)
+        return server
+
+    def _export(self, exporter):
+        self.metrics.flush()
+        exporter.update()
+
+    def run_async(self, headless_address=None):
+        """
+        The same as run_forever(), but everything runs on a single asyncio
+        event loop. The sources are read concurrently as data arrives and the
+        metrics are only ever touched from one thread.
+
+        Params:
+            headless_address (str): If set, run without the curses UI and
+                serve the metrics over HTTP on this address.
+        """
+        self.start_time = time.time()
+
+        self.logger.info('Starting stream monitor')
+        loop = asyncio.get_event_loop()
+        if headless_address:
+            server = self._start_server(headless_address)
+            try:
+                tasks = [self._run_exporter(server.exporter)]
+                loop.run_until_complete(
+                    asyncio.gather(*(tasks + self._sources())))
+            finally:
+                server.stop()
+            return
+
+        with self.display.curses_session():
+            if sys.stdin.isatty():
+                loop.add_reader(sys.stdin, self.display.handle_input)
+            loop.add_signal_handler(
+                signal.SIGWINCH, self._on_resize, signal.SIGWINCH, None)
+
+            tasks = [self._render()] + self._sources()
+            loop.run_until_complete(asyncio.gather(*tasks))
+
+    async def _render(self):
+        """
+        Redraw the UI at each window boundary, or when there's something new.
+        """
+        while True:
+            self.metrics.flush()
+            self.display.draw()
+
+            timeout = self.metrics.time_to_next_window()
+            if await wait_readable(self.wakeup, timeout):
+                self.wakeup.clear()
+            if self._resized:
+                self._resized = False
+                self.display.resize()
+
+    async def _run_exporter(self, exporter):
+        """
+        Update the exported metrics at each window boundary.
+        """
+        while True:
+            self._export(exporter)
+            await asyncio.sleep(self.metrics.time_to_next_window())
+
+    def _sources(self):
+        """
+        The coroutines that feed data into the metrics in run_async().
+        """
+        return [self._follow(self.reader)]
+
+    async def _follow(self, reader, source=None, wait=None, seek_end=True):
+        """
+        The asyncio version of the stream thread, for a single reader.
+
+        Params:
+            reader (ChunkedLineReader or FileFollower): The log to read.
+            source (str): Tags the points with the log that they came from.
+            wait (coroutine function): Waits for more data, see aio.follow().
+            seek_end (bool): Skip over the existing contents of the log.
+        """
+        if seek_end:
+            reader.seek_end()
+
+        if not self.pipeline:
+            async def on_chunk(chunk):
+                self._process_lines(self._read_lines(reader, chunk), source)
+
+            await follow(reader, on_chunk, wait=wait)
+            return
+
+        # Keep the chunks for this reader in order, but let several of them
+        # be parsed at once by the worker processes
+        pending = deque()
+
+        async def add_summary():
+            self._add_summary(await pending.popleft(), source)
+            self._notify()
+
+        async def on_chunk(chunk):
+            future = self.pipeline.executor.submit(
+                summarize_chunk, chunk, *self._sample_chunk(chunk))
+            pending.append(asyncio.wrap_future(future))
+            while pending and (len(pending) >= self.pipeline.max_pending or
+                               pending[0].done()):
+                await add_summary()
+
+        async def on_idle():
+            while pending:
+                await add_summary()
+
+        await follow(reader, on_chunk, on_idle, wait)
+
+    def _on_resize(self, signum, frame):
+        self._resized = True
+        self.wakeup.set()
+
+    def _notify(self):
+        """
+        Let the UI loop know that new data has arrived, throttled so a busy
+        log file doesn't cause a redraw for every batch of lines.
+        """
+        now = time.time()
+        if now - self._last_notify >= 1 / self.max_fps:
+            self._last_notify = now
+            self.wakeup.set()
 
     def _run_stream_thread(self):
         """
         Spin-off a thread to watch the log file for new lines.
         """
 
-        if self.log_file.seekable():
-            # Files are seekable, stdin streams aren't
-            self.log_file.seek(0, os.SEEK_END)
+        self.reader.seek_end()
+
+        if self.pipeline:
+            self._run_pipeline()
 
         while True:
-            try:
-                line = self.log_file.readline()
-                if line:
-                    data = self.http_parser.parse(line)
-                    self.metrics.add_point(data)
-                else:
-                    # At the end of the file, wait for more data
-                    time.sleep(0.1)
-            except Exception as e:
-                # The line contained invalid or corrupt data
-                # self.logger.error(e)
-                self.metrics.add_error()
-
-
-def main():
+            lines = self._read_lines(self.reader)
+            if lines:
+                self._process_lines(lines)
+            else:
+                # At the end of the file, wait for more data
+                self.reader.wait()
+
+    def _read_lines(self, reader, chunk=None):
+        """
+        Read the next chunk, or decode one that's already been read, and
+        record the time in the pipeline stats.
+        """
+        start = time.perf_counter()
+        if chunk is None:
+            chunk = reader.read_chunk()
+            if chunk is None:
+                return []
+        lines = reader.decode(chunk)
+        self.stats.add('read', time.perf_counter() - start, len(chunk))
+        return lines
+
+    def _run_pipeline(self):
+        """
+        Same as the stream thread, but the chunks are parsed by the pool of
+        worker processes.
+        """
+        while True:
+            start = time.perf_counter()
+            chunk = self.reader.read_chunk()
+            if chunk is not None:
+                self.stats.add('read', time.perf_counter() - start,
+                               len(chunk))
+                summaries = self.pipeline.submit(
+                    chunk, *self._sample_chunk(chunk))
+            else:
+                summaries = self.pipeline.drain()
+
+            for summary in summaries:
+                self._add_summary(summary)
+            if summaries:
+                self._notify()
+
+            if chunk is None:
+                # At the end of the file, wait for more data
+                self.reader.wait()
+
+    def _sample_step(self):
+        """
+        With --shed-load, the current 1 in N sampling step.
+        """
+        return 1 if self.shedder is None else self.shedder.step
+
+    def _sample_chunk(self, chunk):
+        """
+        The (step, offset) for a chunk that will be sampled by a worker
+        process. The offset carries over between chunks the same way as it
+        does in LoadShedder.sample(), so the lines that are kept stay evenly
+        spaced.
+        """
+        step = self._sample_step()
+        if step == 1:
+            return 1, 0
+        # The chunk doesn't include the trailing newline
+        return step, self.shedder.advance(chunk.count(b'\n') + 1)
+
+    def _check_backlog(self):
+        """
+        With --shed-load, adjust the sampling step at most once per interval.
+        This runs after a batch has been added, so the lag is measured from
+        the newest line that was just read and not from the watermark that
+        was left behind while the log was quiet.
+        """
+        shedder = self.shedder
+        if shedder is None or not shedder.due():
+            return
+
+        if shedder.update(*self._backlog()):
+            if shedder.step > 1:
+                _logger.warning('Falling behind the log, sampling 1 in %d '
+                                'lines', shedder.step)
+            else:
+                _logger.info('Caught up with the log, parsing every line')
+
+    def _process_lines(self, lines, source=None):
+        """
+        Parse a batch of lines and add them to the metrics.
+        """
+        step = self._sample_step()
+        start = time.perf_counter()
+        if step > 1:
+            n_lines = len(lines)
+            lines = self.shedder.sample(lines)
+            self.metrics.add_skipped(n_lines - len(lines))
+
+        rejects = []
+        points, _ = self.http_parser.parse_batch(lines, rejects)
+        parsed = time.perf_counter()
+        try:
+            self.metrics.add_points(points, source, step)
+        except Exception as e:
+            # Don't let one bad batch kill the reader thread
+            _logger.error('Unable to add %d lines to the metrics: %s',
+                          len(points), e)
+            self.metrics.add_error(len(points))
+        if rejects:
+            # The lines contained invalid or corrupt data
+            self.metrics.add_rejects(rejects)
+
+        self.stats.add('parse', parsed - start, len(lines))
+        self.stats.add('aggregate', time.perf_counter() - parsed, len(points))
+        self._check_backlog()
+        self._notify()
+
+    def _add_summary(self, summary, source=None):
+        """
+        Add a batch that was summarized by a worker process to the metrics.
+        """
+        start = time.perf_counter()
+        try:
+            self.metrics.add_summary(summary, source)
+        except Exception as e:
+            _logger.error('Unable to add %d lines to the metrics: %s',
+                          summary.n_points, e)
+            self.metrics.add_error(summary.n_points)
+        self.stats.add('parse', summary.parse_time,
+                       summary.n_lines - summary.n_skipped)
+        self.stats.add('aggregate', time.perf_counter() - start,
+                       summary.n_points)
+        self._check_backlog()
+
+
+class MultiFileAkita(Akita):
+    """
+    Watches every log file that matches a list of paths or glob patterns,
+    including files that are created later, e.g. one log per virtual host.
+
+    Everything runs on the asyncio event loop. Instead of a thread or an
+    inotify descriptor for each file, the directories are watched with a
+    single descriptor and only the files that changed are woken up.
+    """
+
+    # How long an idle file waits before checking for changes anyway, in
+    # case an event was missed. Without inotify, files are polled instead.
+    idle_timeout = 5.0
+
+    def __init__(self, patterns, metrics, chunk_size=1024 * 1024, workers=0,
+                 backfill=False, log_format=None, shedder=None):
+        super().__init__(None, metrics, chunk_size, workers,
+                         backfill=backfill, log_format=log_format,
+                         shedder=shedder)
+
+        self.backfill = backfill
+        self.log_files = LogFileSet(patterns, chunk_size=chunk_size)
+        self._changed = {}
+
+    @property
+    def source_name(self):
+        return '{} ({} files)'.format(
+            self.log_files.name, len(self.log_files.followers))
+
+    def run_forever(self):
+        self.run_async()
+
+    def run_headless(self, address):
+        self.run_async(headless_address=address)
+
+    def _bytes_behind(self):
+        counts = [follower.bytes_behind()
+                  for follower in self.log_files.followers.values()]
+        counts = [count for count in counts if count is not None]
+        return sum(counts) if counts else None
+
+    def _sources(self):
+        followers = self.log_files.discover(backfill=self.backfill)
+        tasks = [self._follow_file(f, seek_end=True) for f in followers]
+        return [self._watch_directories()] + tasks
+
+    async def _follow_file(self, follower, seek_end):
+        self._changed.setdefault(follower.path, asyncio.Event())
+        await self._follow(follower, follower.path, seek_end=seek_end,
+                           wait=lambda: self._wait_for_change(follower))
+
+    async def _wait_for_change(self, follower):
+        if self.log_files.fileno() is None:
+            await asyncio.sleep(follower.poll_interval)
+            return
+
+        event = self._changed[follower.path]
+        try:
+            await asyncio.wait_for(event.wait(), self.idle_timeout)
+        except asyncio.TimeoutError:
+            pass
+        event.clear()
+
+    async def _watch_directories(self):
+        """
+        Wake up the followers for the files that changed, and start
+        following any new files that match the patterns.
+        """
+        fd = self.log_files.fileno()
+        while True:
+            if fd is None:
+                await asyncio.sleep(self.idle_timeout)
+                unknown = True
+            else:
+                await wait_readable(fd)
+                changed, unknown = self.log_files.read_changes()
+                for follower in changed:
+                    event = self._changed.get(follower.path)
+                    if event is not None:
+                        event.set()
+
+            if unknown:
+                # New files are read from the beginning
+                for follower in self.log_files.discover():
+                    self.logger.info('Watching new log file %s',
+                                     follower.path)
+                    asyncio.ensure_future(
+                        self._follow_file(follower, seek_end=False))
+
+
+class Collector(Akita):
+    """
+    Displays the combined metrics that are published by many Akita agents,
+    instead of watching a log file directly.
+    """
+
+    def __init__(self, address, metrics):
+        super().__init__(None, metrics)
+
+        self.address = address
+        self.receiver = DeltaReceiver(address, self.add_delta)
+
+        # The most recent sequence number received from each agent
+        self.agents = {}
+        self.lost_deltas = 0
+
+    @property
+    def source_name(self):
+        return '{} ({} agents)'.format(self.address, len(self.agents))
+
+    def add_delta(self, delta):
+        name, seq = delta['agent'], delta['seq']
+        if name not in self.agents:
+            self.logger.info('New agent connected: %s', name)
+        elif seq > self.agents[name] + 1:
+            # Datagrams can be dropped, or the agent could have restarted
+            self.lost_deltas += seq - self.agents[name] - 1
+        self.agents[name] = seq
+
+        self._add_summary(delta_to_summary(delta))
+        self._notify()
+
+    def _bytes_behind(self):
+        return None
+
+    def _sources(self):
+        return [receive(self.receiver)]
+
+    def _run_stream_thread(self):
+        """
+        Spin-off a thread to receive deltas from the agents.
+        """
+        while True:
+            self.receiver.poll()
+
+
+def run_agent(argv):
+    args = parse_agent_cmdline(argv)
+    logging.basicConfig(format='%(asctime)s %(message)s')
+
+    try:
+        agent = Agent(args.logfile, args.address, interval=args.interval,
+                      name=args.name, event_time=args.event_time,
+                      chunk_size=args.chunk_size, max_tags=args.max_sections,
+                      log_format=args.log_format)
+    except ValueError as e:
+        sys.exit('akita agent: error: {}'.format(e))
+    try:
+        agent.run_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+def run_collector(argv):
+    args = parse_collect_cmdline(argv)
+    metrics = MetricsAggregator(
+        alert_threshold=args.alert_threshold,
+        alert_window=args.alert_window,
+        error_threshold=args.error_threshold / 100,
+        error_window=args.error_window,
+        event_time=True,
+        allowed_lateness=args.allowed_lateness,
+        top_k=args.top_k,
+        follow_clock=True)
+
+    collector = Collector(args.address, metrics)
+    if args.term_stats:
+        collector.display.output_meter = OutputMeter()
+    try:
+        if args.headless:
+            logging.basicConfig(format='%(asctime)s %(message)s')
+            if args.asyncio:
+                collector.run_async(headless_address=args.http)
+            else:
+                collector.run_headless(args.http)
+        elif args.asyncio:
+            collector.run_async()
+        else:
+            collector.run_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+def main(argv=None):
     """
     Program entry point
     """
-    args = parse_cmdline()
+    argv = sys.argv[1:] if argv is None else argv
+    if argv and argv[0] == 'agent':
+        return run_agent(argv[1:])
+    elif argv and argv[0] == 'collect':
+        return run_collector(argv[1:])
+    elif argv and argv[0] == 'bench':
+        # Only needed for development, so it's loaded on demand
+        from .bench import main as run_bench
+        return run_bench(argv[1:])
+
+    args = parse_cmdline(argv)
     metrics = MetricsAggregator(
         alert_threshold=args.alert_threshold,
-        alert_window=args.alert_window)
+        alert_window=args.alert_window,
+        error_threshold=args.error_threshold / 100,
+        error_window=args.error_window,
+        event_time=args.event_time or args.replay or args.backfill,
+        allowed_lateness=args.allowed_lateness,
+        top_k=args.top_k,
+        sources=args.logfile is None,
+        percentiles=args.percentiles)
 
-    akita = Akita(args.logfile, metrics)
     try:
-        akita.run_forever()
+        # Compile the format up front so mistakes are reported right away
+        create_parser(metrics.fields, args.log_format)
+    except ValueError as e:
+        sys.exit('akita: error: --log-format: {}'.format(e))
+
+    if args.replay:
+        # Alerts are included in the report, don't print them to stderr
+        logging.getLogger('akita').addHandler(logging.NullHandler())
+
+        replay = Replay(args.logfile, metrics, chunk_size=args.chunk_size,
+                        workers=args.workers, log_format=args.log_format)
+        report = replay.run()
+        print(format_report(report, args.output))
+        return
+
+    shedder = None
+    if args.shed_load:
+        shedder = LoadShedder(max_lag=args.max_lag,
+                              max_backlog=args.max_backlog * 1024 * 1024)
+
+    if args.logfile is None:
+        akita = MultiFileAkita(
+            args.logfiles, metrics, chunk_size=args.chunk_size,
+            workers=args.workers, backfill=args.backfill,
+            log_format=args.log_format, shedder=shedder)
+    else:
+        akita = Akita(args.logfile, metrics, chunk_size=args.chunk_size,
+                      workers=args.workers, backfill=args.backfill,
+                      log_format=args.log_format, shedder=shedder)
+    if args.term_stats:
+        akita.display.output_meter = OutputMeter()
+    akita.display.show_stats = args.stats
+    try:
+        if args.headless:
+            logging.basicConfig(format='%(asctime)s %(message)s')
+            if args.asyncio:
+                akita.run_async(headless_address=args.http)
+            else:
+                akita.run_headless(args.http)
+        elif args.asyncio:
+            akita.run_async()
+        else:
+            akita.run_forever()
     except KeyboardInterrupt:
         pass
+
+    if args.stats:
+        # Include the latest batches that weren't in the last interval
+        akita.stats.interval = 0
+        akita.update_stats()
+        print(format_stats(akita.stats), file=sys.stderr)
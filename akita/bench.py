@@ -0,0 +1,549 @@
+"""
+A synthetic log generator and a benchmark runner, so performance can be
+measured the same way on any machine and compared between versions.
+
+Usage:
+    $ akita bench generate --rate 50 --realtime | akita -
+    $ akita bench run --save results.json
+    $ akita bench run --compare results.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import platform
+import tempfile
+from bisect import bisect
+from functools import partial
+from itertools import accumulate
+from datetime import datetime, timezone, timedelta
+
+from .__version__ import __version__
+from .parser import HTTPLogParser
+from .logformat import LogFormatParser
+from .jsonlog import JSONLogParser
+from .replay import Replay
+from .akita import MetricsAggregator
+from . import metrics as akita_metrics
+
+
+# The first few URL sections have real names, the rest are numbered
+SECTIONS = (
+    'api', 'static', 'images', 'blog', 'search', 'category', 'item', 'user',
+    'cart', 'checkout', 'login', 'admin', 'docs', 'assets', 'feed', 'help',
+)
+
+AGENTS = (
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, '
+    'like Gecko) Chrome/80.0.3987.149 Safari/537.36',
+    'Mozilla/5.0 (Macintosh; Intel Mac OS X 10.15; rv:74.0) Gecko/20100101 '
+    'Firefox/74.0',
+    'curl/7.58.0',
+    'Googlebot/2.1 (+http://www.google.com/bot.html)',
+)
+
+DEFAULT_STATUS_MIX = {200: 90, 304: 4, 404: 4, 500: 2}
+
+# The fraction of truncated lines in the malformed benchmarks
+BAD_FRACTION = 0.5
+
+
+def parse_status_mix(text):
+    """
+    Parse a status mix like "200=90,404=5,500=5" into a dict of weights.
+    """
+    mix = {}
+    for item in text.split(','):
+        code, _, weight = item.partition('=')
+        mix[int(code)] = float(weight or 1)
+    return mix
+
+
+class LogGenerator:
+    """
+    Generates deterministic HTTP access log traffic. The same settings and
+    seed always produce the same lines, so benchmark runs are comparable.
+
+    Lines are generated one second of log time at a time. URL sections are
+    picked with a Zipf-like distribution, so a few of them get most of the
+    traffic like they would on a real site.
+    """
+
+    def __init__(self, rate=100, n_paths=50, status_mix=None, malformed=0.0,
+                 burst_every=0, burst_length=10, burst_factor=10,
+                 start=1522160127, log_format='combined', seed=0):
+        """
+        Params:
+            rate (int): The number of lines for each second of log time.
+            n_paths (int): The number of distinct URL sections.
+            status_mix (dict): The relative weight of each status code.
+            malformed (float): The fraction of lines that are truncated.
+            burst_every (int): Start a burst of traffic every N seconds, or
+                never if this is zero.
+            burst_length (int): How long each burst lasts, in seconds.
+            burst_factor (float): The rate is multiplied by this during
+                a burst.
+            start (float): The timestamp of the first line.
+            log_format (str): "combined" or "json".
+            seed (int): The seed for the random number generator.
+        """
+        if log_format not in ('combined', 'json'):
+            raise ValueError('Unknown log format: {}'.format(log_format))
+
+        self.rate = rate
+        self.status_mix = status_mix or DEFAULT_STATUS_MIX
+        self.malformed = malformed
+        self.burst_every = burst_every
+        self.burst_length = burst_length
+        self.burst_factor = burst_factor
+        self.start = start
+        self.log_format = log_format
+        self.random = random.Random(seed)
+
+        self.sections = [
+            SECTIONS[i] if i < len(SECTIONS) else 's{}'.format(i)
+            for i in range(n_paths)]
+        self.weights = list(accumulate(1 / (i + 1) for i in range(n_paths)))
+
+        # Sorted so the output doesn't depend on the order of the dict
+        self.statuses = sorted(self.status_mix)
+        self.status_weights = list(accumulate(
+            self.status_mix[code] for code in self.statuses))
+        self.zone = timezone(timedelta(hours=-4))
+        self.second = 0
+
+    def rate_at(self, second):
+        """
+        The number of lines in the given second, counting from the start.
+        """
+        if (self.burst_every and second >= self.burst_every and
+                second % self.burst_every < self.burst_length):
+            return int(self.rate * self.burst_factor)
+        return self.rate
+
+    def _choose(self, items, cum_weights, k):
+        """
+        Pick ``k`` of the items with replacement, given their cumulative
+        weights. This is random.choices(), which needs python 3.6.
+        """
+        rand, total = self.random.random, cum_weights[-1]
+        hi = len(items) - 1
+        return [items[bisect(cum_weights, rand() * total, 0, hi)]
+                for _ in range(k)]
+
+    def next_second(self):
+        """
+        Generate the lines for the next second of log time.
+        """
+        timestamp = self.start + self.second
+        n_lines = self.rate_at(self.second)
+        self.second += 1
+
+        choose = self._choose
+        sections = choose(self.sections, self.weights, n_lines)
+        statuses = choose(self.statuses, self.status_weights, n_lines)
+        choice = self.random.choice
+        agents = [choice(AGENTS) for _ in range(n_lines)]
+        randrange = self.random.randrange
+
+        if self.log_format == 'json':
+            when = datetime.fromtimestamp(timestamp, self.zone).isoformat()
+            lines = [json.dumps({
+                'time': when,
+                'remote_addr': '10.0.{}.{}'.format(randrange(256),
+                                                   randrange(256)),
+                'method': 'GET',
+                'path': '/{}/{}'.format(section, randrange(10000)),
+                'status': status,
+                'size': randrange(100000),
+                'user_agent': agent,
+            }) for section, status, agent in zip(sections, statuses, agents)]
+        else:
+            when = datetime.fromtimestamp(timestamp, self.zone).strftime(
+                '%d/%b/%Y:%H:%M:%S %z')
+            lines = [
+                '10.0.{}.{} - - [{}] "GET /{}/{} HTTP/1.1" {} {} "-" "{}"'
+                .format(randrange(256), randrange(256), when, section,
+                        randrange(10000), status, randrange(100000), agent)
+                for section, status, agent in zip(sections, statuses, agents)]
+
+        if self.malformed:
+            for i in range(n_lines):
+                if self.random.random() < self.malformed:
+                    lines[i] = lines[i][:self.random.randrange(len(lines[i]))]
+        return lines
+
+    def take(self, n_lines):
+        """
+        Return the next ``n_lines`` lines.
+        """
+        lines = []
+        while len(lines) < n_lines:
+            lines.extend(self.next_second())
+        return lines[:n_lines]
+
+
+def measure(setup, n_ops, repeat=3):
+    """
+    Time the function returned by ``setup()``, keeping the fastest of
+    ``repeat`` runs. The setup isn't included in the time.
+    """
+    best = None
+    for _ in range(repeat):
+        func = setup()
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return {
+        'ops': n_ops,
+        'seconds': best,
+        'ops_per_sec': n_ops / best if best else None,
+    }
+
+
+def _loop(func, items):
+    def run():
+        for item in items:
+            func(item)
+    return run
+
+
+def _parse_benchmarks(lines, json_lines, suffix=''):
+    fields = ('subpath', 'status', 'timestamp')
+
+    def parse():
+        for line in lines:
+            try:
+                HTTPLogParser.parse(line)
+            except Exception:
+                pass
+
+    def parse_batch(parser, lines):
+        # Classify the rejected lines, the same as the app does
+        return lambda: lambda: parser(fields).parse_batch(lines, [])
+
+    if not suffix:
+        yield 'parse/HTTPLogParser.parse', lambda: parse
+    yield ('parse/HTTPLogParser.parse_batch' + suffix,
+           parse_batch(HTTPLogParser, lines))
+    yield ('parse/LogFormatParser.parse_batch' + suffix,
+           parse_batch(partial(LogFormatParser, 'combined'), lines))
+    yield ('parse/JSONLogParser.parse_batch' + suffix,
+           parse_batch(partial(JSONLogParser, 'json'), json_lines))
+
+
+def _metric_benchmarks(points):
+    timestamps = [p['timestamp'] for p in points]
+    tags = [[p['subpath']] for p in points]
+    statuses = [p['status'] for p in points]
+    sizes = [float(p['size']) for p in points]
+
+    def counter(metric_class, **kwargs):
+        def setup():
+            metric = metric_class(**kwargs)
+            return _loop(lambda t: metric.add_point(timestamp=t), timestamps)
+        return setup
+
+    def tagged(metric_class):
+        def setup():
+            metric = metric_class()
+            add_point = metric.add_point
+            return lambda: [add_point(tag, timestamp=t)
+                            for tag, t in zip(tags, timestamps)]
+        return setup
+
+    def valued(metric_class, values, **kwargs):
+        def setup():
+            metric = metric_class(**kwargs)
+            add_point = metric.add_point
+            return lambda: [add_point(value, t)
+                            for value, t in zip(values, timestamps)]
+        return setup
+
+    yield 'metrics/CounterMetric', counter(akita_metrics.CounterMetric)
+    yield 'metrics/AlertMetric', counter(akita_metrics.AlertMetric)
+    yield ('metrics/TaggedCounterMetric',
+           tagged(akita_metrics.TaggedCounterMetric))
+    yield ('metrics/TopKCounterMetric',
+           tagged(akita_metrics.TopKCounterMetric))
+    yield ('metrics/QuantileMetric',
+           valued(akita_metrics.QuantileMetric, sizes, max_value=1e12))
+    yield ('metrics/StatusMetric',
+           valued(akita_metrics.StatusMetric, statuses))
+    yield ('metrics/ErrorRateAlertMetric',
+           valued(akita_metrics.ErrorRateAlertMetric, statuses))
+
+
+def _aggregator(**kwargs):
+    return MetricsAggregator(alert_threshold=10, alert_window=120,
+                             event_time=True, **kwargs)
+
+
+def _aggregator_benchmarks(points, n_flushes=1000):
+    def add_point():
+        metrics = _aggregator()
+        return _loop(metrics.add_point, points)
+
+    def add_points():
+        metrics = _aggregator(percentiles=True)
+        batches = [points[i:i + 1000] for i in range(0, len(points), 1000)]
+        return _loop(metrics.add_points, batches)
+
+    def flush():
+        # Only the wall clock flushes the metrics in processing time mode
+        metrics = MetricsAggregator(alert_threshold=10, alert_window=120,
+                                    percentiles=True)
+        metrics.add_points(points)
+        return lambda: [metrics.flush() for _ in range(n_flushes)]
+
+    yield 'aggregator/add_point', add_point, len(points)
+    yield 'aggregator/add_points', add_points, len(points)
+    yield 'aggregator/flush', flush, n_flushes
+
+
+def _ingest_benchmarks(path, json_path, bad_path, workers):
+    def replay(path, **kwargs):
+        def run():
+            with open(path, 'rb') as fp:
+                Replay(fp, _aggregator(), **kwargs).run()
+        return lambda: run
+
+    yield 'ingest/replay', replay(path)
+    yield 'ingest/replay-json', replay(json_path, log_format='json')
+    yield 'ingest/replay-malformed', replay(bad_path)
+    if workers:
+        yield ('ingest/replay-workers-{}'.format(workers),
+               replay(path, workers=workers))
+
+
+def run_benchmarks(n_lines=100000, repeat=3, workers=0, seed=0,
+                   malformed=0.01, only=None, progress=None):
+    """
+    Run all of the benchmarks and return the results as a dict.
+
+    Params:
+        n_lines (int): The number of log lines to generate.
+        repeat (int): How many times to run each benchmark, the fastest
+            run is kept.
+        workers (int): Also time the replay with this many worker processes.
+        seed (int): The seed for the log generator.
+        malformed (float): The fraction of generated lines that are corrupt.
+        only (str): Only run the benchmarks whose names contain this.
+        progress (function): Called with the name and the result of each
+            benchmark as it finishes.
+    """
+    generator = LogGenerator(rate=1000, malformed=malformed, seed=seed)
+    lines = generator.take(n_lines)
+    json_lines = LogGenerator(rate=1000, malformed=malformed, seed=seed,
+                              log_format='json').take(n_lines)
+    points, _ = HTTPLogParser(
+        ('subpath', 'status', 'timestamp', 'size', 'request_time')
+    ).parse_batch(lines)
+
+    # The same traffic with half of the lines truncated, rejecting a corrupt
+    # line should never cost more than parsing a good one
+    bad_lines = LogGenerator(rate=1000, malformed=BAD_FRACTION,
+                             seed=seed).take(n_lines)
+    bad_json_lines = LogGenerator(rate=1000, malformed=BAD_FRACTION,
+                                  seed=seed, log_format='json').take(n_lines)
+
+    benchmarks = []
+    for name, setup in _parse_benchmarks(lines, json_lines):
+        benchmarks.append((name, setup, n_lines))
+    for name, setup in _parse_benchmarks(bad_lines, bad_json_lines,
+                                         '-malformed'):
+        benchmarks.append((name, setup, n_lines))
+    for name, setup in _metric_benchmarks(points):
+        benchmarks.append((name, setup, len(points)))
+    benchmarks.extend(_aggregator_benchmarks(points))
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'access.log')
+        json_path = os.path.join(directory, 'access.json')
+        bad_path = os.path.join(directory, 'malformed.log')
+        for filename, data in ((path, lines), (json_path, json_lines),
+                               (bad_path, bad_lines)):
+            with open(filename, 'w') as fp:
+                fp.write('\n'.join(data) + '\n')
+
+        for name, setup in _ingest_benchmarks(path, json_path, bad_path,
+                                              workers):
+            benchmarks.append((name, setup, n_lines))
+
+        for name, setup, n_ops in benchmarks:
+            if only and only not in name:
+                continue
+            results[name] = measure(setup, n_ops, repeat)
+            if progress:
+                progress(name, results[name])
+
+    return {
+        'version': __version__,
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'time': time.time(),
+        'settings': {
+            'lines': n_lines, 'repeat': repeat, 'workers': workers,
+            'seed': seed, 'malformed': malformed,
+        },
+        'results': results,
+    }
+
+
+def compare(results, baseline, tolerance=0.1):
+    """
+    Compare the results with a previous run. Returns a list of
+    (name, old ops/s, new ops/s, change) and the names of the benchmarks
+    that are slower by more than the tolerance.
+    """
+    rows, regressions = [], []
+    for name, result in results['results'].items():
+        old = baseline['results'].get(name)
+        if not old or not old['ops_per_sec'] or not result['ops_per_sec']:
+            continue
+        change = result['ops_per_sec'] / old['ops_per_sec'] - 1
+        rows.append((name, old['ops_per_sec'], result['ops_per_sec'], change))
+        if change < -tolerance:
+            regressions.append(name)
+    return rows, regressions
+
+
+def format_result(name, result):
+    return '{:<44} {:>14,.0f} ops/s {:>10.1f} ns/op'.format(
+        name, result['ops_per_sec'], 1e9 / result['ops_per_sec'])
+
+
+def parse_bench_cmdline(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='akita bench',
+        description='Generate synthetic logs and run the benchmarks')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    generate = subparsers.add_parser(
+        'generate', help='Write synthetic log lines to stdout')
+    generate.add_argument(
+        '--rate', type=int, default=100,
+        help='The number of lines per second of log time')
+    generate.add_argument(
+        '--seconds', type=int, default=None,
+        help='Stop after this many seconds of log time, default forever')
+    generate.add_argument(
+        '--paths', type=int, default=50,
+        help='The number of distinct URL sections')
+    generate.add_argument(
+        '--status-mix', type=parse_status_mix, default=None,
+        metavar='MIX', help='The relative weight of each status code, '
+                            'e.g. 200=90,404=5,500=5')
+    generate.add_argument(
+        '--malformed', type=float, default=0.0,
+        help='The fraction of lines that are truncated')
+    generate.add_argument(
+        '--burst-every', type=int, default=0, metavar='SECONDS',
+        help='Start a burst of traffic every N seconds')
+    generate.add_argument(
+        '--burst-length', type=int, default=10, metavar='SECONDS',
+        help='How long each burst lasts')
+    generate.add_argument(
+        '--burst-factor', type=float, default=10,
+        help='The rate is multiplied by this during a burst')
+    generate.add_argument(
+        '--format', choices=['combined', 'json'], default='combined',
+        help='The log format to write')
+    generate.add_argument(
+        '--realtime', action='store_true',
+        help='Write each second of lines in real time, using the current '
+             'time for the timestamps')
+    generate.add_argument('--seed', type=int, default=0)
+
+    run = subparsers.add_parser('run', help='Run the benchmarks')
+    run.add_argument(
+        '--lines', type=int, default=100000,
+        help='The number of log lines to generate')
+    run.add_argument(
+        '--repeat', type=int, default=3,
+        help='Run each benchmark this many times and keep the fastest')
+    run.add_argument(
+        '--workers', type=int, default=0,
+        help='Also time the replay with this many worker processes')
+    run.add_argument(
+        '--only', default=None, metavar='NAME',
+        help='Only run the benchmarks whose names contain NAME')
+    run.add_argument(
+        '--save', default=None, metavar='FILE',
+        help='Write the results to a JSON file')
+    run.add_argument(
+        '--compare', default=None, metavar='FILE',
+        help='Compare the results with a file written by --save, exits with '
+             'status 1 if anything is slower than the tolerance')
+    run.add_argument(
+        '--tolerance', type=float, default=10.0,
+        help='The slowdown allowed by --compare, in percent')
+    run.add_argument('--seed', type=int, default=0)
+    return parser.parse_args(argv)
+
+
+def generate_logs(args, stream=sys.stdout):
+    start = time.time() if args.realtime else 1522160127
+    generator = LogGenerator(
+        rate=args.rate, n_paths=args.paths, status_mix=args.status_mix,
+        malformed=args.malformed, burst_every=args.burst_every,
+        burst_length=args.burst_length, burst_factor=args.burst_factor,
+        start=int(start), log_format=args.format, seed=args.seed)
+
+    while args.seconds is None or generator.second < args.seconds:
+        lines = generator.next_second()
+        if args.realtime:
+            # Wait until the second that the lines are stamped with
+            time.sleep(max(0, generator.start + generator.second - 1 -
+                           time.time()))
+        stream.write('\n'.join(lines) + '\n')
+        stream.flush()
+
+
+def main(argv=None):
+    args = parse_bench_cmdline(argv)
+
+    # Keep the alerts from the generated traffic out of the output
+    logging.getLogger('akita').addHandler(logging.NullHandler())
+    if args.command == 'generate':
+        try:
+            generate_logs(args)
+        except (KeyboardInterrupt, BrokenPipeError):
+            pass
+        return
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as fp:
+            baseline = json.load(fp)
+
+    results = run_benchmarks(
+        n_lines=args.lines, repeat=args.repeat, workers=args.workers,
+        seed=args.seed, only=args.only,
+        progress=lambda name, result: print(format_result(name, result)))
+
+    if args.save:
+        with open(args.save, 'w') as fp:
+            json.dump(results, fp, indent=2)
+
+    if baseline:
+        rows, regressions = compare(results, baseline, args.tolerance / 100)
+        print('\nCompared with akita {} on python {}'.format(
+            baseline['version'], baseline['python']))
+        for name, old, new, change in rows:
+            flag = '  <- slower' if name in regressions else ''
+            print('{:<44} {:>14,.0f} -> {:>14,.0f} {:>+7.1%}{}'.format(
+                name, old, new, change, flag))
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,5 @@
 import os
+import sys
 import time
 import curses
 import logging
@@ -11,6 +12,47 @@ from .__version__ import __version__
 _logger = logging.getLogger('akita')
 
 
+def format_duration(seconds):
+    """
+    Format a duration in seconds with a unit that keeps it short.
+    """
+    if seconds is None:
+        return '-'
+    elif seconds < 1e-3:
+        return '{:.0f}us'.format(seconds * 1e6)
+    elif seconds < 1:
+        return '{:.0f}ms'.format(seconds * 1e3)
+    return '{:.2f}s'.format(seconds)
+
+
+def format_window(seconds):
+    """
+    Format a length of time in seconds like 10s, 5m or 7d, rounded down
+    to the largest unit.
+    """
+    for unit, size in (('d', 86400), ('h', 3600), ('m', 60)):
+        if seconds >= size:
+            return '{}{}'.format(seconds // size, unit)
+    return '{}s'.format(seconds)
+
+
+def format_bytes(size):
+    """
+    Format a number of bytes as a short human readable string.
+    """
+    if size is None:
+        return '-'
+    for unit in ('B', 'K', 'M', 'G'):
+        if size < 1024:
+            break
+        size /= 1024
+    else:
+        unit = 'T'
+    if unit == 'B':
+        return '{:.0f}B'.format(size)
+    return '{:.1f}{}'.format(size, unit)
+
+
 class Display:
     """
     This class provides an interface for drawing text to the terminal and
@@ -40,15 +82,32 @@ class Display:
 
     # Minimum screen size that will be attempted to render
     MIN_HEIGHT = 30
-    MIN_WIDTH = 40
+    MIN_WIDTH = 80
 
-    def __init__(self, akita):
+    def __init__(self, akita, output_meter=None):
         self.akita = akita
+        self.output_meter = output_meter
+
+        # Show the pipeline stats panel, toggled with the "p" key
+        self.show_stats = False
+
+        # Show a sample of the lines that failed to parse in place of the
+        # alerts, toggled with the "e" key
+        self.show_errors = False
+
+        # The resolution of the traffic chart, 0 is the full resolution and
+        # higher levels are the coarser rollups. Cycled with the "z" key.
+        self.zoom = 0
 
         self.stdscr = None
         self.n_rows = None
         self.n_cols = None
 
+        # The curses window for each panel, and the state that was last
+        # drawn in it. Both are rebuilt when the terminal is resized.
+        self.panels = []
+        self.drawn = {}
+
     @contextmanager
     def curses_session(self):
         """
@@ -77,6 +136,10 @@ class Display:
             # will be returned
             stdscr.keypad(1)
 
+            # Input is only read when select() says that a key is waiting,
+            # so getch() should never block
+            stdscr.nodelay(1)
+
             # Start color, too.  Harmless if the terminal doesn't have color; user
             # can test with has_color() later on.  The try/catch works around a
             # minor bit of over-conscientiousness in the curses module -- the error
@@ -117,6 +180,8 @@ class Display:
                 curses.endwin()
 
             self.stdscr = None
+            self.panels = []
+            self.drawn = {}
 
     @staticmethod
     def add_line(window, text, row=None, col=None, attr=None):
@@ -154,70 +219,216 @@ class Display:
             _logger.warning('add_line raised an exception')
             _logger.exception(str(e))
 
-    def draw(self):
+    def handle_input(self):
+        """
+        Process all of the pending keypresses.
+        """
+        if not self.stdscr:
+            return
+
+        while True:
+            key = self.stdscr.getch()
+            if key == -1:
+                break
+            elif key == curses.KEY_RESIZE:
+                self.resize()
+            elif key == ord('p'):
+                self.show_stats = not self.show_stats
+                # Force the panels to be rebuilt on the next draw
+                self.n_rows = self.n_cols = None
+            elif key == ord('e'):
+                self.show_errors = not self.show_errors
+                self.n_rows = self.n_cols = None
+            elif key == ord('z'):
+                levels = self.akita.metrics.traffic_counter.levels
+                self.zoom = (self.zoom + 1) % (len(levels) + 1)
+
+    def resize(self):
+        """
+        Let curses know that the terminal has changed size.
+        """
         if not self.stdscr:
             return
 
-        self.stdscr.erase()
+        try:
+            n_cols, n_rows = os.get_terminal_size(sys.__stdout__.fileno())
+            curses.resizeterm(n_rows, n_cols)
+        except (OSError, curses.error):
+            _logger.warning('Unable to resize the terminal window')
+
+        # Force the panels to be rebuilt on the next draw
+        self.n_rows = self.n_cols = None
+
+    def draw(self):
+        """
+        Redraw the panels that have changed since the last frame.
+
+        Each panel has a state function that returns everything it displays
+        (usually a metric's version number), and it's only redrawn when that
+        state changes. All of the changes are sent to the terminal at once
+        with a single doupdate().
+        """
+        if not self.stdscr:
+            return
 
+        start = time.perf_counter()
+        if self.stdscr.getmaxyx() != (self.n_rows, self.n_cols):
+            self._layout()
+
+        # Hold the lock so the reader thread can't change the metrics while
+        # they're being drawn, but not while waiting on the terminal
+        with self.akita.metrics.lock:
+            for name, window, state, draw in self.panels:
+                value = state()
+                if name in self.drawn and self.drawn[name] == value:
+                    continue
+                self.drawn[name] = value
+
+                window.erase()
+                draw(window)
+                window.noutrefresh()
+
+        if self.output_meter:
+            self.output_meter.update()
+        curses.doupdate()
+        self.akita.stats.add('draw', time.perf_counter() - start)
+
+    def _layout(self):
+        """
+        Create the windows for all of the panels to fit the terminal.
+        """
         self.n_rows, self.n_cols = self.stdscr.getmaxyx()
+        self.panels = []
+        self.drawn = {}
+
+        # Clear whatever was left over from the previous layout
+        self.stdscr.clear()
+        self.stdscr.noutrefresh()
+
         if self.n_rows < self.MIN_HEIGHT or self.n_cols < self.MIN_WIDTH:
-            self.add_line(self.stdscr, '(enlarge window)')
+            window = curses.newwin(1, self.n_cols, 0, 0)
+            self.add_panel('enlarge', window, lambda: None,
+                           lambda w: self.add_line(w, '(enlarge window)'))
+            return
+
+        metrics = self.akita.metrics
+        records = self.akita.message_queue
+
+        # Share the space to the right of the info box with the sources panel
+        width = self.n_cols - 30
+        if metrics.source_counter is not None:
+            width //= 2
+
+        self.add_panel(
+            'title', curses.newwin(1, self.n_cols, 0, 0),
+            lambda: None, self._draw_title)
+        self.add_panel(
+            'info', curses.newwin(10, 30, 1, 0),
+            self._info_lines, self._draw_info_box)
+        self.add_panel(
+            'most_visited', curses.newwin(10, width, 1, 30),
+            lambda: metrics.subpath_counter.version, self._draw_most_visited)
+        if metrics.source_counter is not None:
+            self.add_panel(
+                'sources', curses.newwin(10, self.n_cols - 30 - width,
+                                         1, 30 + width),
+                lambda: metrics.source_counter.version, self._draw_sources)
+        # The status codes and percentiles panels sit to the right of the
+        # traffic chart
+        width = self.n_cols - 26
+        self.add_panel(
+            'status_codes', curses.newwin(10, 26, 11, width),
+            lambda: (metrics.status_counter.version,
+                     metrics.error_alert.version),
+            self._draw_status_codes)
+        if metrics.percentiles:
+            width -= 30
+            self.add_panel(
+                'percentiles', curses.newwin(10, 30, 11, width),
+                lambda: (metrics.latency_metric.version,
+                         metrics.size_metric.version,
+                         metrics.bytes_counter.version),
+                self._draw_percentiles)
+        self.add_panel(
+            'traffic', curses.newwin(10, width, 11, 0),
+            lambda: (metrics.traffic_counter.version, self.zoom),
+            self._draw_traffic_chart)
+        # The pipeline stats share the bottom row with the alerts
+        width = self.n_cols
+        if self.show_stats:
+            width -= 46
+            self.add_panel(
+                'pipeline', curses.newwin(self.n_rows - 22, 46, 21, width),
+                self.akita.update_stats, self._draw_pipeline)
+        if self.show_errors:
+            self.add_panel(
+                'errors', curses.newwin(self.n_rows - 22, width, 21, 0),
+                lambda: metrics.miss_total, self._draw_errors)
         else:
-            self._draw_title()
-            self._draw_info_box()
-            self._draw_most_visited()
-            self._draw_traffic_chart()
-            self._draw_alerts()
-            self._draw_footer()
-        self.stdscr.touchwin()
-        self.stdscr.refresh()
-
-    def _draw_title(self):
-        window = self.stdscr.derwin(1, self.n_cols, 0, 0)
+            self.add_panel(
+                'alerts', curses.newwin(self.n_rows - 22, width, 21, 0),
+                lambda: (len(records), records[-1] if records else None),
+                self._draw_alerts)
+        self.add_panel(
+            'footer', curses.newwin(1, self.n_cols, self.n_rows - 1, 0),
+            self._footer_text, self._draw_footer)
+
+    def add_panel(self, name, window, state, draw):
+        """
+        Params:
+            name (str): A unique name for the panel.
+            window (curses.window): The window that the panel is drawn in.
+            state (function): Returns a value that changes whenever the
+                panel needs to be redrawn.
+            draw (function): Draws the panel, called with the window.
+        """
+        self.panels.append((name, window, state, draw))
+
+    def _draw_title(self, window):
         window.bkgd(' ', self.CYAN | curses.A_REVERSE | curses.A_BOLD)
         self.add_line(window, 'Akita HTTP Log Monitor', 0, 1)
 
         text = 'v{0}'.format(__version__)
         self.add_line(window, text, 0, self.n_cols - len(text) - 1)
 
-    def _draw_info_box(self):
-        window = self.stdscr.derwin(10, 30, 1, 0)
-        window.border()
-        self.add_line(window, ' Information ', 0, 2, attr=self.GREEN)
-
+    def _info_lines(self):
+        """
+        The values shown in the info box, in order.
+        """
         metrics = self.akita.metrics
 
         uptime = int(time.time() - self.akita.start_time)
-        text = str(timedelta(seconds=uptime))
-        self.add_line(window, 'Uptime       : ', 1, 1, curses.A_BOLD)
-        self.add_line(window, text, attr=self.CYAN)
-
         if metrics.last_seen:
             last_seen = '{:%H:%M:%S}'.format(metrics.last_seen)
         else:
             last_seen = '-'
-        self.add_line(window, 'Last Seen    : ', 2, 1, curses.A_BOLD)
-        self.add_line(window, str(last_seen), attr=self.CYAN)
 
-        self.add_line(window, 'Parsed Lines : ', 3, 1, curses.A_BOLD)
-        self.add_line(window, str(metrics.hit_total), attr=self.GREEN)
-
-        self.add_line(window, 'Failed Lines : ', 4, 1, curses.A_BOLD)
-        self.add_line(window, str(metrics.miss_total), attr=self.RED)
-
-        text = '{}/s'.format(metrics.alert_metric.threshold)
-        self.add_line(window, 'Alert Thresh : ', 5, 1, curses.A_BOLD)
-        self.add_line(window, text, attr=self.MAGENTA)
+        lines = [
+            ('Uptime       : ', str(timedelta(seconds=uptime)), self.CYAN),
+            ('Last Seen    : ', last_seen, self.CYAN),
+            ('Parsed Lines : ', str(metrics.hit_total), self.GREEN),
+            ('Failed Lines : ', str(metrics.miss_total), self.RED),
+            ('Alert Thresh : ', '{}/s'.format(metrics.alert_metric.threshold),
+             self.MAGENTA),
+            ('Alert Window : ', '{}s'.format(metrics.alert_metric.n_windows),
+             self.MAGENTA),
+        ]
+        if metrics.event_time:
+            lines.append(
+                ('Late Lines   : ', str(metrics.late_total), self.YELLOW))
+        return lines
+
+    def _draw_info_box(self, window):
+        window.border()
+        self.add_line(window, ' Information ', 0, 2, attr=self.GREEN)
 
-        text = '{}s'.format(metrics.alert_metric.n_windows)
-        self.add_line(window, 'Alert Window : ', 6, 1, curses.A_BOLD)
-        self.add_line(window, text, attr=self.MAGENTA)
+        for row, (label, text, attr) in enumerate(self.drawn['info'], 1):
+            self.add_line(window, label, row, 1, curses.A_BOLD)
+            self.add_line(window, text, attr=attr)
 
         self.add_line(window, '(press ctrl-c to quit)', 8, 1)
 
-    def _draw_most_visited(self):
-        window = self.stdscr.derwin(10,self.n_cols - 30, 1, 30)
+    def _draw_most_visited(self, window):
         window.border()
         self.add_line(window, ' Most Visited ', 0, 2, attr=self.GREEN)
 
@@ -227,20 +438,58 @@ class Display:
         text = '{:<15} {}'.format('URL Section', 'Hits/10s')
         self.add_line(window, text, 1, 1, attr=curses.A_BOLD)
 
-        counter = self.akita.metrics.subpath_counter.total
+        metrics = self.akita.metrics
+        counter = metrics.subpath_counter.total
         items = (x for x in counter.most_common(n_rows-3) if x[0] is not None)
         for row, (path, count) in enumerate(items, start=2):
             text = '{:<15} '.format('/' + path)
             self.add_line(window, text, row, 1, self.GREEN | curses.A_BOLD)
-            self.add_line(window, str(count))
+            bound = metrics.error_bound(count)
+            if bound:
+                # Estimated from a sample of the lines, with a ~95% margin
+                self.add_line(window, '~{} \xb1{:.0f}'.format(count, bound))
+            elif hasattr(counter, 'error') and counter.error(path):
+                # Approximate counts from the heavy hitters sketch
+                self.add_line(window, '~{}'.format(count))
+            else:
+                self.add_line(window, str(count))
 
         total = counter.get(None, '-')
         text = '{:<15} {}'.format('All Sections', total)
         self.add_line(window, text, n_rows, 1, curses.A_BOLD)
 
-    def _draw_traffic_chart(self):
-        window = self.stdscr.derwin(10, self.n_cols, 11, 0)
+    def _draw_sources(self, window):
+        window.border()
+        self.add_line(window, ' Sources ', 0, 2, attr=self.GREEN)
+
+        n_rows, n_cols = window.getmaxyx()
+        n_rows, n_cols = n_rows - 2, n_cols - 2  # Leave space for the borders
+
+        # Long paths are truncated from the left to keep the file names
+        width = max(10, n_cols - 16)
+
+        text = '{:<{}} {}'.format('Log File', width, 'Hits/10s')
+        self.add_line(window, text, 1, 1, attr=curses.A_BOLD)
+
+        counter = self.akita.metrics.source_counter.total
+        total = counter.get(None, 0)
+        items = (x for x in counter.most_common(n_rows-3) if x[0] is not None)
+        for row, (path, count) in enumerate(items, start=2):
+            if len(path) > width:
+                path = '..' + path[-width + 2:]
+            text = '{:<{}} '.format(path, width)
+            self.add_line(window, text, row, 1, self.GREEN | curses.A_BOLD)
+            share = count / total if total else 0
+            self.add_line(window, '{} ({:.0%})'.format(count, share))
+
+        text = '{:<{}} {}'.format('All Sources', width, total or '-')
+        self.add_line(window, text, n_rows, 1, curses.A_BOLD)
+
+    def _draw_traffic_chart(self, window):
         window.border()
+        if self.zoom:
+            self._draw_traffic_rollup(window)
+            return
         self.add_line(window, ' Traffic ', 0, 2, attr=self.GREEN)
 
         n_rows, n_cols = window.getmaxyx()
@@ -254,14 +503,155 @@ class Display:
             '-' if traffic.max is None else traffic.max)
         self.add_line(window, status, n_rows, 2, attr=self.YELLOW | curses.A_BOLD)
 
-        points = traffic.history
-        y_max = max(4, max(points))
-        for col, point in enumerate(points[:n_cols][::-1]):
+        y_max = max(4, max(traffic.history))
+        points = traffic.history.chronological(n_cols)
+        for col, point in enumerate(points):
             height = int((point / y_max * n_rows))
             window.vline(n_rows - height + 1, col + 1, '|', height-1)
 
-    def _draw_alerts(self):
-        window = self.stdscr.derwin(self.n_rows-22, self.n_cols, 21, 0)
+    def _draw_traffic_rollup(self, window):
+        """
+        Draw the traffic at one of the coarser resolutions. The bars are the
+        average rate in each bucket, with a dot at the busiest second.
+        """
+        traffic = self.akita.metrics.traffic_counter
+        level = traffic.levels[self.zoom - 1]
+        self.add_line(window, ' Traffic ({} buckets) '.format(
+            format_window(level.window_size)), 0, 2, attr=self.GREEN)
+
+        n_rows, n_cols = window.getmaxyx()
+        n_rows, n_cols = n_rows - 2, n_cols - 2  # Leave space for the borders
+
+        buckets = level.rates(n_cols)
+        if not buckets:
+            return
+
+        span = len(buckets) * level.window_size
+        status = 'last {}, avg {:.2f}/s, min {}/s, max {}/s'.format(
+            format_window(span),
+            sum(avg for avg, _, _ in buckets) / len(buckets),
+            min(low for _, low, _ in buckets),
+            max(high for _, _, high in buckets))
+        self.add_line(window, status, n_rows, 2, attr=self.YELLOW | curses.A_BOLD)
+
+        y_max = max(4, max(high for _, _, high in buckets))
+        for col, (avg, _, high) in enumerate(buckets):
+            height = int((avg / y_max * n_rows))
+            if height > 1:
+                window.vline(n_rows - height + 1, col + 1, '|', height-1)
+            peak = int((high / y_max * n_rows))
+            if peak > max(height, 1):
+                self.add_line(window, '.', n_rows - peak + 1, col + 1)
+
+    def _draw_status_codes(self, window):
+        window.border()
+        self.add_line(window, ' Status Codes ', 0, 2, attr=self.GREEN)
+
+        n_rows, n_cols = window.getmaxyx()
+        n_rows, n_cols = n_rows - 2, n_cols - 2  # Leave space for the borders
+
+        metrics = self.akita.metrics
+        statuses = metrics.status_counter.total
+        classes = statuses.classes()
+        total = sum(classes)
+
+        text = '{:<6}{:>10} {:>5}'.format('/10s', 'Hits', '%')
+        self.add_line(window, text, 1, 1, attr=curses.A_BOLD)
+
+        colors = [self.GREEN, self.CYAN, self.YELLOW, self.RED]
+        for row, (index, color) in enumerate(zip(range(2, 6), colors), 2):
+            count = classes[index]
+            share = '{:.0%}'.format(count / total) if total else '-'
+            self.add_line(window, '{}xx   '.format(index), row, 1,
+                          color | curses.A_BOLD)
+            self.add_line(window, '{:>10} {:>5}'.format(count, share))
+
+        # The most common codes that weren't successful
+        codes = sorted((item for item in statuses.items() if item[0] >= 400),
+                       key=lambda item: -item[1])
+        text = ' '.join('{}:{}'.format(code, count) for code, count in codes)
+        self.add_line(window, text, 6, 1, attr=self.YELLOW)
+
+        alert = metrics.error_alert
+        text = '5xx/{}s: {:.1%} (>{:.0%})'.format(
+            alert.n_windows * alert.window_size, alert.rate(),
+            alert.threshold)
+        attr = self.RED if alert.triggered else self.MAGENTA
+        self.add_line(window, text, n_rows, 1, attr | curses.A_BOLD)
+
+    def _draw_percentiles(self, window):
+        window.border()
+        self.add_line(window, ' Percentiles ', 0, 2, attr=self.GREEN)
+
+        n_rows, n_cols = window.getmaxyx()
+        n_rows, n_cols = n_rows - 2, n_cols - 2  # Leave space for the borders
+
+        metrics = self.akita.metrics
+        quantiles = (0.5, 0.95, 0.99)
+
+        text = '{:<8}{:>6} {:>6} {:>6}'.format('/10s', 'p50', 'p95', 'p99')
+        self.add_line(window, text, 1, 1, attr=curses.A_BOLD)
+
+        latency = metrics.latency_metric.total
+        values = [format_duration(latency.quantile(q)) for q in quantiles]
+        self.add_line(window, '{:<8}'.format('Time'), 2, 1, curses.A_BOLD)
+        self.add_line(window, '{:>6} {:>6} {:>6}'.format(*values),
+                      attr=self.CYAN)
+
+        size = metrics.size_metric.total
+        values = [format_bytes(size.quantile(q)) for q in quantiles]
+        self.add_line(window, '{:<8}'.format('Size'), 3, 1, curses.A_BOLD)
+        self.add_line(window, '{:>6} {:>6} {:>6}'.format(*values),
+                      attr=self.CYAN)
+
+        text = '{:<15} {}'.format('Bytes Served', '/10s')
+        self.add_line(window, text, 5, 1, attr=curses.A_BOLD)
+
+        counter = metrics.bytes_counter.total
+        items = [x for x in counter.most_common(n_rows - 5)
+                 if x[0] is not None][:n_rows - 5]
+        for row, (path, count) in enumerate(items, start=6):
+            text = '{:<15} '.format('/' + path)
+            self.add_line(window, text, row, 1, self.GREEN | curses.A_BOLD)
+            self.add_line(window, format_bytes(count))
+
+    def _draw_pipeline(self, window):
+        window.border()
+        self.add_line(window, ' Pipeline ', 0, 2, attr=self.GREEN)
+
+        n_rows, n_cols = window.getmaxyx()
+        n_rows, n_cols = n_rows - 2, n_cols - 2  # Leave space for the borders
+
+        stats = self.akita.stats
+        text = '{:<10}{:>9} {:>5} {:>7} {:>7}'.format(
+            'Stage', 'Items/s', 'Load', 'Avg', 'Max')
+        self.add_line(window, text, 1, 1, attr=curses.A_BOLD)
+
+        # The busiest stage is most likely the bottleneck
+        loads = {stage: values[1] for stage, values in stats.recent.items()}
+        busiest = max(loads, key=loads.get) if any(loads.values()) else None
+        for row, stage in enumerate(stats.stages, start=2):
+            self.add_line(window, '{:<10}'.format(stage), row, 1,
+                          curses.A_BOLD)
+            if stage not in stats.recent:
+                continue
+            rate, load, average, peak = stats.recent[stage]
+            if stage == 'read':
+                rate = format_bytes(rate)
+            else:
+                rate = '{:,.0f}'.format(rate)
+            text = '{:>9} {:>5.0%} {:>7} {:>7}'.format(
+                rate, load, format_duration(average),
+                format_duration(peak or None))
+            attr = self.YELLOW if stage == busiest else self.CYAN
+            self.add_line(window, text, attr=attr)
+
+        lag = '-' if stats.lag is None else '{:.0f}s'.format(stats.lag)
+        text = 'Lag {}, {} behind EOF'.format(
+            lag, format_bytes(stats.bytes_behind))
+        self.add_line(window, text, min(n_rows, 7), 1, attr=self.MAGENTA)
+
+    def _draw_alerts(self, window):
         window.border()
         self.add_line(window, ' Alerts ', 0, 2, attr=self.GREEN)
 
@@ -288,7 +678,78 @@ class Display:
             text = str(record.msg) % record.args
             self.add_line(window, text, attr=color)
 
-    def _draw_footer(self):
-        window = self.stdscr.derwin(1, self.n_cols, self.n_rows - 1, 0)
-        text = ' Watching {0}'.format(self.akita.log_file.name)
-        self.add_line(window, text, attr=self.GREEN)
+    def _draw_errors(self, window):
+        window.border()
+        self.add_line(window, ' Failed Lines ', 0, 2, attr=self.GREEN)
+
+        metrics = self.akita.metrics
+        n_rows, n_cols = window.getmaxyx()
+        n_rows, n_cols = n_rows - 2, n_cols - 2  # Leave space for the borders
+
+        reasons = metrics.error_reasons.most_common()
+        text = '  '.join('{} {:,}'.format(reason, count)
+                         for reason, count in reasons)
+        self.add_line(window, text or '(none)', 1, 1, attr=curses.A_BOLD)
+
+        # A random sample of the rejected lines, the sample is replaced
+        # while it's being drawn so take a copy first
+        samples = list(metrics.error_samples.items)
+        for row, (reason, line) in enumerate(samples[:n_rows - 1], start=2):
+            self.add_line(window, '{:<10} '.format(reason), row, 1, self.RED)
+            # Escape any control characters that would upset curses
+            self.add_line(window, repr(line[:n_cols])[1:-1])
+
+    def _footer_text(self):
+        text = ' Watching {0}'.format(self.akita.source_name)
+        shedder = self.akita.shedder
+        if shedder is not None and shedder.step > 1:
+            text = '{}  (sampling 1 in {} lines, {:,} skipped)'.format(
+                text, shedder.step, self.akita.metrics.skipped_total)
+        if self.output_meter and self.output_meter.rate is not None:
+            text = '{}  ({:,.0f} bytes/s to the terminal)'.format(
+                text, self.output_meter.rate)
+        return text
+
+    def _draw_footer(self, window):
+        self.add_line(window, self.drawn['footer'], attr=self.GREEN)
+
+
+class OutputMeter:
+    """
+    Measures how many bytes per second the process writes, using the
+    ``wchar`` counter in /proc/self/io. While the UI is running that's almost
+    all terminal output, so this shows how much each frame costs over a slow
+    connection. The rate stays None on platforms without /proc.
+    """
+
+    def __init__(self, interval=1.0, path='/proc/self/io'):
+        self.interval = interval
+        self.path = path
+        self.rate = None
+        self._last_time = time.time()
+        self._last_count = self._read()
+
+    def _read(self):
+        try:
+            with open(self.path) as fp:
+                for line in fp:
+                    if line.startswith('wchar:'):
+                        return int(line.split()[1])
+        except (OSError, ValueError):
+            pass
+        return None
+
+    def update(self):
+        """
+        Re-calculate the rate, at most once per interval.
+        """
+        now = time.time()
+        elapsed = now - self._last_time
+        if self._last_count is None or elapsed <= 0 or elapsed < self.interval:
+            return
+
+        count = self._read()
+        if count is None:
+            return
+        self.rate = (count - self._last_count) / elapsed
+        self._last_time, self._last_count = now, count
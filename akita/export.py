@@ -0,0 +1,259 @@
+import json
+import logging
+from threading import Thread
+from socketserver import ThreadingMixIn
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+
+_logger = logging.getLogger('akita')
+
+
+def parse_http_address(address):
+    """
+    Split an address like 127.0.0.1:9180 or :9180 into (host, port).
+    """
+    host, _, port = address.rpartition(':')
+    try:
+        return host.strip('[]') or '0.0.0.0', int(port)
+    except ValueError:
+        raise ValueError('Invalid address: {}'.format(address))
+
+
+def _escape_label(value):
+    value = str(value)
+    value = value.replace('\\', '\\\\').replace('"', '\\"')
+    return value.replace('\n', '\\n')
+
+
+class MetricsExporter:
+    """
+    Serializes the metrics from a MetricsAggregator for other monitoring
+    systems, in both the Prometheus text format and JSON.
+
+    The output is only rebuilt when the metrics roll over to a new window,
+    and the encoded bytes are cached. Serving a request just returns a
+    reference to the cached bytes, so any number of scrapes can be handled
+    without touching the metrics or slowing down the parser.
+    """
+
+    prometheus_content_type = 'text/plain; version=0.0.4; charset=utf-8'
+    json_content_type = 'application/json'
+
+    def __init__(self, metrics, top=10):
+        """
+        Params:
+            metrics (MetricsAggregator): The metrics to export.
+            top (int): The number of URL sections (and log files) to export.
+        """
+        self.metrics = metrics
+        self.top = top
+
+        self.window = None
+        self.json = b'{}'
+        self.prometheus = b''
+
+    def update(self):
+        """
+        Rebuild the cached output if the metrics have moved on to a new
+        window since the last update. Returns True if it was rebuilt.
+        """
+        # The reader thread keeps adding to the metrics, so copy everything
+        # out of them at once under the lock and encode the copy afterwards
+        with self.metrics.lock:
+            window = self.metrics.traffic_counter.head
+            if window is not None and window == self.window:
+                return False
+            data = self.to_dict()
+
+        # Build both before swapping them in, so readers never see a mix
+        self.json, self.prometheus = (
+            json.dumps(data).encode(), self.to_prometheus(data).encode())
+        self.window = window
+        return True
+
+    def _top(self, counter):
+        items = counter.most_common(self.top + 1)
+        return [[tag, count] for tag, count in items
+                if tag is not None][:self.top]
+
+    def to_dict(self):
+        """
+        Copy the metrics into plain data, with the metrics' lock held.
+        """
+        metrics = self.metrics
+        traffic = metrics.traffic_counter
+        alert = metrics.alert_metric
+
+        data = {
+            'window': traffic.head,
+            'hits_total': metrics.hit_total,
+            'errors_total': metrics.miss_total,
+            'errors_by_reason': dict(metrics.error_reasons),
+            'late_total': metrics.late_total,
+            'skipped_total': metrics.skipped_total,
+            'sample_step': metrics.sample_step,
+            'traffic': {
+                'current': traffic.history[0],
+                'avg': traffic.total / len(traffic.history),
+                'min': traffic.min,
+                'max': traffic.max,
+                'history': list(traffic.history.chronological()),
+            },
+            'sections': self._top(metrics.subpath_counter.total),
+            'alert': {
+                'threshold': alert.threshold,
+                'window': alert.n_windows * alert.window_size,
+                'triggered': alert.triggered,
+                'triggered_at': alert.triggered_at,
+                'triggered_rate': alert.triggered_rate,
+            },
+        }
+        statuses = metrics.status_counter.total
+        classes = statuses.classes()
+        error_alert = metrics.error_alert
+        data['status_classes'] = {
+            '{}xx'.format(i): count for i, count in enumerate(classes) if i}
+        data['status_codes'] = [[code, count]
+                                for code, count in statuses.items() if code]
+        data['error_alert'] = {
+            'threshold': error_alert.threshold,
+            'window': error_alert.n_windows * error_alert.window_size,
+            'rate': error_alert.rate(),
+            'triggered': error_alert.triggered,
+            'triggered_at': error_alert.triggered_at,
+            'triggered_rate': error_alert.triggered_rate,
+        }
+        if metrics.source_counter is not None:
+            data['sources'] = self._top(metrics.source_counter.total)
+        return data
+
+    def to_prometheus(self, data):
+        lines = []
+
+        def metric(name, kind, description, samples):
+            lines.append('# HELP akita_{} {}'.format(name, description))
+            lines.append('# TYPE akita_{} {}'.format(name, kind))
+            for labels, value in samples:
+                if labels:
+                    labels = '{' + ','.join(
+                        '{}="{}"'.format(key, _escape_label(val))
+                        for key, val in labels) + '}'
+                lines.append('akita_{}{} {}'.format(name, labels, value))
+
+        traffic, alert = data['traffic'], data['alert']
+        metric('hits_total', 'counter',
+               'Log lines that were parsed.',
+               [('', data['hits_total'])])
+        metric('errors_total', 'counter',
+               'Log lines that failed to parse.',
+               [('', data['errors_total'])])
+        metric('parse_errors_total', 'counter',
+               'Log lines that failed to parse, by the reason.',
+               [([('reason', reason)], count) for reason, count
+                in sorted(data['errors_by_reason'].items())])
+        metric('late_total', 'counter',
+               'Log lines that arrived too late to be counted.',
+               [('', data['late_total'])])
+        metric('skipped_total', 'counter',
+               'Log lines that were skipped by --shed-load.',
+               [('', data['skipped_total'])])
+        metric('sample_step', 'gauge',
+               'Only 1 in this many lines is being parsed.',
+               [('', data['sample_step'])])
+        metric('requests_per_second', 'gauge',
+               'Requests in the most recent complete window.',
+               [('', traffic['current'])])
+        metric('requests_per_second_avg', 'gauge',
+               'Average requests per second over the traffic history.',
+               [('', traffic['avg'])])
+        metric('section_hits', 'gauge',
+               'Hits for the top URL sections over the last 10 seconds.',
+               [([('section', '/' + section)], count)
+                for section, count in data['sections']])
+        if 'sources' in data:
+            metric('source_hits', 'gauge',
+                   'Hits for each log file over the last 10 seconds.',
+                   [([('source', source)], count)
+                    for source, count in data['sources']])
+        metric('responses', 'gauge',
+               'Responses in each status class over the last 10 seconds.',
+               [([('class', name)], count)
+                for name, count in sorted(data['status_classes'].items())])
+        metric('status_responses', 'gauge',
+               'Responses for each status code over the last 10 seconds.',
+               [([('code', code)], count)
+                for code, count in data['status_codes']])
+        metric('error_rate', 'gauge',
+               'The fraction of 5xx responses over the error alert window.',
+               [('', data['error_alert']['rate'])])
+        metric('error_alert_active', 'gauge',
+               'Set to 1 while the server error alert is active.',
+               [('', int(data['error_alert']['triggered']))])
+        metric('alert_active', 'gauge',
+               'Set to 1 while the high traffic alert is active.',
+               [('', int(alert['triggered']))])
+        metric('alert_threshold', 'gauge',
+               'The high traffic alert threshold, in requests per second.',
+               [('', alert['threshold'])])
+        return '\n'.join(lines) + '\n'
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    """
+    Serves the cached output of the server's MetricsExporter.
+    """
+
+    def do_GET(self):
+        exporter = self.server.exporter
+        path = self.path.split('?')[0]
+        if path == '/metrics':
+            body, content_type = (exporter.prometheus,
+                                  exporter.prometheus_content_type)
+        elif path == '/metrics.json':
+            body, content_type = exporter.json, exporter.json_content_type
+        else:
+            self.send_error(404)
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, fmt, *args):
+        # Scrapes are too frequent to log, the default writes to stderr
+        pass
+
+
+class MetricsServer(ThreadingMixIn, HTTPServer):
+    """
+    A small HTTP server for the /metrics (Prometheus) and /metrics.json
+    endpoints, running on its own thread.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, exporter):
+        """
+        Params:
+            address (str): The address to listen on, e.g. 127.0.0.1:9180.
+            exporter (MetricsExporter): Provides the cached output.
+        """
+        super().__init__(parse_http_address(address), MetricsRequestHandler)
+        self.exporter = exporter
+        self._thread = None
+
+    @property
+    def address(self):
+        host, port = self.server_address[:2]
+        return '{}:{}'.format(host, port)
+
+    def start(self):
+        self._thread = Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
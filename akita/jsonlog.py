@@ -0,0 +1,370 @@
+import re
+import json
+import calendar
+from json.scanner import make_scanner
+from collections import OrderedDict
+from datetime import datetime, timezone
+from operator import itemgetter, methodcaller
+from urllib.parse import urlparse
+
+from .parser import HTTPLogParser, EMPTY, FORMAT, TIMESTAMP, MISSING, VALUE
+from .parser import TimestampDecoder
+
+
+# The JSON key for each field, unless they're changed with a mapping
+DEFAULT_JSON_FIELDS = {
+    'host': 'remote_addr',
+    'user': 'remote_user',
+    'time': 'time',
+    'method': 'method',
+    'path': 'path',
+    'status': 'status',
+    'size': 'size',
+    'referrer': 'referrer',
+    'agent': 'user_agent',
+    'request_time': 'request_time',
+}
+
+# The fields that can be read from a JSON key, the rest are derived
+JSON_FIELDS = set(DEFAULT_JSON_FIELDS) | {'request', 'cookies'}
+
+UNITS = {'': 1, 's': 1, 'ms': 1e-3, 'us': 1e-6}
+
+
+class _TimestampError(ValueError):
+    """
+    The time in a JSON line couldn't be decoded.
+    """
+
+
+def parse_json_format(log_format):
+    """
+    Parse a format like "json:path=uri,status=code,request_time=took:ms"
+    into a dict of field -> (key, unit). Nested keys are separated with
+    dots, e.g. "path=request.uri". If the request line is given instead of
+    the path, the method and path are split out of it.
+    """
+    name, _, spec = log_format.partition(':')
+    if name != 'json':
+        raise ValueError('Not a JSON log format: {}'.format(log_format))
+
+    mapping = {field: (key, 's') for field, key in DEFAULT_JSON_FIELDS.items()}
+    given = set()
+    for item in filter(None, spec.split(',')):
+        field, sep, key = item.strip().partition('=')
+        key, _, unit = key.partition(':')
+        if not sep or not key or field not in JSON_FIELDS:
+            raise ValueError('Invalid JSON field: {}'.format(item))
+        if unit not in UNITS or (unit and field not in ('time',
+                                                         'request_time')):
+            raise ValueError('Invalid unit: {}'.format(item))
+
+        mapping[field] = (key, unit or 's')
+        given.add(field)
+
+    if 'request' in given and 'path' not in given:
+        del mapping['path']
+    return mapping
+
+
+class ISOTimestampDecoder:
+    """
+    Converts ISO 8601 timestamps like 2018-03-27T10:15:27.120-04:00 into
+    seconds since the unix epoch. Timestamps without a time zone are
+    assumed to be in UTC.
+
+    Like the TimestampDecoder, the epoch time for each minute and time zone
+    is cached, so most timestamps are decoded by slicing off the seconds.
+    The full pattern is only matched the first time a minute is seen.
+    """
+
+    pattern = re.compile(
+        r'(\d{4})-(\d\d)-(\d\d)[T ](\d\d):(\d\d)(?::\d\d(?:\.\d+)?)?'
+        r'\s*(Z|[+-]\d\d(?::?\d\d)?)?\Z')
+
+    def __init__(self, maxsize=64):
+        """
+        Params:
+            maxsize (int): The maximum number of minute prefixes to cache.
+        """
+        self.maxsize = maxsize
+        self._cache = OrderedDict()
+
+    def to_timestamp(self, text):
+        """
+        Convert the timestamp string into seconds since the unix epoch.
+        """
+        seconds = text[17:19]
+        if len(text) < 19 or text[16] != ':' or not seconds.isdigit():
+            # Without seconds, the minute is the whole timestamp
+            return float(self._decode_minute(text))
+
+        zone = text[19:]
+        fraction = 0.0
+        if zone[:1] == '.':
+            zone = zone[1:].lstrip('0123456789')
+            fraction = float(text[19:len(text) - len(zone)])
+
+        key = text[:16] + zone
+        epoch = self._cache.get(key)
+        if epoch is None:
+            epoch = self._decode_minute(text)
+            self._cache[key] = epoch
+            if len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+        else:
+            self._cache.move_to_end(key)
+        return epoch + int(seconds) + fraction
+
+    def _decode_minute(self, text):
+        """
+        Return the epoch time for the start of the timestamp's minute.
+        """
+        match = self.pattern.match(text)
+        if match is None:
+            raise ValueError('Invalid timestamp: {}'.format(text))
+
+        *parts, zone = match.groups()
+        epoch = calendar.timegm(datetime(*map(int, parts)).timetuple())
+        if zone and zone != 'Z':
+            zone = zone.replace(':', '')
+            offset = int(zone[1:3]) * 3600 + int(zone[3:5] or 0) * 60
+            epoch -= offset if zone[0] == '+' else -offset
+        return epoch
+
+
+class JSONLogParser:
+    """
+    Extracts the HTTP fields from access logs written as JSON lines, with
+    the same interface as the HTTPLogParser.
+
+    Decoding a whole line with json.loads() builds every value in it, when
+    the metrics only need two or three of them. Instead, the fast path
+    finds each key that's needed with str.find() and decodes just its value
+    with the json module's C scanner. Anything unusual falls back to
+    json.loads(), including lines with nested objects and nested keys.
+
+    The fast path doesn't check that the rest of the line is valid JSON,
+    only that it looks like a single object.
+    """
+
+    _scan_once = staticmethod(make_scanner(json.JSONDecoder()))
+
+    def __init__(self, log_format='json', fields=None):
+        """
+        Params:
+            log_format (str): "json", optionally followed by a mapping from
+                the fields to the JSON keys, see parse_json_format().
+            fields (iterable): The names of the fields that should be
+                returned by extract(), defaults to all of the fields.
+        """
+        fields = HTTPLogParser.fields if fields is None else tuple(fields)
+        unknown = set(fields) - set(HTTPLogParser.fields)
+        if unknown:
+            raise ValueError('Unknown fields: {}'.format(', '.join(unknown)))
+
+        self.fields = fields
+        self._fields = set(fields)
+        self.mapping = parse_json_format(log_format)
+
+        # The decoders keep caches, so each parser gets its own
+        self.timestamp_decoder = TimestampDecoder()
+        self.iso_decoder = ISOTimestampDecoder()
+
+        # The values that have to be read from the JSON object
+        needed = set()
+        for name in fields:
+            if name in ('path', 'url_parts', 'subpath'):
+                needed.add('path' if 'path' in self.mapping else 'request')
+            elif name in ('time', 'timestamp', 'datetime'):
+                needed.add('time')
+            elif name in ('method', 'version'):
+                needed.update((name, 'request'))
+            else:
+                needed.add(name)
+        needed &= set(self.mapping)
+
+        self._keys = []
+        self._nested = []
+        for field in sorted(needed):
+            key, unit = self.mapping[field]
+            if '.' in key:
+                self._nested.append((field, key.split('.')))
+            else:
+                self._keys.append((field, json.dumps(key)))
+        self._units = {field: UNITS[unit]
+                       for field, (_, unit) in self.mapping.items()}
+
+        self._raw = 'raw' in self._fields
+        self._steps = [(name, self._converter(name)) for name in fields]
+
+    def _scan(self, line):
+        """
+        The fast path, returns the raw values for the needed keys or None
+        if the line has to be decoded in full.
+        """
+        # Lines with nested objects are decoded in full, otherwise a key
+        # could be found inside of one
+        if (self._nested or line[:1] != '{' or line.find('{', 1) != -1 or
+                line.rstrip()[-1:] != '}'):
+            return None
+
+        values = {}
+        for field, needle in self._keys:
+            start = line.find(needle)
+            if start == -1:
+                continue
+            if line[start - 1] == '\\':
+                # Part of a longer key with an escaped quote
+                return None
+
+            pos = start + len(needle)
+            if line.startswith(':', pos):
+                pos += 1
+            elif line.startswith(' :', pos):
+                pos += 2
+            else:
+                # The first match was a string value, not a key
+                return None
+            if line.startswith(' ', pos):
+                pos += 1
+
+            try:
+                values[field], _ = self._scan_once(line, pos)
+            except StopIteration:
+                return None
+        return values
+
+    def _decode(self, line):
+        """
+        The slow path, decode the whole line.
+        """
+        data = json.loads(line)
+        if not isinstance(data, dict):
+            raise ValueError('Not a JSON object')
+
+        values = {}
+        for field, _ in self._keys:
+            key = self.mapping[field][0]
+            if key in data:
+                values[field] = data[key]
+        for field, keys in self._nested:
+            value = data
+            for key in keys:
+                if not isinstance(value, dict) or key not in value:
+                    break
+                value = value[key]
+            else:
+                values[field] = value
+        return values
+
+    def _to_timestamp(self, value):
+        try:
+            if isinstance(value, (int, float)):
+                return float(value * self._units['time'])
+            if len(value) == 26 and value[2] == '/':
+                # Common Log Format, e.g. 27/Mar/2018:10:15:27 -0400
+                return self.timestamp_decoder.to_timestamp(value)
+            return self.iso_decoder.to_timestamp(value)
+        except (ValueError, TypeError) as e:
+            raise _TimestampError(str(e)) from e
+
+    @staticmethod
+    def _request_part(index):
+        """
+        Split the method, path or version out of a "GET / HTTP/1.1" request.
+        """
+        def get(values):
+            parts = values['request'].split(' ')
+            return parts[index] if len(parts) > index else None
+        return get
+
+    def _converter(self, name):
+        """
+        Return a function that builds the field from the decoded values.
+        Missing values are None, except for the required fields which raise
+        a KeyError.
+        """
+        if name in ('status', 'time', 'raw'):
+            get = itemgetter(name)
+        else:
+            get = methodcaller('get', name)
+
+        if name == 'status':
+            return lambda values: int(get(values))
+        if name == 'size':
+            # The size may be "-" if it was copied from a text log
+            def size(values):
+                value = get(values)
+                return 0 if value is None or value == '-' else int(value)
+            return size
+        if name == 'request_time':
+            unit = self._units['request_time']
+
+            def request_time(values):
+                value = get(values)
+                if value is None or value == '-':
+                    return None
+                return float(value) * unit
+            return request_time
+
+        if name in ('path', 'url_parts', 'subpath'):
+            if 'path' in self.mapping:
+                path = itemgetter('path')
+            else:
+                path = self._request_part(1)
+
+            if name == 'url_parts':
+                return lambda values: urlparse(path(values))
+            if name == 'subpath':
+                return lambda values: HTTPLogParser._subpath(path(values))
+            return path
+        if name == 'method' and 'request' in self.mapping:
+            method = self._request_part(0)
+            return lambda values: get(values) or method(values)
+        if name == 'version':
+            version = self._request_part(2)
+            return lambda values: version(values) if 'request' in values \
+                else None
+
+        time = itemgetter('time')
+        if name == 'timestamp':
+            return lambda values: self._to_timestamp(time(values))
+        if name == 'datetime':
+            return lambda values: datetime.fromtimestamp(
+                self._to_timestamp(time(values)), timezone.utc)
+        return get
+
+    extract = HTTPLogParser.extract
+    parse_batch = HTTPLogParser.parse_batch
+
+    def try_extract(self, line):
+        """
+        Parse a line without raising an exception. Returns a tuple of
+        (data, None), or (None, reason) if the line was rejected.
+
+        A line that isn't wrapped in braces can't be a JSON object, which
+        catches blank and truncated lines without calling json.loads().
+        """
+        values = self._scan(line)
+        if values is None:
+            stripped = line.strip()
+            if not stripped:
+                return None, EMPTY
+            if stripped[0] != '{' or stripped[-1] != '}':
+                return None, FORMAT
+            try:
+                values = self._decode(line)
+            except ValueError:
+                return None, FORMAT
+
+        if self._raw:
+            values['raw'] = line
+        try:
+            return {name: func(values) for name, func in self._steps}, None
+        except KeyError:
+            return None, MISSING
+        except _TimestampError:
+            return None, TIMESTAMP
+        except (ValueError, TypeError, AttributeError):
+            return None, VALUE
@@ -0,0 +1,480 @@
+import re
+from urllib.parse import urlparse
+
+from .parser import HTTPLogParser, EMPTY, FORMAT, REQUEST, TIMESTAMP, VALUE
+from .parser import TimestampDecoder, _is_digits
+from .jsonlog import JSONLogParser
+
+
+# Shortcuts that can be passed instead of a full format string
+LOG_FORMATS = {
+    'common': '%h %l %u %t "%r" %>s %b',
+    'combined': '%h %l %u %t "%r" %>s %b "%{Referer}i" "%{User-agent}i"',
+    'nginx': '$remote_addr - $remote_user [$time_local] "$request" $status '
+             '$body_bytes_sent "$http_referer" "$http_user_agent"',
+}
+
+
+def _seconds(value):
+    return None if value == '-' else float(value)
+
+
+def _milliseconds(value):
+    return None if value == '-' else int(value) / 1e3
+
+
+def _microseconds(value):
+    return None if value == '-' else int(value) / 1e6
+
+
+def _upstream_seconds(value):
+    """
+    nginx logs one time for each upstream server that was tried, like
+    "0.010, 0.250" or "0.010 : 0.250", and "-" if there was no response.
+    """
+    total = None
+    for part in re.split(r'[,:]', value):
+        part = part.strip()
+        if part and part != '-':
+            total = (total or 0) + float(part)
+    return total
+
+
+# Apache directive -> (field, converter). Directives that aren't listed are
+# matched but never extracted.
+APACHE_DIRECTIVES = {
+    'h': ('host', None),
+    'a': ('host', None),
+    'u': ('user', None),
+    't': ('time', None),
+    'r': ('request', None),
+    's': ('status', None),
+    'b': ('size', None),
+    'B': ('size', None),
+    'O': ('size', None),
+    'D': ('request_time', _microseconds),
+    'T': ('request_time', _seconds),
+    '{s}T': ('request_time', _seconds),
+    '{ms}T': ('request_time', _milliseconds),
+    '{us}T': ('request_time', _microseconds),
+    'v': ('vhost', None),
+    'V': ('vhost', None),
+    'm': ('method', None),
+    'U': ('path', None),
+    'H': ('version', None),
+    '{referer}i': ('referrer', None),
+    '{user-agent}i': ('agent', None),
+    '{cookie}i': ('cookies', None),
+}
+
+# nginx variable -> (field, converter)
+NGINX_VARIABLES = {
+    'remote_addr': ('host', None),
+    'remote_user': ('user', None),
+    'time_local': ('time', None),
+    'request': ('request', None),
+    'status': ('status', None),
+    'body_bytes_sent': ('size', None),
+    'bytes_sent': ('size', None),
+    'http_referer': ('referrer', None),
+    'http_user_agent': ('agent', None),
+    'http_cookie': ('cookies', None),
+    'request_time': ('request_time', _seconds),
+    'upstream_response_time': ('upstream_time', _upstream_seconds),
+    'host': ('vhost', None),
+    'server_name': ('vhost', None),
+    'request_method': ('method', None),
+    'request_uri': ('path', None),
+    'server_protocol': ('version', None),
+}
+
+_apache_token = re.compile(
+    r'%%|%[!0-9,]*[<>]?(?P<arg>\{[^}]*\})?(?P<name>[a-zA-Z])')
+_nginx_token = re.compile(r'\$(?:\{(?P<braced>\w+)\}|(?P<name>\w+))')
+
+
+def tokenize(log_format):
+    """
+    Split an Apache LogFormat or nginx log_format string into a list of
+    literal strings and (field, converter) tuples. Unknown directives are
+    returned as (None, None). The style is detected from the string, any
+    ``%`` directive means it's an Apache format.
+    """
+    log_format = LOG_FORMATS.get(log_format, log_format)
+
+    # Formats copied out of httpd.conf have their quotes escaped
+    log_format = log_format.replace('\\"', '"')
+
+    if _apache_token.search(log_format):
+        pattern = _apache_token
+    else:
+        pattern = _nginx_token
+
+    tokens, pos = [], 0
+    for match in pattern.finditer(log_format):
+        tokens.append(log_format[pos:match.start()])
+        pos = match.end()
+        if match.group(0) == '%%':
+            tokens[-1] += '%'
+            continue
+
+        if pattern is _apache_token:
+            name = (match.group('arg') or '').lower() + match.group('name')
+            if name == 't':
+                # %t is written with the brackets, e.g. [10/Oct/2000:...]
+                tokens[-1] += '['
+                tokens.append(APACHE_DIRECTIVES[name])
+                tokens.append(']')
+                continue
+            tokens.append(APACHE_DIRECTIVES.get(name, (None, None)))
+        else:
+            name = match.group('braced') or match.group('name')
+            tokens.append(NGINX_VARIABLES.get(name, (None, None)))
+    tokens.append(log_format[pos:])
+
+    # Merge the adjacent literals
+    merged = []
+    for token in tokens:
+        if isinstance(token, str) and merged and isinstance(merged[-1], str):
+            merged[-1] += token
+        else:
+            merged.append(token)
+    return merged
+
+
+class LogFormatParser:
+    """
+    A parser for a custom log format, with the same interface as the
+    HTTPLogParser.
+
+    The format is compiled once into a python function that walks through
+    the line with str.find(), using the literal text between the fields as
+    the separators. Only the fields that are needed are sliced out of the
+    line and converted, the rest are skipped over. Lines that don't fit the
+    simple layout (e.g. a quoted field containing a quote) fall back to a
+    regular expression that's generated from the same format.
+    """
+
+    # Fields that are None when they aren't in the format, everything else
+    # has to be there
+    optional_fields = {
+        'host', 'user', 'size', 'referrer', 'agent', 'cookies',
+        'request_time', 'upstream_time', 'vhost',
+    }
+
+    # The regex fallback for fields that never contain spaces, anything else
+    # matches up to the next separator
+    _patterns = {
+        'host': r'\S+',
+        'user': r'\S+',
+        'status': r'[0-9]+',
+        'size': r'\S+',
+        'request_time': r'\S+',
+        'vhost': r'\S+',
+    }
+
+    # Fields that can contain spaces, even though they aren't quoted
+    _spaced = {'upstream_time'}
+
+    _request_fields = HTTPLogParser._request_fields
+    _time_fields = HTTPLogParser._time_fields
+
+    def __init__(self, log_format, fields=None, converters=None):
+        """
+        Params:
+            log_format (str): An Apache LogFormat or nginx log_format string,
+                or the name of one of the LOG_FORMATS.
+            fields (iterable): The names of the fields that should be
+                returned by extract(), defaults to all of the fields that
+                the format contains.
+            converters (dict): Functions that convert the raw text for a
+                field, by name. These replace the default conversions, like
+                turning a request time into float seconds.
+        """
+        self.log_format = log_format
+        self.tokens = tokenize(log_format)
+        self.timestamp_decoder = TimestampDecoder()
+
+        # The first directive for each field wins, any duplicates are
+        # matched and skipped
+        self._converters = {}
+        for token in self.tokens:
+            if isinstance(token, tuple) and token[0] is not None:
+                self._converters.setdefault(token[0], token[1])
+        for name, converter in (converters or {}).items():
+            if name in self._converters:
+                self._converters[name] = converter
+
+        available = {'raw'} | set(self._converters)
+        if 'request' in available or 'path' in available:
+            available |= {'path', 'url_parts', 'subpath'}
+        if 'request' in available:
+            available |= {'method', 'version'}
+        if 'time' in available:
+            available |= {'datetime', 'timestamp'}
+
+        fields = tuple(available) if fields is None else tuple(fields)
+        unknown = set(fields) - set(HTTPLogParser.fields) - available
+        missing = set(fields) - available - self.optional_fields - unknown
+        if unknown:
+            raise ValueError('Unknown fields: {}'.format(', '.join(unknown)))
+        if missing:
+            raise ValueError('The log format does not contain: {}'.format(
+                ', '.join(sorted(missing))))
+
+        self.fields = fields
+        self._fields = set(fields)
+        self._split, self._from_groups, self.pattern = self._compile()
+
+        # The literal text that has to appear in every line, in order, for
+        # the regex to have any chance of matching
+        self._head = self.tokens[0]
+        self._tail = self.tokens[-1].rstrip()
+        self._separators = [token for token in self.tokens[2:-1:2] if token]
+
+    def _needed(self):
+        """
+        The raw fields that have to be sliced out of each line.
+        """
+        fields, available = self._fields, set(self._converters)
+        needed = fields & available
+        if fields & {'path', 'url_parts', 'subpath'}:
+            needed.add('path' if 'path' in available else 'request')
+        if fields & {'method', 'version'} - available:
+            needed.add('request')
+        if fields & self._time_fields:
+            needed.add('time')
+        return needed
+
+    def _compile(self):
+        """
+        Generate the source code for the fast path and the regex fallback,
+        and compile them.
+        """
+        needed = self._needed()
+        tokens = self.tokens
+        namespace = {
+            'urlparse': urlparse,
+            'subpath': HTTPLogParser._subpath,
+            'is_digits': _is_digits,
+            'decoder': self.timestamp_decoder,
+            'REQUEST': REQUEST,
+            'TIMESTAMP': TIMESTAMP,
+            'VALUE': VALUE,
+        }
+
+        # (group, field, text before, text after) for each directive, only
+        # the first directive for each field is extracted
+        fields, seen = [], set()
+        for index in range(1, len(tokens), 2):
+            name = tokens[index][0]
+            before, after = tokens[index - 1], tokens[index + 1]
+            if not after and index != len(tokens) - 2:
+                raise ValueError(
+                    'The fields must be separated by some text: {}'.format(
+                        self.log_format))
+            if name in seen:
+                name = None
+            seen.add(name)
+            fields.append(('g{}'.format(index), name, before, after))
+
+        body = ['    ' + line for line in self._build(needed, namespace)]
+        split = self._compile_split(fields, needed) + body
+        from_groups = ['def _from_groups(line, groups):']
+        for group, name, _, _ in fields:
+            if name in needed:
+                from_groups.append('    {} = groups[{!r}]'.format(
+                    name, group))
+        from_groups += body
+
+        exec('\n'.join(split + [''] + from_groups), namespace)
+        return (namespace['_split'], namespace['_from_groups'],
+                self._compile_regex(fields))
+
+    def _compile_regex(self, fields):
+        regex = []
+        for group, name, before, after in fields:
+            regex.append(re.escape(before))
+            if before.endswith('"') and after.startswith('"'):
+                # Quotes inside of the field are escaped as \" or \x22
+                regex.append(r'(?P<{}>(?:[^"\\]|\\.)*)'.format(group))
+            else:
+                regex.append('(?P<{}>{})'.format(
+                    group, self._patterns.get(name, '.*?')))
+        regex.append(re.escape(self.tokens[-1]))
+        return re.compile(''.join(regex) + r'\s*\Z')
+
+    def _compile_split(self, fields, needed):
+        """
+        The fast path finds the end of each field by searching for the text
+        that comes after it. A field that can contain its own separator
+        (like the comma separated upstream times) is handled by finding the
+        fields after it from the end of the line instead.
+        """
+        code = ['def _split(line):']
+
+        def add(*lines):
+            code.extend('    ' + line for line in lines)
+
+        def extract(name, before, start, end):
+            if before.endswith('"'):
+                # A quote inside of a quoted field means the separator might
+                # have been found in the wrong place, the regex can sort
+                # that out
+                add("if line.find('\"', {}, {}) != -1:".format(start, end),
+                    '    return None')
+            if name in needed or name == 'status':
+                add('{} = line[{}:{}]'.format(name, start, end))
+            if name == 'status':
+                add('if not is_digits(status):', '    return None')
+
+        spaced = [i for i, (_, name, before, _) in enumerate(fields)
+                  if name in self._spaced and not before.endswith('"')]
+        if len(spaced) > 1:
+            # Too ambiguous, always use the regex
+            add('return None')
+            return code
+
+        head = self.tokens[0]
+        if head:
+            add('if not line.startswith({!r}):'.format(head),
+                '    return None')
+        add('pos = {}'.format(len(head)))
+
+        split_at = spaced[0] if spaced else len(fields)
+        for index, (_, name, before, after) in enumerate(fields[:split_at]):
+            if index == len(fields) - 1 and not after.strip():
+                # The last field runs to the end of the line
+                add('end = len(line.rstrip())')
+            else:
+                add('end = line.find({!r}, pos)'.format(after),
+                    'if end == -1:', '    return None')
+            extract(name, before, 'pos', 'end')
+            add('pos = end + {}'.format(len(after)))
+
+        tail = self.tokens[-1].rstrip()
+        if not spaced:
+            if tail:
+                # Check that the line ends with the trailing text
+                add('if line[pos:].strip():', '    return None')
+            return code
+
+        # Work backwards from the end of the line to the spaced field
+        add('end = len(line.rstrip())')
+        if tail:
+            add('if not line.endswith({!r}, pos, end):'.format(tail),
+                '    return None',
+                'end -= {}'.format(len(tail)))
+        for _, name, before, after in reversed(fields[split_at + 1:]):
+            add('start = line.rfind({!r}, pos, end)'.format(before),
+                'if start == -1:', '    return None')
+            extract(name, before, 'start + {}'.format(len(before)), 'end')
+            add('end = start')
+        _, name, before, _ = fields[split_at]
+        extract(name, before, 'pos', 'end')
+        return code
+
+    def _build(self, needed, namespace):
+        """
+        The lines of code that convert the raw fields and return the dict,
+        or the reason that the line was rejected.
+        """
+        fields = self._fields
+        body = []
+        converted = []
+        for name in sorted(needed):
+            converter = self._converters.get(name)
+            if converter is not None:
+                namespace['convert_' + name] = converter
+                converted.append('    {0} = convert_{0}({0})'.format(name))
+        if converted:
+            body += ['try:'] + converted + [
+                'except ValueError:', '    return None, VALUE']
+
+        values = {name: name for name in needed & fields}
+        if 'raw' in fields:
+            values['raw'] = 'line'
+        if 'request' in needed:
+            body.append("parts = request.split(' ')")
+            values.setdefault('method', 'parts[0]')
+            values.setdefault(
+                'version', "parts[2] if len(parts) > 2 else 'HTTP/0.9'")
+            if 'path' not in needed and fields & {'path', 'url_parts',
+                                                  'subpath'}:
+                body += ['if len(parts) < 2:', '    return None, REQUEST',
+                         'path = parts[1]']
+                values.setdefault('path', 'path')
+        values.setdefault('url_parts', 'urlparse(path)')
+        values.setdefault('subpath', 'subpath(path)')
+
+        times = []
+        if 'datetime' in fields:
+            times.append('    dt = decoder.to_datetime(time)')
+            values['datetime'] = 'dt'
+        if 'timestamp' in fields:
+            if 'datetime' in fields:
+                # Already decoded, don't look the minute up twice
+                times.append('    timestamp = dt.timestamp()')
+            else:
+                times.append('    timestamp = decoder.to_timestamp(time)')
+            values['timestamp'] = 'timestamp'
+        if times:
+            body += ['try:'] + times + [
+                'except ValueError:', '    return None, TIMESTAMP']
+
+        # Optional fields that aren't in the format are always None
+        body.append('return {' + ', '.join(
+            '{!r}: {}'.format(name, values.get(name, 'None'))
+            for name in self.fields) + '}, None')
+        return body
+
+    extract = HTTPLogParser.extract
+    parse_batch = HTTPLogParser.parse_batch
+
+    def try_extract(self, line):
+        """
+        Parse a line without raising an exception. Returns a tuple of
+        (data, None), or (None, reason) if the line was rejected.
+        """
+        result = self._split(line)
+        if result is None:
+            reason = self._precheck(line)
+            if reason is not None:
+                return None, reason
+            match = self.pattern.match(line)
+            if match is None:
+                return None, FORMAT
+            result = self._from_groups(line, match.groupdict())
+        return result
+
+    def _precheck(self, line):
+        """
+        Return the reason that a line can't possibly match the regex, or
+        None if it might. Checking for the separators is much cheaper than
+        letting the regex fail on a truncated line.
+        """
+        if not line or line.isspace():
+            return EMPTY
+        if (not line.startswith(self._head) or
+                not line.rstrip().endswith(self._tail)):
+            return FORMAT
+        pos = len(self._head)
+        for separator in self._separators:
+            pos = line.find(separator, pos)
+            if pos == -1:
+                return FORMAT
+            pos += len(separator)
+        return None
+
+
+def create_parser(fields, log_format=None):
+    """
+    Return a LogFormatParser for the format, or the default HTTPLogParser
+    if no format is given. Formats starting with "json" select the
+    JSONLogParser.
+    """
+    if log_format is None:
+        return HTTPLogParser(fields=fields)
+    if log_format.split(':', 1)[0] == 'json':
+        return JSONLogParser(log_format, fields=fields)
+    return LogFormatParser(log_format, fields=fields)
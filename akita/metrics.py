@@ -1,12 +1,98 @@
+import json
+import math
+import random
 import time
+import zlib
 import logging
 import threading
+from array import array
+from operator import add, sub, itemgetter
+from functools import partial
 from collections import Counter
 
 
 _logger = logging.getLogger('akita')
 
 
+class RingBuffer:
+    """
+    A fixed-size sequence where pushing a new item at the front evicts the
+    oldest item from the back in O(1) time, without shifting the rest of the
+    items around.
+
+    Index 0 is always the newest item. Integers can be stored in a compact
+    array by passing a typecode, otherwise the items are kept in a list.
+    """
+
+    def __init__(self, size, factory, typecode=None):
+        """
+        Params:
+            size (int): The number of items in the buffer.
+            factory (callable): Creates the initial value for each item.
+            typecode (str): If set, store the items in an array.array.
+        """
+        self.size = size
+        if typecode:
+            self._data = array(typecode, [factory()]) * size
+        else:
+            self._data = [factory() for _ in range(size)]
+
+        # The position of the newest item in the underlying storage
+        self._start = 0
+
+    def __len__(self):
+        return self.size
+
+    def _position(self, index):
+        if index < 0:
+            index += self.size
+        if not 0 <= index < self.size:
+            raise IndexError('RingBuffer index out of range')
+        return (self._start + index) % self.size
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self.size))]
+        return self._data[self._position(index)]
+
+    def __setitem__(self, index, value):
+        self._data[self._position(index)] = value
+
+    def __iter__(self):
+        """
+        Iterate from the newest item to the oldest.
+        """
+        data, start = self._data, self._start
+        for i in range(start, self.size):
+            yield data[i]
+        for i in range(start):
+            yield data[i]
+
+    def chronological(self, n=None):
+        """
+        Iterate over the newest ``n`` items, from oldest to newest.
+        """
+        n = self.size if n is None else min(n, self.size)
+        data, size = self._data, self.size
+        for i in range(self._start + n - 1, self._start - 1, -1):
+            yield data[i % size]
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __repr__(self):
+        return 'RingBuffer({!r})'.format(list(self))
+
+    def push(self, value):
+        """
+        Insert the value as the newest item and return the evicted item.
+        """
+        self._start = (self._start - 1) % self.size
+        evicted = self._data[self._start]
+        self._data[self._start] = value
+        return evicted
+
+
 class SlidingWindowBase:
     """
     Data structure that keeps track of the total number of events that have
@@ -20,23 +106,38 @@ class SlidingWindowBase:
     # must support +/- operations.
     datatype = None
 
-    def __init__(self, window_size=1, n_windows=10):
+    # If set, the history is stored in a compact array of this type
+    typecode = None
+
+    def __init__(self, window_size=1, n_windows=10, allowed_lateness=None):
         """
         Params:
             window_size (int): The length of each event window, in seconds.
             n_windows (int): The number of windows kept in memory.
+            allowed_lateness (float): When points are added with their own
+                timestamps, points that are older than the head of the window
+                by more than this many seconds will be dropped. Defaults to
+                accepting anything that still fits in the history.
         """
 
         self.window_size = window_size
         self.n_windows = n_windows
+        self.allowed_lateness = allowed_lateness
 
         self.head = None
 
-        # Note: I decided to use a plain list instead of a deque because
-        # fast random access is more important than the cost of inserting at
-        # the head of the list, the latter of which will only happen at most
-        # once per window_size.
-        self.history = [self.datatype() for _ in range(self.n_windows)]
+        # The number of event-time points that arrived too late to be counted
+        self.dropped = 0
+
+        # Incremented whenever the history or the total changes, so readers
+        # like the display can tell when their copy is stale without having
+        # to compare the data. Points that are still accumulating in the
+        # buffer don't count as a change.
+        self.version = 0
+
+        # A ring buffer gives both fast random access and O(1) rotation
+        # when the head of the window advances.
+        self.history = self._new_history()
         self.buffer = self.datatype()
         self.total = self.datatype()
 
@@ -51,7 +152,11 @@ class SlidingWindowBase:
                 window with, will default to the current time.
         """
         timestamp = time.time() if timestamp is None else timestamp
-        window = timestamp - timestamp % self.window_size
+        self._advance(timestamp - timestamp % self.window_size)
+
+    def _advance(self, window):
+        if self.head is None or window > self.head:
+            self.version += 1
 
         if self.head is None:
             # The first flush initializes the window
@@ -62,17 +167,58 @@ class SlidingWindowBase:
             self._history_update(self.buffer)
             offset = int((window - self.head) // self.window_size)
 
-            # Pad with zeros if the gap is larger than 1 window
-            for _ in range(offset-1):
-                self._history_update(self.datatype())
+            # Pad with zeros if the gap is larger than 1 window, anything past
+            # the length of the history would only overwrite the same zeros
+            self._history_fill(min(offset - 1, self.n_windows))
 
             self.buffer = self.datatype()
             self.head = window
 
+    def _new_history(self):
+        return RingBuffer(self.n_windows, self.datatype, self.typecode)
+
     def _history_update(self, buffer):
-        self.history.insert(0, buffer)
         self.total += buffer
-        self.total -= self.history.pop()
+        self.total -= self.history.push(buffer)
+
+    def _history_fill(self, count):
+        for _ in range(count):
+            self._history_update(self.datatype())
+
+    def _add(self, value, timestamp=None, count=1):
+        """
+        Add a value to the window that matches the event's timestamp.
+
+        Points without a timestamp are always added to the current buffer.
+        Points that are newer than the head of the window will advance the
+        head, acting as a watermark. Points that are older than the head are
+        placed into the matching slot in the history, as long as they're not
+        too late.
+        """
+        if timestamp is None:
+            self.buffer += value
+            return
+
+        window = timestamp - timestamp % self.window_size
+        if self.head is None or window > self.head:
+            self._advance(window)
+            self.buffer += value
+            return
+
+        offset = int((self.head - window) // self.window_size)
+        if offset == 0:
+            self.buffer += value
+        elif offset > self.n_windows or (
+                self.allowed_lateness is not None and
+                self.head - window > self.allowed_lateness):
+            self.dropped += count
+        else:
+            self._history_add(offset - 1, value)
+
+    def _history_add(self, index, value):
+        self.history[index] += value
+        self.total += value
+        self.version += 1
 
     def add_point(self):
         """
@@ -80,6 +226,108 @@ class SlidingWindowBase:
         """
         raise NotImplementedError
 
+    def merge(self, other):
+        """
+        Combine the windows from another metric into this one.
+
+        The windows are aligned by their timestamps, so both metrics must use
+        the same window size and number of windows. If the other metric is
+        ahead of this one, the head of this metric is advanced to match.
+        Windows from the other metric that are older than this metric's
+        history are dropped.
+        """
+        if (other.window_size, other.n_windows) != (
+                self.window_size, self.n_windows):
+            raise ValueError('Cannot merge metrics with different windows')
+
+        self.dropped += other.dropped
+        if other.head is None:
+            self.buffer += other.buffer
+            return
+
+        if self.head is None or other.head > self.head:
+            self._advance(other.head)
+
+        offset = int((self.head - other.head) // self.window_size)
+        if offset > self.n_windows:
+            # The other metric is too far behind for any of it to fit
+            self.dropped += self._count(other.buffer)
+            return
+
+        self._add_at(offset, other.buffer)
+        for index, value in enumerate(other.history, start=offset + 1):
+            if index > self.n_windows:
+                break
+            self._add_at(index, value)
+
+    def _add_at(self, offset, value):
+        if offset == 0:
+            self.buffer += value
+        else:
+            self._history_add(offset - 1, value)
+
+    def _count(self, value):
+        """
+        The number of points in a window, for the dropped count.
+        """
+        return value
+
+    def _params(self):
+        """
+        The arguments needed to construct an empty copy of this metric.
+        """
+        return {
+            'window_size': self.window_size,
+            'n_windows': self.n_windows,
+            'allowed_lateness': self.allowed_lateness,
+        }
+
+    def _encode(self, value):
+        return value
+
+    def _decode(self, value):
+        return value
+
+    def snapshot(self):
+        """
+        Return the full state of the metric as a JSON serializable dict.
+        """
+        return {
+            'type': type(self).__name__,
+            'params': self._params(),
+            'head': self.head,
+            'dropped': self.dropped,
+            'buffer': self._encode(self.buffer),
+            'history': [self._encode(value) for value in self.history],
+            'total': self._encode(self.total),
+        }
+
+    def restore(self, data):
+        """
+        Load the state from a dict that was returned by snapshot().
+        """
+        if data['type'] != type(self).__name__:
+            raise ValueError('Cannot restore a {} snapshot into a {}'.format(
+                data['type'], type(self).__name__))
+
+        self.head = data['head']
+        self.dropped = data['dropped']
+        self.buffer = self._decode(data['buffer'])
+        self.history = self._new_history()
+        for index, value in enumerate(data['history']):
+            self.history[index] = self._decode(value)
+        self.total = self._decode(data['total'])
+        self.version += 1
+
+    @classmethod
+    def from_snapshot(cls, data):
+        """
+        Construct a new metric from a dict that was returned by snapshot().
+        """
+        metric = cls(**data['params'])
+        metric.restore(data)
+        return metric
+
 
 class CounterMetric(SlidingWindowBase):
     """
@@ -88,9 +336,10 @@ class CounterMetric(SlidingWindowBase):
     """
 
     datatype = int
+    typecode = 'q'
 
-    def __init__(self, window_size=1, n_windows=10):
-        super().__init__(window_size, n_windows)
+    def __init__(self, window_size=1, n_windows=10, allowed_lateness=None):
+        super().__init__(window_size, n_windows, allowed_lateness)
 
         self.min = None
         self.max = None
@@ -101,28 +350,63 @@ class CounterMetric(SlidingWindowBase):
         self.min = buffer if self.min is None else min(self.min, buffer)
         self.max = buffer if self.max is None else max(self.max, buffer)
 
-    def add_point(self):
-        self.buffer += 1
+    def _history_add(self, index, value):
+        super()._history_add(index, value)
+
+        # Late points can only make a window larger, so the min is left as-is
+        if self.max is not None:
+            self.max = max(self.max, self.history[index])
+
+    def merge(self, other):
+        super().merge(other)
+
+        if other.min is not None:
+            self.min = other.min if self.min is None else min(
+                self.min, other.min)
+        if other.max is not None:
+            self.max = other.max if self.max is None else max(
+                self.max, other.max)
+
+    def snapshot(self):
+        data = super().snapshot()
+        data['min'] = self.min
+        data['max'] = self.max
+        return data
 
+    def restore(self, data):
+        super().restore(data)
+        self.min = data['min']
+        self.max = data['max']
 
-class AlertMetric(CounterMetric):
+    def add_point(self, count=1, timestamp=None):
+        if timestamp is None:
+            self.buffer += count
+        else:
+            self._add(count, timestamp, count)
+
+
+class ThresholdAlertMixin:
     """
-    An extension of the CounterMetric that watches the avg. rate of events
-    over the entire window, and returns an alert when the rate crosses a given
-    threshold.
+    Adds an alert to a sliding window metric. Each time the window is
+    flushed, the value returned by rate() is compared to the threshold, and
+    an alert is returned when it crosses the threshold in either direction.
     """
 
     ALERT_START = 'start'
     ALERT_STOP = 'stop'
 
-    def __init__(self, window_size=1, n_windows=120, threshold=10):
-        super().__init__(window_size, n_windows)
-
+    def _init_alert(self, threshold):
         self.threshold = threshold
         self.triggered = False
         self.triggered_rate = None
         self.triggered_at = None
 
+    def rate(self):
+        """
+        The value that's compared to the threshold, over the whole window.
+        """
+        raise NotImplementedError
+
     def flush(self, timestamp=None):
         super().flush(timestamp=timestamp)
 
@@ -132,7 +416,7 @@ class AlertMetric(CounterMetric):
             # Not enough time has elapsed since the previous alert
             return
 
-        rate = self.total * self.window_size / self.n_windows
+        rate = self.rate()
         if not self.triggered and rate >= self.threshold:
             self.triggered = True
             self.triggered_at = self.head
@@ -145,6 +429,350 @@ class AlertMetric(CounterMetric):
             self.triggered_rate = rate
             return self.ALERT_STOP
 
+    def _params(self):
+        params = super()._params()
+        params['threshold'] = self.threshold
+        return params
+
+    def snapshot(self):
+        data = super().snapshot()
+        data['triggered'] = self.triggered
+        data['triggered_rate'] = self.triggered_rate
+        data['triggered_at'] = self.triggered_at
+        return data
+
+    def restore(self, data):
+        super().restore(data)
+        self.triggered = data['triggered']
+        self.triggered_rate = data['triggered_rate']
+        self.triggered_at = data['triggered_at']
+
+
+class AlertMetric(ThresholdAlertMixin, CounterMetric):
+    """
+    An extension of the CounterMetric that watches the avg. rate of events
+    over the entire window, and returns an alert when the rate crosses a given
+    threshold.
+    """
+
+    def __init__(self, window_size=1, n_windows=120, threshold=10,
+                 allowed_lateness=None):
+        super().__init__(window_size, n_windows, allowed_lateness)
+        self._init_alert(threshold)
+
+    def rate(self):
+        return self.total * self.window_size / self.n_windows
+
+
+class RollupLevel:
+    """
+    One of the coarser resolutions kept by a RollupMetric, e.g. 10 second
+    buckets built from the 1 second windows.
+
+    Each bucket stores the total, and the smallest and largest of the
+    finest windows that went into it, so the chart can still show the
+    spikes after they've been averaged out. Buckets are filled one finer
+    bucket at a time as it's completed, and pushed to the next level when
+    the head moves on, so the cost per window is O(1) amortized and the
+    memory is fixed.
+    """
+
+    def __init__(self, window_size, n_windows, source_size, base_size):
+        """
+        Params:
+            window_size (int): The length of each bucket, in seconds.
+            n_windows (int): The number of buckets kept in memory.
+            source_size (int): The bucket length of the finer level that
+                this one is built from, must divide ``window_size``.
+            base_size (int): The window length of the finest level, which
+                the min and max are measured in.
+        """
+        self.window_size = window_size
+        self.n_windows = n_windows
+        self.source_size = source_size
+        self.base_size = base_size
+
+        # The number of finer buckets that make up a full bucket
+        self.ratio = window_size // source_size
+
+        # The coarser level that the completed buckets are pushed to
+        self.next = None
+
+        self.head = None
+
+        # The number of buckets that have been pushed, up to n_windows, so
+        # the time before the first point isn't shown as idle
+        self.filled = 0
+
+        self.sums = RingBuffer(n_windows, int, 'q')
+        self.mins = RingBuffer(n_windows, int, 'q')
+        self.maxes = RingBuffer(n_windows, int, 'q')
+
+        # The bucket at the head, which is still being filled
+        self._reset()
+
+    def _reset(self):
+        self._sum = 0
+        self._min = None
+        self._max = None
+        self._count = 0
+
+    def add(self, window, total, low, high):
+        """
+        Add a completed bucket from the finer level.
+
+        Params:
+            window (int): The start of the finer bucket.
+            total (int): The number of events in the finer bucket.
+            low (int): The smallest of the finest windows in the bucket.
+            high (int): The largest of the finest windows in the bucket.
+        """
+        start = window - window % self.window_size
+        if self.head is None:
+            self.head = start
+        elif start > self.head:
+            self._roll(start)
+        elif start < self.head:
+            self.add_late(window, total, high)
+            return
+
+        self._sum += total
+        self._min = low if self._min is None else min(self._min, low)
+        self._max = high if self._max is None else max(self._max, high)
+        self._count += 1
+
+    def add_late(self, window, delta, high):
+        """
+        Add events to a finer bucket that was already completed, e.g. when
+        a point arrives after its window was flushed in event time mode.
+        Late points can only make a window larger, so the min is left as-is.
+
+        Params:
+            window (int): The start of the finer bucket.
+            delta (int): The number of events that were added to it.
+            high (int): The new value of the finest window that they were
+                added to.
+        """
+        start = window - window % self.window_size
+        if self.head is None:
+            self.head = start
+        elif start > self.head:
+            self._roll(start)
+
+        if start == self.head:
+            # Will be pushed to the next level along with the bucket
+            self._sum += delta
+            self._max = high if self._max is None else max(self._max, high)
+            return
+
+        offset = int((self.head - start) // self.window_size)
+        if offset > self.n_windows:
+            return
+        self.sums[offset - 1] += delta
+        if high > self.maxes[offset - 1]:
+            self.maxes[offset - 1] = high
+        if self.next is not None:
+            self.next.add_late(start, delta, high)
+
+    def _roll(self, start):
+        # A bucket that's missing some of its finer buckets was idle for
+        # part of the time, so its smallest window was empty
+        low = self._min if self._count >= self.ratio else 0
+        high = self._max or 0
+        self.sums.push(self._sum)
+        self.mins.push(low)
+        self.maxes.push(high)
+        if self.next is not None:
+            self.next.add(self.head, self._sum, low, high)
+
+        offset = int((start - self.head) // self.window_size)
+        gap = min(offset - 1, self.n_windows)
+        for _ in range(gap):
+            self.sums.push(0)
+            self.mins.push(0)
+            self.maxes.push(0)
+        self.filled = min(self.filled + 1 + gap, self.n_windows)
+        if offset > 1 and self.next is not None:
+            # Keep the next level's head in step with this one
+            self.next.add(start - self.window_size, 0, 0, 0)
+
+        self.head = start
+        self._reset()
+
+    def rates(self, n=None):
+        """
+        The newest ``n`` buckets from oldest to newest, as the (avg, min,
+        max) events per finest window. The last item is the bucket that's
+        still being filled, averaged over the part that's been filled.
+        """
+        if self.head is None:
+            return []
+
+        n = self.n_windows + 1 if n is None else n
+        count = min(n - 1, self.filled)
+        scale = self.base_size / self.window_size
+        items = [(total * scale, low, high) for total, low, high in zip(
+            self.sums.chronological(count), self.mins.chronological(count),
+            self.maxes.chronological(count))]
+        if self._count:
+            scale = self.base_size / (self._count * self.source_size)
+            items.append((self._sum * scale, self._min, self._max))
+        return items[-n:]
+
+    def merge(self, other):
+        """
+        Combine the buckets from the same level of another metric.
+        """
+        if other.head is None:
+            return
+        if self.head is None:
+            self.head = other.head
+        elif other.head > self.head:
+            self._roll(other.head)
+
+        if other._count:
+            if other.head == self.head:
+                self._sum += other._sum
+                self._min = other._min if self._min is None else min(
+                    self._min, other._min)
+                self._max = other._max if self._max is None else max(
+                    self._max, other._max)
+                self._count = max(self._count, other._count)
+            else:
+                self.add_late(other.head, other._sum, other._max)
+
+        # The other level's buckets were already pushed to its own next
+        # level, which is merged separately
+        offset = int((self.head - other.head) // self.window_size)
+        self.filled = max(self.filled, min(
+            other.filled + offset, self.n_windows))
+        for index in range(offset, min(offset + other.filled,
+                                       self.n_windows)):
+            source = index - offset
+            self.sums[index] += other.sums[source]
+            self.mins[index] = min(self.mins[index], other.mins[source])
+            self.maxes[index] = max(self.maxes[index], other.maxes[source])
+
+    def snapshot(self):
+        return {
+            'head': self.head,
+            'filled': self.filled,
+            'sums': list(self.sums),
+            'mins': list(self.mins),
+            'maxes': list(self.maxes),
+            'pending': [self._sum, self._min, self._max, self._count],
+        }
+
+    def restore(self, data):
+        self.head = data['head']
+        self.filled = data['filled']
+        for name in ('sums', 'mins', 'maxes'):
+            buffer = RingBuffer(self.n_windows, int, 'q')
+            for index, value in enumerate(data[name]):
+                buffer[index] = value
+            setattr(self, name, buffer)
+        self._sum, self._min, self._max, self._count = data['pending']
+
+
+class RollupMetric(CounterMetric):
+    """
+    A CounterMetric that also keeps a long history at coarser resolutions.
+
+    The full resolution windows are kept as usual. As each window is
+    completed it's added to the first level, e.g. 10 second buckets, and
+    each of those is added to the next level when it's completed, and so
+    on. A day of traffic can then be kept in a few thousand integers
+    instead of 86,400.
+    """
+
+    def __init__(self, window_size=1, n_windows=300, allowed_lateness=None,
+                 levels=((10, 360), (60, 1440), (3600, 168))):
+        """
+        Params:
+            levels (list): The (window_size, n_windows) of each coarser
+                level, from finest to coarsest. Each window size must be a
+                multiple of the previous one.
+        """
+        super().__init__(window_size, n_windows, allowed_lateness)
+
+        self.levels = []
+        source = window_size
+        for size, count in levels:
+            if size <= source or size % source:
+                raise ValueError(
+                    'Rollup window {}s is not a multiple of {}s'.format(
+                        size, source))
+            level = RollupLevel(size, count, source, window_size)
+            if self.levels:
+                self.levels[-1].next = level
+            self.levels.append(level)
+            source = size
+
+        # The start of the window that's being pushed into the history, and
+        # the head that the window is advancing to
+        self._pushed = None
+        self._new_head = None
+        self._propagate = True
+
+    def _advance(self, window):
+        self._pushed, self._new_head = self.head, window
+        super()._advance(window)
+
+    def _history_update(self, buffer):
+        super()._history_update(buffer)
+        if self.levels and self._pushed is not None:
+            self.levels[0].add(self._pushed, buffer, buffer, buffer)
+            self._pushed += self.window_size
+
+    def _history_fill(self, count):
+        # The zeros stand in for the windows just before the new head, even
+        # if the gap was longer than the history
+        self._pushed = self._new_head - count * self.window_size
+        super()._history_fill(count)
+
+    def _history_add(self, index, value):
+        super()._history_add(index, value)
+        if self.levels and self._propagate:
+            window = self.head - (index + 1) * self.window_size
+            self.levels[0].add_late(window, value, self.history[index])
+
+    def merge(self, other):
+        if self._params()['levels'] != other._params()['levels']:
+            raise ValueError('Cannot merge metrics with different rollups')
+
+        # The other metric's history was already rolled up into its own
+        # levels, only the points still in its buffer need to be added
+        self._propagate = False
+        try:
+            super().merge(other)
+        finally:
+            self._propagate = True
+
+        if self.levels and other.head is not None and other.buffer:
+            offset = int((self.head - other.head) // self.window_size)
+            if 0 < offset <= self.n_windows:
+                self.levels[0].add_late(
+                    other.head, other.buffer, self.history[offset - 1])
+
+        for level, other_level in zip(self.levels, other.levels):
+            level.merge(other_level)
+
+    def _params(self):
+        params = super()._params()
+        params['levels'] = [[level.window_size, level.n_windows]
+                            for level in self.levels]
+        return params
+
+    def snapshot(self):
+        data = super().snapshot()
+        data['levels'] = [level.snapshot() for level in self.levels]
+        return data
+
+    def restore(self, data):
+        super().restore(data)
+        for level, level_data in zip(self.levels, data['levels']):
+            level.restore(level_data)
+
 
 class TaggedCounterMetric(SlidingWindowBase):
     """
@@ -155,10 +783,597 @@ class TaggedCounterMetric(SlidingWindowBase):
 
     datatype = Counter
 
-    def add_point(self, tags=None):
+    def _encode(self, value):
+        # JSON objects can't use None as a key, so store the items as a list
+        return [[tag, count] for tag, count in value.items()]
+
+    def _decode(self, value):
+        return Counter({tag: count for tag, count in value})
+
+    def _count(self, value):
+        return value[None]
+
+    def add_point(self, tags=None, count=1, timestamp=None):
+        buffer = self.buffer if timestamp is None else self.datatype()
+
         tags = tags or []
         for tag in tags:
-            self.buffer[tag] += 1
+            buffer[tag] += count
 
         # None is a special tag that holds the combined total for all points
-        self.buffer[None] += 1
+        buffer[None] += count
+
+        if timestamp is not None:
+            self._add(buffer, timestamp, count)
+
+    def add_points(self, tags, timestamp=None, weight=1):
+        """
+        Add a batch of points at once, with a single tag for each point.
+        When the points are a 1 in N sample, each one counts as ``weight``
+        points.
+        """
+        buffer = self.buffer if timestamp is None else self.datatype()
+        if weight == 1:
+            buffer.update(tags)
+        else:
+            buffer.update({tag: count * weight
+                           for tag, count in Counter(tags).items()})
+        count = len(tags) * weight
+        buffer[None] += count
+
+        if timestamp is not None:
+            self._add(buffer, timestamp, count)
+
+    def add_counter(self, counter, timestamp=None):
+        """
+        Add pre-aggregated counts, the counter must include the combined
+        total for all of the points under the None tag.
+        """
+        self._add(counter, timestamp, counter[None])
+
+
+class HeavyHitters:
+    """
+    A fixed-size approximation of a collections.Counter that only tracks the
+    most frequent items, using a variant of the Space-Saving algorithm.
+
+    Up to 2x ``capacity`` items are counted exactly. When that limit is
+    exceeded, everything except the ``capacity`` largest items is evicted in
+    a single pass, and ``floor`` is raised to the largest count that was
+    thrown away. New items start counting from the floor, so the counts are
+    never underestimated, and each item's count is too high by at most its
+    ``error()``. Evicting in batches keeps the amortized cost of each update
+    constant, regardless of how many distinct items are in the stream.
+
+    The None key is special and holds the exact total of all of the counts,
+    the same as it does in TaggedCounterMetric.
+    """
+
+    def __init__(self, capacity=100):
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+        self.floor = 0
+        self.n = 0
+
+    def __len__(self):
+        return len(self.counts)
+
+    def __getitem__(self, key):
+        if key is None:
+            return self.n
+        return self.counts.get(key, 0)
+
+    def __setitem__(self, key, value):
+        if key is None:
+            self.n = value
+        elif key in self.counts:
+            self.counts[key] = value
+        else:
+            self.counts[key] = self.floor + value
+            self.errors[key] = self.floor
+            if len(self.counts) > 2 * self.capacity:
+                self._prune()
+
+    def get(self, key, default=None):
+        value = self[key]
+        return value if value else default
+
+    def error(self, key):
+        """
+        The maximum amount that the count for the key could be overestimated.
+        """
+        return self.errors.get(key, self.floor)
+
+    def update(self, items):
+        """
+        Add counts from an iterable of keys or a mapping of key -> count.
+        """
+        if not hasattr(items, 'items'):
+            items = Counter(items)
+        for key, count in items.items():
+            self[key] += count
+
+    def most_common(self, n=None):
+        """
+        Return the n most common items, like Counter.most_common(). The None
+        key is not included.
+        """
+        items = sorted(self.counts.items(), key=itemgetter(1), reverse=True)
+        return items if n is None else items[:n]
+
+    def __iadd__(self, other):
+        if not isinstance(other, HeavyHitters):
+            self.update(other)
+            return self
+
+        # Items that are missing from either sketch could have been counted
+        # up to that sketch's floor, so the floor is added to keep the counts
+        # as upper bounds.
+        for key in self.counts:
+            if key not in other.counts:
+                self.counts[key] += other.floor
+                self.errors[key] += other.floor
+        for key, count in other.counts.items():
+            if key in self.counts:
+                self.counts[key] += count
+                self.errors[key] += other.errors[key]
+            else:
+                self.counts[key] = self.floor + count
+                self.errors[key] = self.floor + other.errors[key]
+
+        self.floor += other.floor
+        self.n += other.n
+        if len(self.counts) > 2 * self.capacity:
+            self._prune()
+        return self
+
+    def _prune(self):
+        items = self.most_common()
+        self.floor = max(self.floor, items[self.capacity][1])
+        for key, _ in items[self.capacity:]:
+            del self.counts[key]
+            del self.errors[key]
+
+
+class TopKCounterMetric(TaggedCounterMetric):
+    """
+    A TaggedCounterMetric that stores each window in a HeavyHitters sketch
+    instead of a Counter. Memory use and the cost of each flush depend only
+    on the capacity, not the number of distinct tags, at the expense of
+    approximate counts for the less frequent tags.
+    """
+
+    def __init__(self, window_size=1, n_windows=10, capacity=100,
+                 allowed_lateness=None):
+        """
+        Params:
+            capacity (int): The number of tags tracked in each window.
+        """
+        self.capacity = capacity
+        self.datatype = partial(HeavyHitters, capacity)
+        super().__init__(window_size, n_windows, allowed_lateness)
+
+    def _history_update(self, buffer):
+        self.history.push(buffer)
+        self._rebuild_total()
+
+    def _history_fill(self, count):
+        for _ in range(count):
+            self.history.push(self.datatype())
+        self._rebuild_total()
+
+    def _rebuild_total(self):
+        # Sketches can't be subtracted, so the total is rebuilt by merging
+        # the windows, which is O(n_windows * capacity).
+        total = self.datatype()
+        for value in self.history:
+            total += value
+        self.total = total
+
+    def _params(self):
+        params = super()._params()
+        params['capacity'] = self.capacity
+        return params
+
+    def _encode(self, value):
+        return {
+            'n': value.n,
+            'floor': value.floor,
+            'counts': [[key, count, value.errors[key]]
+                       for key, count in value.counts.items()],
+        }
+
+    def _decode(self, value):
+        sketch = self.datatype()
+        sketch.n = value['n']
+        sketch.floor = value['floor']
+        for key, count, error in value['counts']:
+            sketch.counts[key] = count
+            sketch.errors[key] = error
+        return sketch
+
+
+class LogHistogram:
+    """
+    A fixed-size histogram with logarithmically spaced buckets, in the same
+    spirit as an HDR histogram or DDSketch.
+
+    Every value between ``min_value`` and ``max_value`` is counted in the
+    bucket that covers it, and the quantiles are estimated to within the
+    given relative ``accuracy`` (1% means a p99 of 200ms is reported as
+    somewhere between 198ms and 202ms). Adding a value is O(1), the memory
+    use is fixed by the range and the accuracy, and two histograms with the
+    same parameters can be combined by adding their buckets together.
+
+    Values of zero or less are counted separately, values outside of the
+    range are clamped to the first or last bucket.
+    """
+
+    def __init__(self, min_value=1e-6, max_value=1e6, accuracy=0.01):
+        """
+        Params:
+            min_value (float): The smallest value that's tracked accurately.
+            max_value (float): The largest value that's tracked accurately.
+            accuracy (float): The relative error of the quantiles.
+        """
+        self.min_value = min_value
+        self.max_value = max_value
+        self.accuracy = accuracy
+
+        self._gamma = (1 + accuracy) / (1 - accuracy)
+        self._scale = 1 / math.log(self._gamma)
+        self._offset = math.floor(math.log(min_value) * self._scale)
+        n_buckets = math.floor(math.log(max_value) * self._scale)
+        n_buckets = n_buckets - self._offset + 1
+
+        self.counts = array('q', [0]) * n_buckets
+        self.zero = 0
+        self.count = 0
+        self.sum = 0
+
+    def __repr__(self):
+        return 'LogHistogram(count={}, sum={})'.format(self.count, self.sum)
+
+    def __eq__(self, other):
+        return (self.counts, self.zero, self.count, self.sum) == (
+            other.counts, other.zero, other.count, other.sum)
+
+    def add(self, value, count=1):
+        self.count += count
+        self.sum += value * count
+        if value <= 0:
+            self.zero += count
+            return
+
+        index = math.floor(math.log(value) * self._scale) - self._offset
+        if index < 0:
+            index = 0
+        elif index >= len(self.counts):
+            index = len(self.counts) - 1
+        self.counts[index] += count
+
+    def _combine(self, other, op):
+        if len(other.counts) != len(self.counts):
+            raise ValueError('Cannot combine histograms with different ranges')
+        self.counts = array('q', map(op, self.counts, other.counts))
+        self.zero = op(self.zero, other.zero)
+        self.count = op(self.count, other.count)
+        self.sum = op(self.sum, other.sum)
+        return self
+
+    def __iadd__(self, other):
+        return self._combine(other, add)
+
+    def __isub__(self, other):
+        return self._combine(other, sub)
+
+    def mean(self):
+        return self.sum / self.count if self.count else None
+
+    def quantile(self, q):
+        """
+        Estimate the value at quantile ``q`` (0.5 for the median), or None if
+        the histogram is empty.
+        """
+        if self.count <= 0:
+            return None
+
+        rank = q * (self.count - 1)
+        seen = self.zero
+        if seen > rank:
+            return 0
+
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen > rank:
+                # The middle of the bucket, which keeps the relative error
+                # within the accuracy for any value that landed in it
+                upper = self._gamma ** (index + self._offset + 1)
+                return 2 * upper / (self._gamma + 1)
+        return self.max_value
+
+
+class QuantileMetric(SlidingWindowBase):
+    """
+    A sliding window that keeps a LogHistogram of the values that were seen
+    in each time increment, e.g. request latencies or response sizes. The
+    ``total`` is a histogram covering the whole window, so percentiles over
+    the last N seconds can be read directly from it.
+    """
+
+    def __init__(self, window_size=1, n_windows=10, min_value=1e-6,
+                 max_value=1e6, accuracy=0.01, allowed_lateness=None):
+        """
+        Params:
+            min_value (float): The smallest value that's tracked accurately.
+            max_value (float): The largest value that's tracked accurately.
+            accuracy (float): The relative error of the quantiles.
+        """
+        self.min_value = min_value
+        self.max_value = max_value
+        self.accuracy = accuracy
+        self.datatype = partial(LogHistogram, min_value, max_value, accuracy)
+        super().__init__(window_size, n_windows, allowed_lateness)
+
+    def add_point(self, value, timestamp=None):
+        self.add_values([value], timestamp)
+
+    def add_values(self, values, timestamp=None):
+        """
+        Add a batch of values that share the same timestamp.
+        """
+        if timestamp is not None:
+            window = timestamp - timestamp % self.window_size
+            if window != self.head:
+                # Only allocate a histogram when the values don't belong in
+                # the current buffer
+                histogram = self.datatype()
+                for value in values:
+                    histogram.add(value)
+                self._add(histogram, timestamp, len(values))
+                return
+
+        buffer = self.buffer
+        for value in values:
+            buffer.add(value)
+
+    def _params(self):
+        params = super()._params()
+        params.update(min_value=self.min_value, max_value=self.max_value,
+                      accuracy=self.accuracy)
+        return params
+
+    def _encode(self, value):
+        return {
+            'zero': value.zero,
+            'count': value.count,
+            'sum': value.sum,
+            'counts': [[i, c] for i, c in enumerate(value.counts) if c],
+        }
+
+    def _decode(self, value):
+        histogram = self.datatype()
+        histogram.zero = value['zero']
+        histogram.count = value['count']
+        histogram.sum = value['sum']
+        for index, count in value['counts']:
+            histogram.counts[index] = count
+        return histogram
+
+    def _count(self, value):
+        return value.count
+
+
+class StatusCounts:
+    """
+    The number of responses for each HTTP status code.
+
+    The counts are kept in a flat integer array that's indexed by the status
+    code itself, so adding to a code is a single array increment instead of
+    hashing a key, and the memory use is fixed no matter how many distinct
+    codes show up. The counts for each status class (2xx, 3xx, ...) are
+    summed from slices of the array when they're needed. Codes outside of
+    100-599 are counted together in slot 0.
+    """
+
+    size = 600
+
+    def __init__(self):
+        self.counts = array('q', [0]) * self.size
+
+    def __repr__(self):
+        return 'StatusCounts({!r})'.format(dict(self.items()))
+
+    def __eq__(self, other):
+        return self.counts == other.counts
+
+    def add(self, code, count=1):
+        self.counts[code if 0 < code < self.size else 0] += count
+
+    def update(self, tally):
+        """
+        Add a mapping of status codes to counts. The codes can be strings
+        or integers.
+        """
+        counts, size = self.counts, self.size
+        for code, count in tally.items():
+            code = int(code)
+            counts[code if 0 < code < size else 0] += count
+
+    def add_codes(self, codes):
+        """
+        Count a batch of status codes, given as strings or integers.
+        """
+        # Counter tallies the batch in C, a batch only has a few distinct
+        # codes so there's very little left to do in python
+        self.update(Counter(codes))
+
+    def _combine(self, other, sign):
+        counts = self.counts
+        for code, count in other.items():
+            counts[code] += sign * count
+        return self
+
+    def __iadd__(self, other):
+        return self._combine(other, 1)
+
+    def __isub__(self, other):
+        return self._combine(other, -1)
+
+    def items(self):
+        """
+        The (code, count) pairs for every code that has been seen.
+        """
+        return [(code, count) for code, count in enumerate(self.counts)
+                if count]
+
+    def total(self):
+        return sum(self.counts)
+
+    def classes(self):
+        """
+        The counts for each status class, index 1 holds the 1xx responses
+        and so on. Index 0 holds the unknown codes.
+        """
+        counts = self.counts
+        classes = [counts[0]]
+        for start in range(100, self.size, 100):
+            classes.append(sum(counts[start:start + 100]))
+        return classes
+
+
+class StatusMetric(SlidingWindowBase):
+    """
+    A sliding window that counts the HTTP status codes in each time
+    increment.
+    """
+
+    datatype = StatusCounts
+
+    def add_point(self, code, timestamp=None):
+        self.add_counts({code: 1}, timestamp)
+
+    def add_counts(self, tally, timestamp=None):
+        """
+        Add a mapping of status codes to counts that share the same
+        timestamp, e.g. a Counter of the codes in a batch of lines.
+        """
+        if timestamp is not None:
+            window = timestamp - timestamp % self.window_size
+            if window != self.head:
+                # Only allocate a new array when the codes don't belong in
+                # the current buffer
+                counts = self.datatype()
+                counts.update(tally)
+                self._add(counts, timestamp, sum(tally.values()))
+                return
+
+        self.buffer.update(tally)
+
+    def _encode(self, value):
+        return value.items()
+
+    def _decode(self, value):
+        counts = self.datatype()
+        counts.update(dict(value))
+        return counts
+
+    def _count(self, value):
+        return value.total()
+
+
+class ErrorRateAlertMetric(ThresholdAlertMixin, StatusMetric):
+    """
+    An extension of the StatusMetric that watches the fraction of responses
+    that were server errors (5xx) over the entire window, and returns an
+    alert when it crosses a given threshold.
+
+    Unlike the traffic alert this fires on a ratio, so a quiet period with
+    a handful of failed requests could look like an outage. The rate is
+    treated as zero until the window holds at least ``min_requests``.
+    """
+
+    def __init__(self, window_size=1, n_windows=60, threshold=0.05,
+                 min_requests=20, allowed_lateness=None):
+        """
+        Params:
+            threshold (float): The fraction of 5xx responses, from 0 to 1.
+            min_requests (int): The number of responses needed in the window
+                before the alert can be triggered.
+        """
+        super().__init__(window_size, n_windows, allowed_lateness)
+        self._init_alert(threshold)
+        self.min_requests = min_requests
+
+    def rate(self):
+        classes = self.total.classes()
+        total = sum(classes)
+        if total < self.min_requests:
+            return 0.0
+        return classes[5] / total
+
+    def _params(self):
+        params = super()._params()
+        params['min_requests'] = self.min_requests
+        return params
+
+
+class ReservoirSample:
+    """
+    Keeps a uniform random sample of a fixed number of items from a stream
+    of unknown length, using Vitter's Algorithm R.
+
+    Once the sample is full, the n-th item replaces a random slot with
+    probability size / n, so a flood of bad lines costs one random number
+    per line and the memory use never grows.
+    """
+
+    def __init__(self, size=20, seed=None):
+        """
+        Params:
+            size (int): The maximum number of items to keep.
+            seed (int): Seed for the random number generator, for tests.
+        """
+        self.size = size
+        self.seen = 0
+        self.items = []
+        self._random = random.Random(seed).random
+
+    def __len__(self):
+        return len(self.items)
+
+    def add(self, item):
+        self.extend((item,))
+
+    def extend(self, items):
+        sample, size, rand = self.items, self.size, self._random
+        seen = self.seen
+        for item in items:
+            seen += 1
+            if seen <= size:
+                sample.append(item)
+            else:
+                index = int(rand() * seen)
+                if index < size:
+                    sample[index] = item
+        self.seen = seen
+
+    def clear(self):
+        self.seen = 0
+        self.items = []
+
+
+def encode_snapshot(data):
+    """
+    Serialize a snapshot dict into compact, compressed bytes.
+    """
+    text = json.dumps(data, separators=(',', ':'))
+    return zlib.compress(text.encode('utf-8'))
+
+
+def decode_snapshot(payload):
+    """
+    The inverse of encode_snapshot().
+    """
+    return json.loads(zlib.decompress(payload).decode('utf-8'))
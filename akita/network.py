@@ -0,0 +1,376 @@
+import os
+import stat
+import time
+import socket
+import struct
+import logging
+import selectors
+from collections import Counter
+from itertools import groupby
+
+from .logformat import create_parser
+from .reader import open_reader
+from .pipeline import BatchSummary
+from .metrics import TaggedCounterMetric, StatusMetric
+from .metrics import encode_snapshot, decode_snapshot
+
+
+_logger = logging.getLogger('akita')
+
+# Leave some room under the 65507 byte limit for UDP datagrams
+MAX_DATAGRAM_SIZE = 65000
+
+# TCP connections send each delta with a 4-byte length prefix
+FRAME_HEADER = struct.Struct('!I')
+
+# A TCP peer that announces a larger frame is disconnected, instead of
+# buffering whatever it sends
+MAX_FRAME_SIZE = 16 * 1024 * 1024
+
+
+def parse_address(address):
+    """
+    Split an address like udp://host:port, tcp://host:port or
+    unix:///path/to/socket into the scheme and a socket address.
+    """
+    scheme, sep, rest = address.partition('://')
+    if not sep or scheme not in ('udp', 'tcp', 'unix'):
+        raise ValueError('Invalid address: {}'.format(address))
+
+    if scheme == 'unix':
+        return scheme, rest
+
+    host, _, port = rest.rpartition(':')
+    return scheme, (host.strip('[]') or '0.0.0.0', int(port))
+
+
+def encode_delta(delta):
+    return encode_snapshot(delta)
+
+
+def decode_delta(payload):
+    return decode_snapshot(payload)
+
+
+def delta_to_summary(delta):
+    """
+    Convert a delta that was published by an agent into a BatchSummary that
+    can be added to a MetricsAggregator.
+    """
+    summary = BatchSummary(delta['lines'], delta['errors'])
+    # Older agents don't send the reasons
+    summary.error_reasons.update(delta.get('error_reasons', {}))
+    for window, hits, tags, *rest in delta['windows']:
+        subpaths = Counter({tag: count for tag, count in tags})
+        subpaths[None] = hits
+
+        # Agents from before status codes were added only send 3 items
+        statuses = Counter({code: count for code, count in
+                            (rest[0] if rest else [])})
+        summary.windows.append([window, hits, subpaths, statuses])
+    return summary
+
+
+class DeltaSender:
+    """
+    Publishes encoded deltas to a collector.
+    """
+
+    def __init__(self, address):
+        self.address = address
+        self.scheme, self.sockaddr = parse_address(address)
+        self.sock = None
+
+    def _connect(self):
+        if self.scheme == 'tcp':
+            self.sock = socket.create_connection(self.sockaddr)
+        elif self.scheme == 'udp':
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        else:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+
+    def send(self, payload):
+        """
+        Send a payload, returns False if it couldn't be delivered. Failures
+        are never fatal because the collector may not be running yet.
+        """
+        try:
+            if self.sock is None:
+                self._connect()
+            if self.scheme == 'tcp':
+                self.sock.sendall(FRAME_HEADER.pack(len(payload)) + payload)
+            elif len(payload) > MAX_DATAGRAM_SIZE:
+                _logger.warning('Delta is too large to send, %d bytes',
+                                len(payload))
+                return False
+            else:
+                self.sock.sendto(payload, self.sockaddr)
+        except OSError as e:
+            _logger.warning('Unable to send delta to %s: %s', self.address, e)
+            self.close()
+            return False
+        return True
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+
+class DeltaReceiver:
+    """
+    Listens for deltas from any number of agents on a single socket, and
+    calls ``on_delta(delta)`` for each one that's received.
+
+    Everything is handled on one thread using a selector, including TCP
+    connections from multiple agents.
+    """
+
+    def __init__(self, address, on_delta):
+        self.scheme, sockaddr = parse_address(address)
+        self.on_delta = on_delta
+        self.selector = selectors.DefaultSelector()
+        self._buffers = {}
+
+        if self.scheme == 'unix':
+            try:
+                mode = os.stat(sockaddr).st_mode
+            except FileNotFoundError:
+                mode = 0
+            if stat.S_ISSOCK(mode):
+                # Clean up the socket from a previous run, anything else at
+                # the path is left alone and binding will fail
+                os.unlink(sockaddr)
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        elif self.scheme == 'udp':
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        else:
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+
+        self.sock.bind(sockaddr)
+        if self.scheme == 'tcp':
+            self.sock.listen()
+        self.selector.register(self.sock, selectors.EVENT_READ)
+
+    @property
+    def address(self):
+        """
+        The address that the socket is bound to, useful when binding to port
+        zero to let the OS pick a free port.
+        """
+        sockaddr = self.sock.getsockname()
+        if self.scheme == 'unix':
+            return 'unix://' + sockaddr
+        return '{}://{}:{}'.format(self.scheme, sockaddr[0], sockaddr[1])
+
+    def fileno(self):
+        """
+        A descriptor that becomes readable when any of the sockets have
+        data, or None if the platform's selector doesn't provide one.
+        """
+        try:
+            return self.selector.fileno()
+        except AttributeError:
+            return None
+
+    def poll(self, timeout=None):
+        """
+        Wait for up to ``timeout`` seconds and handle any incoming data.
+        Returns the number of deltas that were received.
+        """
+        count = 0
+        for key, _ in self.selector.select(timeout):
+            sock = key.fileobj
+            if sock is not self.sock:
+                count += self._read_stream(sock)
+            elif self.scheme == 'tcp':
+                conn, _ = sock.accept()
+                conn.setblocking(False)
+                self._buffers[conn] = b''
+                self.selector.register(conn, selectors.EVENT_READ)
+            else:
+                payload = sock.recv(65536)
+                count += self._handle(payload)
+        return count
+
+    def _read_stream(self, conn):
+        try:
+            data = conn.recv(65536)
+        except OSError:
+            data = b''
+        if not data:
+            self._close_stream(conn)
+            return 0
+
+        buffer = self._buffers[conn] + data
+        count = 0
+        while len(buffer) >= FRAME_HEADER.size:
+            (size,) = FRAME_HEADER.unpack_from(buffer)
+            if size > MAX_FRAME_SIZE:
+                _logger.warning('Closing connection that sent a %d byte '
+                                'frame', size)
+                self._close_stream(conn)
+                return count
+            end = FRAME_HEADER.size + size
+            if len(buffer) < end:
+                break
+            count += self._handle(buffer[FRAME_HEADER.size:end])
+            buffer = buffer[end:]
+        self._buffers[conn] = buffer
+        return count
+
+    def _close_stream(self, conn):
+        self.selector.unregister(conn)
+        del self._buffers[conn]
+        conn.close()
+
+    def _handle(self, payload):
+        try:
+            delta = decode_delta(payload)
+        except Exception:
+            _logger.warning('Received an invalid delta')
+            return 0
+        self.on_delta(delta)
+        return 1
+
+    def close(self):
+        for conn in list(self._buffers):
+            conn.close()
+        self._buffers.clear()
+        self.selector.close()
+        self.sock.close()
+
+
+class Agent:
+    """
+    A lightweight process that watches a single log file and publishes the
+    per-window aggregates to a central collector at a regular interval.
+
+    Lines are bucketed into a TaggedCounterMetric, so the size of each delta
+    depends on the number of windows and sections, not the number of lines.
+    """
+
+    def __init__(self, log_file, address, interval=1.0, name=None,
+                 event_time=False, chunk_size=1024 * 1024, max_tags=100,
+                 log_format=None):
+        """
+        Params:
+            log_file (file): The log file, opened in binary mode.
+            address (str): The collector address, e.g. udp://host:port.
+            interval (float): How often to publish deltas, in seconds.
+            name (str): Identifies this agent to the collector.
+            event_time (bool): Bin points using the log timestamps instead
+                of the time that they were read.
+            chunk_size (int): The maximum number of bytes to read at once.
+            max_tags (int): The maximum number of sections to send for each
+                window, the rest are only counted in the window's total.
+            log_format (str): An Apache or nginx log format string, defaults
+                to the Combined Log Format.
+        """
+        self.interval = interval
+        self.name = name or '{}:{}'.format(
+            socket.gethostname(), getattr(log_file, 'name', '-'))
+        self.event_time = event_time
+        self.max_tags = max_tags
+
+        fields = ('subpath', 'status')
+        if event_time:
+            fields += ('timestamp',)
+        self.reader = open_reader(log_file, chunk_size=chunk_size)
+        self.http_parser = create_parser(fields, log_format)
+        self.sender = DeltaSender(address)
+
+        self.seq = 0
+        self._reset()
+
+    def _reset(self):
+        # Keep enough windows to hold a full interval plus some late points
+        n_windows = int(self.interval) + 60
+        self.buckets = TaggedCounterMetric(1, n_windows)
+        self.statuses = StatusMetric(1, n_windows)
+        self.n_lines = 0
+        self.n_errors = 0
+        self.error_reasons = Counter()
+
+    def process_lines(self, lines):
+        self.n_lines += len(lines)
+        rejects = []
+        points, n_errors = self.http_parser.parse_batch(lines, rejects)
+        self.n_errors += n_errors
+        if rejects:
+            self.error_reasons.update([reason for reason, _ in rejects])
+
+        if not self.event_time:
+            self._add_points(points, time.time())
+            return
+
+        def key(point):
+            return point['timestamp'] - point['timestamp'] % 1
+
+        for window, group in groupby(points, key=key):
+            self._add_points(list(group), window)
+
+    def _add_points(self, points, timestamp):
+        self.buckets.add_points([p['subpath'] for p in points],
+                                timestamp=timestamp)
+        self.statuses.add_counts(Counter([p['status'] for p in points]),
+                                 timestamp=timestamp)
+
+    def delta(self):
+        """
+        Build the delta containing everything since the last publish.
+        """
+        buckets, statuses = self.buckets, self.statuses
+        windows = []
+        if buckets.head is not None:
+            # Both metrics are always given the same timestamps, so their
+            # windows line up
+            values = zip([buckets.buffer] + list(buckets.history),
+                         [statuses.buffer] + list(statuses.history))
+            for offset, (counter, codes) in enumerate(values):
+                hits = counter[None]
+                if not hits:
+                    continue
+                window = buckets.head - offset * buckets.window_size
+                tags = [[tag, count] for tag, count
+                        in counter.most_common(self.max_tags + 1)
+                        if tag is not None][:self.max_tags]
+                codes = [[code, count] for code, count in codes.items()]
+                windows.append([window, hits, tags, codes])
+            windows.reverse()
+
+        return {
+            'agent': self.name,
+            'seq': self.seq,
+            'lines': self.n_lines,
+            'errors': self.n_errors,
+            'error_reasons': dict(self.error_reasons),
+            'dropped': buckets.dropped,
+            'windows': windows,
+        }
+
+    def publish(self):
+        """
+        Send the current delta to the collector and start a new one.
+        """
+        delta = self.delta()
+        self.seq += 1
+        self._reset()
+        return self.sender.send(encode_delta(delta))
+
+    def run_forever(self):
+        self.reader.seek_end()
+
+        next_publish = time.time() + self.interval
+        while True:
+            lines = self.reader.read_lines()
+            if lines:
+                self.process_lines(lines)
+            else:
+                # At the end of the file, wait for more data
+                self.reader.wait(max(0, next_publish - time.time()))
+
+            if time.time() >= next_publish:
+                self.publish()
+                next_publish = max(next_publish + self.interval, time.time())
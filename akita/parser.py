@@ -1,8 +1,121 @@
 import re
-from datetime import datetime
+import calendar
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
 from urllib.parse import urlparse
 
 
+# The reasons that a parser can reject a line for, see try_extract()
+EMPTY = 'empty'  # a blank line
+FORMAT = 'format'  # the line doesn't match the log format
+REQUEST = 'request'  # the request line doesn't have a path
+TIMESTAMP = 'timestamp'  # the time couldn't be decoded
+MISSING = 'missing'  # a required field isn't in the line
+VALUE = 'value'  # a field couldn't be converted, e.g. a status of "abc"
+
+
+class TimestampDecoder:
+    """
+    Converts Common Log Format timestamps into python objects.
+
+    Calling datetime.strptime() on every line is expensive, but consecutive
+    lines in a log file almost always share the same date, minute and time
+    zone. The epoch time for each "dd/Mon/YYYY:HH:MM zone" prefix is cached
+    in a small LRU cache, and the seconds are added on with plain integer
+    arithmetic. Anything that doesn't match the standard layout falls back
+    to strptime(), so the results are always identical.
+    """
+
+    # [24/Mar/2018:23:05:09 -0400]
+    date_fmt = "%d/%b/%Y:%H:%M:%S %z"
+
+    months = {
+        'Jan': 1, 'Feb': 2, 'Mar': 3, 'Apr': 4, 'May': 5, 'Jun': 6,
+        'Jul': 7, 'Aug': 8, 'Sep': 9, 'Oct': 10, 'Nov': 11, 'Dec': 12,
+    }
+
+    def __init__(self, maxsize=64):
+        """
+        Params:
+            maxsize (int): The maximum number of minute prefixes to cache.
+        """
+        self.maxsize = maxsize
+        self._cache = OrderedDict()
+
+    def to_timestamp(self, text):
+        """
+        Convert the timestamp string into seconds since the unix epoch.
+        """
+        entry = self._lookup(text)
+        if entry is None:
+            return datetime.strptime(text, self.date_fmt).timestamp()
+        return float(entry[0] + int(text[18:20]))
+
+    def to_datetime(self, text):
+        """
+        Convert the timestamp string into a timezone aware datetime.
+        """
+        entry = self._lookup(text)
+        if entry is None:
+            return datetime.strptime(text, self.date_fmt)
+        return entry[1].replace(second=int(text[18:20]))
+
+    def _lookup(self, text):
+        """
+        Return the cached (epoch, datetime) pair for the start of the minute,
+        or None if the text can't be decoded without using strptime().
+        """
+        if (len(text) != 26 or text[2] != '/' or text[6] != '/' or
+                text[11] != ':' or text[14] != ':' or text[17] != ':' or
+                text[20] != ' ' or not text[18:20].isdigit() or
+                text[18:20] > '59'):
+            return None
+
+        key = text[:17] + text[20:]
+        entry = self._cache.get(key)
+        if entry is not None:
+            self._cache.move_to_end(key)
+            return entry
+
+        entry = self._decode_minute(text)
+        if entry is not None:
+            self._cache[key] = entry
+            if len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+        return entry
+
+    def _decode_minute(self, text):
+        month = self.months.get(text[3:6])
+        zone = text[21:]
+        numbers = (text[0:2], text[7:11], text[12:14], text[15:17], zone[1:])
+        if (month is None or zone[0] not in '+-' or
+                not all(n.isdigit() for n in numbers) or zone[3:] > '59'):
+            return None
+
+        day, year, hour, minute = (int(n) for n in numbers[:4])
+        offset = timedelta(hours=int(zone[1:3]), minutes=int(zone[3:]))
+        if zone[0] == '-':
+            offset = -offset
+
+        try:
+            # Raises ValueError for invalid dates like Feb 31
+            dt = datetime(year, month, day, hour, minute,
+                          tzinfo=timezone(offset))
+        except ValueError:
+            return None
+
+        epoch = calendar.timegm(dt.utctimetuple())
+        return epoch, dt
+
+
+def _is_digits(text):
+    """
+    Equivalent to matching ``[0-9]+``. str.isdigit() also accepts other
+    digits like superscripts, which the regex doesn't.
+    """
+    return bool(text) and not text.strip('0123456789')
+
+
 class HTTPLogParser:
     """
     Extracts information from HTTP log lines
@@ -28,11 +141,47 @@ class HTTPLogParser:
         r'(\s+"(?P<referrer>.*?)")?',  # referrer "%{Referer}i"
         r'(\s+"(?P<agent>.*?)")?',  # user agent "%{User-agent}i"
         r'(\s+"(?P<cookies>.*?)")?',  # cookies "%{Cookies}i"
+        r'(\s+(?P<request_time>[0-9]+(?:\.[0-9]+)?))?',  # %D or $request_time
     ]
     pattern = re.compile(''.join(_parts) + r'\s*\Z')
 
     # [24/Mar/2018:23:05:09 -0400]
-    date_fmt = "%d/%b/%Y:%H:%M:%S %z"
+    date_fmt = TimestampDecoder.date_fmt
+
+    # All of the fields that can be extracted from a line
+    fields = (
+        'raw', 'host', 'user', 'time', 'request', 'status', 'size',
+        'referrer', 'agent', 'cookies', 'request_time', 'method', 'path',
+        'version', 'url_parts', 'subpath', 'datetime', 'timestamp',
+    )
+
+    _request_fields = {'request', 'method', 'path', 'version', 'url_parts',
+                       'subpath'}
+    _time_fields = {'time', 'datetime', 'timestamp'}
+    _tail_fields = {'referrer', 'agent', 'cookies'}
+
+    # The fields that are returned as they appear in the line
+    _simple_fields = ('host', 'user', 'status', 'size', 'referrer', 'agent',
+                      'cookies', 'request_time')
+
+    def __init__(self, fields=None):
+        """
+        Params:
+            fields (iterable): The names of the fields that should be
+                returned by extract(), defaults to all of the fields. Only
+                the work needed to compute these fields will be performed.
+        """
+        fields = self.fields if fields is None else tuple(fields)
+        unknown = set(fields) - set(self.fields)
+        if unknown:
+            raise ValueError('Unknown fields: {}'.format(', '.join(unknown)))
+
+        self.fields = fields
+        self._fields = set(fields)
+
+        # Each parser has its own cache, so parsers in different threads
+        # never share one
+        self.timestamp_decoder = TimestampDecoder()
 
     @classmethod
     def parse(cls, line):
@@ -54,3 +203,240 @@ class HTTPLogParser:
         data['datetime'] = datetime.strptime(data['time'], cls.date_fmt)
         data['timestamp'] = data['datetime'].timestamp()
         return data
+
+    def extract(self, line):
+        """
+        Parse a line and return only the selected fields. Raises a
+        ValueError that includes the reason if the line is rejected.
+        """
+        data, reason = self.try_extract(line)
+        if data is None:
+            raise ValueError('Invalid log line ({}): {!r}'.format(
+                reason, line[:200]))
+        return data
+
+    def try_extract(self, line):
+        """
+        Parse a line without raising an exception. Returns a tuple of
+        (data, None), or (None, reason) if the line was rejected where the
+        reason is one of the constants at the top of this module.
+
+        Well-formed lines are split apart using plain string operations,
+        which is much faster than matching the full regular expression.
+        Anything that doesn't look like a typical Combined Log Format line
+        falls back to the regex, after a couple of cheap checks that throw
+        out most corrupt lines before the regex gets a chance to backtrack
+        through them.
+        """
+        parts = self._split(line)
+        if parts is None:
+            reason = self._precheck(line)
+            if reason is not None:
+                return None, reason
+            match = self.pattern.match(line)
+            if match is None:
+                return None, FORMAT
+            parts = self._from_match(line, match)
+        return self._convert(*parts)
+
+    # Necessary conditions for the regex to match, any line that has a
+    # status and size after the request has to contain the first pattern.
+    # A line that doesn't end with a quoted field has to end with the size
+    # or a request time.
+    _status_pattern = re.compile(r'"\s+[0-9]+\s+\S')
+    _end_pattern = re.compile(
+        r'"\s+[0-9]+\s+\S+(?:\s+[0-9]+(?:\.[0-9]+)?)?\Z|'
+        r'"\s+[0-9]+(?:\.[0-9]+)?\Z')
+
+    def _precheck(self, line):
+        """
+        Return the reason that a line can't possibly match the regex, or
+        None if it might. Truncated lines usually fail here.
+        """
+        if not line or line.isspace():
+            return EMPTY
+        if self._status_pattern.search(line) is None:
+            return FORMAT
+        line = line.rstrip()
+        if line[-1] != '"' and self._end_pattern.search(line) is None:
+            return FORMAT
+        return None
+
+    def _from_match(self, line, match):
+        """
+        Pick the selected fields out of a regex match, the same way that
+        _split() does.
+        """
+        fields = self._fields
+        groups = match.groupdict()
+        data = {name: groups[name] for name in self._simple_fields
+                if name in fields}
+        if 'raw' in fields:
+            data['raw'] = line
+        return data, groups['request'], groups['time']
+
+    def _split(self, line):
+        """
+        The fast path for try_extract(), returns a tuple of the simple
+        fields, the request and the time, or None if the line can't be
+        handled without using the regular expression.
+        """
+        fields = self._fields
+
+        # host ident user [time] "request" status size "referrer" "agent"
+        i = line.find(' [')
+        if i == -1:
+            return None
+        head = line[:i]
+        if not head.isprintable():
+            # Tabs or other whitespace, which the regex treats as separators.
+            # Every whitespace character except a plain space is unprintable.
+            return None
+        head = head.split(' ')
+        if len(head) != 3 or not all(head):
+            return None
+
+        j = line.find('] "', i)
+        if j == -1:
+            return None
+        k = line.find('" ', j + 3)
+        if k == -1:
+            return None
+        request = line[j + 3:k]
+        if '"' in request:
+            return None
+
+        rest = line[k + 2:].split(None, 2)
+        if len(rest) < 2 or not _is_digits(rest[0]):
+            return None
+
+        tail = rest[2].strip() if len(rest) == 3 else ''
+
+        # An optional request time after the quoted fields, either Apache's
+        # %D in microseconds or nginx's $request_time in seconds
+        request_time = None
+        if tail and tail[-1] != '"':
+            tail, _, request_time = tail.rpartition(' ')
+            whole, dot, fraction = request_time.partition('.')
+            if not _is_digits(whole) or dot and not _is_digits(fraction):
+                return None
+            tail = tail.rstrip()
+
+        if tail:
+            tail = tail.split('"')
+            if len(tail) not in (3, 5, 7) or tail[0] or tail[-1]:
+                return None
+            if any(sep.strip() or not sep for sep in tail[2:-1:2]):
+                return None
+            tail = tail[1::2]
+        else:
+            tail = []
+        tail += [None] * (3 - len(tail))
+
+        data = {}
+        if 'raw' in fields:
+            data['raw'] = line
+        if 'host' in fields:
+            data['host'] = head[0]
+        if 'user' in fields:
+            data['user'] = head[2]
+        if 'status' in fields:
+            data['status'] = rest[0]
+        if 'size' in fields:
+            data['size'] = rest[1]
+        if 'referrer' in fields:
+            data['referrer'] = tail[0]
+        if 'agent' in fields:
+            data['agent'] = tail[1]
+        if 'cookies' in fields:
+            data['cookies'] = tail[2]
+        if 'request_time' in fields:
+            data['request_time'] = request_time
+
+        return data, request, line[i + 2:j]
+
+    def _convert(self, data, request, time):
+        """
+        Add the fields that are derived from the request and the time.
+        """
+        fields = self._fields
+        if fields & self._request_fields:
+            request_parts = request.split(' ')
+            if len(request_parts) < 2:
+                return None, REQUEST
+            path = request_parts[1]
+            if 'request' in fields:
+                data['request'] = request
+            if 'method' in fields:
+                data['method'] = request_parts[0]
+            if 'path' in fields:
+                data['path'] = path
+            if 'version' in fields:
+                if len(request_parts) > 2:
+                    data['version'] = request_parts[2]
+                else:
+                    data['version'] = 'HTTP/0.9'
+            if 'url_parts' in fields:
+                data['url_parts'] = urlparse(path)
+            if 'subpath' in fields:
+                data['subpath'] = self._subpath(path)
+
+        if fields & self._time_fields:
+            if 'time' in fields:
+                data['time'] = time
+            try:
+                # Only timestamps that aren't in the standard layout get as
+                # far as strptime(), which raises
+                if 'datetime' in fields:
+                    data['datetime'] = dt = self.timestamp_decoder.to_datetime(
+                        time)
+                    if 'timestamp' in fields:
+                        data['timestamp'] = dt.timestamp()
+                elif 'timestamp' in fields:
+                    data['timestamp'] = self.timestamp_decoder.to_timestamp(
+                        time)
+            except ValueError:
+                return None, TIMESTAMP
+
+        return data, None
+
+    @staticmethod
+    def _subpath(path):
+        """
+        Equivalent to ``urlparse(path).path[1:].split('/')[0]``, without
+        the overhead of urlparse for plain absolute paths.
+        """
+        if path[:1] != '/' or path[:2] == '//' or ';' in path:
+            return urlparse(path).path[1:].split('/')[0]
+
+        subpath = path[1:].split('/', 1)[0]
+        for char in '?#':
+            subpath = subpath.split(char, 1)[0]
+        return subpath
+
+    def parse_batch(self, lines, rejects=None):
+        """
+        Parse a list of lines, returning a list of the successfully parsed
+        lines and the number of lines that contained invalid or corrupt data.
+
+        Params:
+            lines (list): The log lines.
+            rejects (list): If given, a (reason, line) tuple is appended to
+                it for every line that was rejected.
+        """
+        points, n_errors = [], 0
+        try_extract = self.try_extract
+        for line in lines:
+            try:
+                data, reason = try_extract(line)
+            except Exception:
+                # Nothing should get here, but one bad line mustn't stop
+                # the whole batch
+                data, reason = None, VALUE
+            if data is None:
+                n_errors += 1
+                if rejects is not None:
+                    rejects.append((reason, line))
+            else:
+                points.append(data)
+        return points, n_errors
@@ -0,0 +1,176 @@
+import time
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+
+from .logformat import create_parser
+from .metrics import ReservoirSample
+
+
+class BatchSummary:
+    """
+    The partial aggregates for a single batch of log lines.
+
+    Workers parse a batch and reduce it down to one entry per time window,
+    so only a handful of small counters need to be sent back to the main
+    process instead of a dict for every line.
+    """
+
+    def __init__(self, n_lines=0, n_errors=0):
+        self.n_lines = n_lines
+        self.n_errors = n_errors
+
+        # The seconds that the worker spent decoding and parsing the batch
+        self.parse_time = 0.0
+
+        # The number of rejected lines for each reason, and a small random
+        # sample of the (reason, line) pairs
+        self.error_reasons = Counter()
+        self.error_samples = []
+
+        # When the batch was sampled 1 in N, each point counts as ``weight``
+        # hits and the rest of the lines were skipped
+        self.weight = 1
+        self.n_skipped = 0
+
+        # A list of [window, hits, Counter of subpaths, Counter of status
+        # codes], in the order that the windows first appeared in the batch.
+        # The window is None if the points don't have timestamps. Like
+        # TaggedCounterMetric, the None subpath holds the combined total.
+        self.windows = []
+
+    @property
+    def n_points(self):
+        return sum(entry[1] for entry in self.windows)
+
+    @classmethod
+    def from_points(cls, points, n_lines=0, n_errors=0, window_size=1):
+        summary = cls(n_lines, n_errors)
+        return summary._add_points(points, window_size)
+
+    @classmethod
+    def from_batch(cls, points, rejects, n_lines=0, window_size=1,
+                   n_samples=5):
+        """
+        Build the summary from the output of parse_batch(), including the
+        rejected lines.
+        """
+        summary = cls(n_lines, len(rejects))
+        if rejects:
+            summary.error_reasons.update([reason for reason, _ in rejects])
+            sample = ReservoirSample(n_samples)
+            sample.extend(rejects)
+            summary.error_samples = sample.items
+        return summary._add_points(points, window_size)
+
+    def _add_points(self, points, window_size):
+        windows = {}
+        for point in points:
+            timestamp = point.get('timestamp')
+            window = None
+            if timestamp is not None:
+                window = timestamp - timestamp % window_size
+
+            entry = windows.get(window)
+            if entry is None:
+                entry = windows[window] = [window, 0, Counter(), Counter()]
+                self.windows.append(entry)
+            entry[1] += 1
+            entry[2][point['subpath']] += 1
+            status = point.get('status')
+            if status is not None:
+                entry[3][status] += 1
+
+        for _, hits, subpaths, _ in self.windows:
+            subpaths[None] = hits
+        return self
+
+
+# Each worker process keeps its own parser, configured by the initializer
+_worker = {}
+
+
+def _init_worker(fields, encoding, errors, log_format=None):
+    _worker['parser'] = create_parser(fields, log_format)
+    _worker['encoding'] = encoding
+    _worker['errors'] = errors
+
+
+def summarize_chunk(chunk, step=1, offset=0):
+    """
+    Decode, parse and summarize a chunk of raw bytes from the log file.
+    This runs inside of the worker processes. If the step is more than 1,
+    only every step-th line is parsed starting from the offset, see
+    sampling.LoadShedder.advance().
+    """
+    start = time.perf_counter()
+    lines = chunk.decode(_worker['encoding'], _worker['errors']).split('\n')
+    n_lines = len(lines)
+    if step > 1:
+        lines = lines[offset::step]
+
+    rejects = []
+    points, _ = _worker['parser'].parse_batch(lines, rejects)
+    summary = BatchSummary.from_batch(points, rejects, n_lines)
+    summary.weight = step
+    summary.n_skipped = n_lines - len(lines)
+    summary.parse_time = time.perf_counter() - start
+    return summary
+
+
+class ParallelParser:
+    """
+    Fans chunks of the log file out to a pool of worker processes.
+
+    Results are always returned in the same order that the chunks were
+    submitted, so the metrics see the windows in log order and the alerts
+    behave the same as they would with a single process.
+    """
+
+    def __init__(self, fields, workers, encoding='utf-8', errors='replace',
+                 max_pending=None, log_format=None):
+        """
+        Params:
+            fields (tuple): The fields that the workers should extract.
+            workers (int): The number of worker processes.
+            encoding (str): The text encoding of the log file.
+            errors (str): How to handle undecodable bytes in the log file.
+            max_pending (int): The maximum number of chunks that can be
+                in flight at once, defaults to twice the number of workers.
+            log_format (str): A custom log format, each worker compiles its
+                own parser for it.
+        """
+        self.workers = workers
+        self.max_pending = max_pending or workers * 2
+        self.executor = ProcessPoolExecutor(
+            workers, initializer=_init_worker,
+            initargs=(fields, encoding, errors, log_format))
+        self.pending = deque()
+
+    def submit(self, chunk, step=1, offset=0):
+        """
+        Queue a chunk to be processed, and return a list of the summaries
+        that have finished in the meantime.
+
+        This will block if there are too many chunks in flight, which keeps
+        memory bounded when the reader is faster than the workers.
+        """
+        self.pending.append(
+            self.executor.submit(summarize_chunk, chunk, step, offset))
+
+        summaries = []
+        while self.pending and (len(self.pending) >= self.max_pending or
+                                self.pending[0].done()):
+            summaries.append(self.pending.popleft().result())
+        return summaries
+
+    def drain(self):
+        """
+        Wait for all of the chunks in flight and return their summaries.
+        """
+        summaries = []
+        while self.pending:
+            summaries.append(self.pending.popleft().result())
+        return summaries
+
+    def close(self):
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,654 @@
+import os
+import re
+import sys
+import glob
+import gzip
+import fnmatch
+import time
+import ctypes
+import ctypes.util
+import stat
+import select
+import struct
+import logging
+
+
+_logger = logging.getLogger('akita')
+
+
+class ChunkedLineReader:
+    """
+    Reads lines from a binary file object in large chunks.
+
+    Instead of calling readline() once per line, raw bytes are pulled from
+    the file into a reusable buffer and split into lines in bulk. Any partial
+    line at the end of a chunk is carried over and joined with the next read,
+    so callers only ever see complete lines.
+    """
+
+    # How often to check for new data when waiting at the end of the file
+    poll_interval = 0.1
+
+    def __init__(self, fp, chunk_size=1024 * 1024, encoding='utf-8',
+                 errors='replace'):
+        """
+        Params:
+            fp (file): A file object opened in binary mode.
+            chunk_size (int): The maximum number of bytes to read at once.
+            encoding (str): The text encoding of the log file.
+            errors (str): How to handle undecodable bytes in the log file.
+        """
+        self.fp = fp
+        self.chunk_size = chunk_size
+        self.encoding = encoding
+        self.errors = errors
+
+        # Skip python's buffering layer when we can, we're already reading
+        # in large chunks so it only adds an extra copy.
+        self._raw = getattr(fp, 'raw', fp)
+        self._buffer = bytearray(chunk_size)
+        self._view = memoryview(self._buffer)
+        self._partial = b''
+
+        # Set when the most recent read didn't return any data
+        self.at_eof = False
+
+        # Pipes and sockets can be watched with select(), and they're closed
+        # for good once a read returns zero bytes. Regular files can always
+        # grow, so they're never considered closed.
+        self._stream = False
+        try:
+            self._stream = not stat.S_ISREG(os.fstat(fp.fileno()).st_mode)
+        except (AttributeError, OSError, ValueError):
+            pass
+        self.closed = False
+
+    @property
+    def name(self):
+        return getattr(self.fp, 'name', '<stream>')
+
+    def seek_end(self):
+        """
+        Move to the end of the file if it's seekable, stdin streams aren't.
+        """
+        if self.fp.seekable():
+            self.seek(0, os.SEEK_END)
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        self.fp.seek(offset, whence)
+        self._partial = b''
+        self.at_eof = False
+
+    def tell(self):
+        """
+        The position in the file that the next read will start from.
+        """
+        return self._raw.tell()
+
+    def bytes_behind(self):
+        """
+        The number of bytes between the last complete line that was read and
+        the end of the file, or None for streams that can't be measured.
+        """
+        if self._stream:
+            return None
+        try:
+            size = os.fstat(self.fp.fileno()).st_size
+        except (AttributeError, OSError, ValueError):
+            return None
+        return max(0, size - self.tell()) + len(self._partial)
+
+    def read_lines(self):
+        """
+        Read the next chunk from the file and return the complete lines.
+
+        Returns an empty list if there was no complete line available, either
+        because we've reached the end of the file or because the chunk ended
+        in the middle of a line.
+        """
+        chunk = self.read_chunk()
+        if chunk is None:
+            return []
+        return self.decode(chunk)
+
+    def read_chunk(self):
+        """
+        Read the next chunk from the file and return the raw bytes for all
+        of the complete lines, without the trailing newline.
+
+        Returns None if there was no complete line available.
+        """
+        n_bytes = self._raw.readinto(self._view)
+        self.at_eof = not n_bytes
+        if n_bytes == 0 and self._stream:
+            self.closed = True
+        if not n_bytes:
+            # Either EOF or a non-blocking stream with no data available
+            return None
+
+        data = self._view[:n_bytes]
+        end = self._buffer.rfind(b'\n', 0, n_bytes)
+        if end == -1:
+            self._partial += data
+            return None
+
+        chunk = self._partial + data[:end]
+        self._partial = bytes(data[end + 1:])
+        return chunk
+
+    def decode(self, chunk):
+        """
+        Split a chunk returned by read_chunk() into lines of text.
+        """
+        return chunk.decode(self.encoding, self.errors).split('\n')
+
+    def flush(self):
+        """
+        Return the trailing partial line, if there is one. This should be
+        called when the stream has been closed and no more data will arrive.
+        """
+        chunk = self.flush_chunk()
+        if chunk is None:
+            return []
+        return [chunk.decode(self.encoding, self.errors)]
+
+    def flush_chunk(self):
+        """
+        The same as flush(), but returns the raw bytes or None.
+        """
+        chunk, self._partial = self._partial, b''
+        return chunk or None
+
+    def selectable(self):
+        """
+        A file descriptor that becomes readable when more data is available,
+        or None if the reader needs to be polled.
+        """
+        return self.fp.fileno() if self._stream else None
+
+    def wait(self, timeout=1.0):
+        """
+        Block until more data might be available. There's no way to be
+        notified for a plain stream, so this polls at a short interval.
+        """
+        time.sleep(min(timeout, self.poll_interval))
+
+
+IN_MODIFY = 0x002
+IN_ATTRIB = 0x004
+IN_MOVED_FROM = 0x040
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+# The events that could mean a log file has new data, or has been rotated
+IN_LOG_EVENTS = (IN_MODIFY | IN_ATTRIB | IN_MOVED_FROM | IN_MOVED_TO |
+                 IN_CREATE | IN_DELETE)
+
+_inotify_event = struct.Struct('iIII')
+
+
+def _inotify_init():
+    """
+    Create a non-blocking inotify descriptor, returns (libc, fd).
+    """
+    libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+    if fd < 0:
+        raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+    return libc, fd
+
+
+def _inotify_add_watch(libc, fd, directory):
+    wd = libc.inotify_add_watch(fd, directory.encode(), IN_LOG_EVENTS)
+    if wd < 0:
+        raise OSError(ctypes.get_errno(), 'inotify_add_watch failed')
+    return wd
+
+
+def _inotify_read(fd):
+    """
+    Consume the pending inotify events, returns a list of (wd, name).
+    """
+    try:
+        data = os.read(fd, 65536)
+    except BlockingIOError:
+        return []
+
+    events = []
+    offset = 0
+    while offset < len(data):
+        wd, _, _, length = _inotify_event.unpack_from(data, offset)
+        offset += _inotify_event.size
+        name = data[offset:offset + length].rstrip(b'\0')
+        offset += length
+        events.append((wd, name))
+    return events
+
+
+class FileWatcher:
+    """
+    Waits for a file to be modified, created, moved or deleted.
+
+    On Linux this uses inotify to watch the file's directory, so callers wake
+    up as soon as the file changes. Everywhere else it falls back to polling
+    at a fixed interval.
+    """
+
+    def __init__(self, path, poll_interval=0.1):
+        """
+        Params:
+            path (str): The file to watch, it doesn't need to exist yet.
+            poll_interval (float): How often to wake up when inotify isn't
+                available.
+        """
+        self.path = os.path.abspath(path)
+        self.poll_interval = poll_interval
+        self.fd = None
+        self._name = os.path.basename(self.path).encode()
+
+        if sys.platform.startswith('linux'):
+            try:
+                libc, self.fd = _inotify_init()
+                _inotify_add_watch(libc, self.fd, os.path.dirname(self.path))
+            except (OSError, AttributeError):
+                _logger.debug('inotify is unavailable, polling for changes')
+                self.close()
+
+    def fileno(self):
+        return self.fd
+
+    def wait(self, timeout=1.0):
+        """
+        Block until the file changes or the timeout expires. Returns True if
+        a change was detected, when polling this always returns False.
+        """
+        if self.fd is None:
+            time.sleep(min(timeout, self.poll_interval))
+            return False
+
+        deadline = time.time() + timeout
+        while True:
+            remaining = max(0, deadline - time.time())
+            readable, _, _ = select.select([self.fd], [], [], remaining)
+            if not readable:
+                return False
+            if self.read_events():
+                return True
+
+    def read_events(self):
+        """
+        Consume the pending inotify events, and return True if any of them
+        were for the watched file instead of its neighbors.
+        """
+        return any(name == self._name for _, name in _inotify_read(self.fd))
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class DirectoryWatcher:
+    """
+    Watches any number of directories with a single inotify descriptor, and
+    reports which files in them have changed.
+
+    Unlike FileWatcher, this scales to hundreds of log files without using a
+    descriptor (or a wakeup) for each one.
+    """
+
+    def __init__(self):
+        self.fd = None
+        self._libc = None
+        self._directories = {}
+
+        if sys.platform.startswith('linux'):
+            try:
+                self._libc, self.fd = _inotify_init()
+            except (OSError, AttributeError):
+                _logger.debug('inotify is unavailable, polling for changes')
+
+    def fileno(self):
+        return self.fd
+
+    def watch(self, directory):
+        """
+        Start watching a directory, does nothing if it's already watched.
+        """
+        directory = os.path.abspath(directory)
+        if self.fd is None or directory in self._directories.values():
+            return
+        try:
+            wd = _inotify_add_watch(self._libc, self.fd, directory)
+        except OSError as e:
+            _logger.warning('Unable to watch %s: %s', directory, e)
+            return
+        self._directories[wd] = directory
+
+    def read_changes(self):
+        """
+        Consume the pending events and return the set of absolute paths for
+        the files that changed.
+        """
+        if self.fd is None:
+            return set()
+
+        paths = set()
+        for wd, name in _inotify_read(self.fd):
+            directory = self._directories.get(wd)
+            if directory and name:
+                paths.add(os.path.join(directory, os.fsdecode(name)))
+        return paths
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class FileFollower:
+    """
+    Follows a log file by its path, similar to ``tail -F``.
+
+    If the file is renamed or deleted and a new file is created in its place,
+    the rest of the old file is read before switching over to the new one.
+    If the file is truncated, reading starts again from the beginning.
+
+    With backfill enabled, rotated copies of the file (access.log.1,
+    access.log.2.gz, etc.) are read from oldest to newest on startup,
+    followed by the whole current file.
+    """
+
+    _rotated_suffix = re.compile(r'\.(\d+)(\.gz)?$')
+
+    poll_interval = ChunkedLineReader.poll_interval
+
+    # The file is followed by its path, so it never runs out of data for good
+    closed = False
+
+    def __init__(self, fp, chunk_size=1024 * 1024, backfill=False,
+                 encoding='utf-8', errors='replace', watch=True):
+        """
+        Params:
+            fp (file): The log file, opened in binary mode.
+            chunk_size (int): The maximum number of bytes to read at once.
+            backfill (bool): Read the rotated log files and the current log
+                file from the beginning.
+            encoding (str): The text encoding of the log file.
+            errors (str): How to handle undecodable bytes in the log file.
+            watch (bool): Create a FileWatcher for this file. Disable this
+                when the caller is watching the directory itself, like
+                LogFileSet does.
+        """
+        self.path = fp.name
+        self.chunk_size = chunk_size
+        self.backfill = backfill
+        self.encoding = encoding
+        self.errors = errors
+
+        self.reader = None
+        self._stat = None
+        self._switch(fp)
+
+        self._pending = []
+        self._backfill = []
+        if backfill:
+            self._backfill = [self._open_rotated(path)
+                              for path in self.rotated_paths()]
+
+        self.watcher = None
+        if watch:
+            self.watcher = FileWatcher(self.path, self.poll_interval)
+
+    @property
+    def name(self):
+        return self.path
+
+    @property
+    def at_eof(self):
+        return not self._backfill and not self._pending and self.reader.at_eof
+
+    def rotated_paths(self):
+        """
+        Find the rotated copies of the log file, sorted from oldest to newest.
+        """
+        paths = []
+        for path in glob.glob(glob.escape(self.path) + '.*'):
+            match = self._rotated_suffix.match(path[len(self.path):])
+            if match:
+                paths.append((int(match.group(1)), path))
+        return [path for _, path in sorted(paths, reverse=True)]
+
+    def _open_rotated(self, path):
+        if path.endswith('.gz'):
+            fp = gzip.open(path, 'rb')
+        else:
+            fp = open(path, 'rb')
+        return ChunkedLineReader(fp, self.chunk_size, self.encoding,
+                                 self.errors)
+
+    def _switch(self, fp):
+        if self.reader is not None:
+            self.reader.fp.close()
+        self.reader = ChunkedLineReader(fp, self.chunk_size, self.encoding,
+                                        self.errors)
+        self._stat = os.fstat(fp.fileno())
+
+    def seek_end(self):
+        """
+        Skip to the end of the current file, unless we're backfilling.
+        """
+        if not self.backfill:
+            self.reader.seek_end()
+
+    def bytes_behind(self):
+        """
+        The unread bytes in the current file, including any that were left
+        in the old file after it was rotated.
+        """
+        behind = self.reader.bytes_behind()
+        if behind is None:
+            return None
+        return behind + sum(len(chunk) for chunk in self._pending)
+
+    def read_lines(self):
+        chunk = self.read_chunk()
+        if chunk is None:
+            return []
+        return self.decode(chunk)
+
+    def read_chunk(self):
+        if self._pending:
+            return self._pending.pop(0)
+
+        if self._backfill:
+            return self._read_backfill()
+
+        chunk = self.reader.read_chunk()
+        if chunk is None and self.reader.at_eof:
+            self._check_rotation()
+            if self._pending:
+                return self._pending.pop(0)
+        return chunk
+
+    def _read_backfill(self):
+        reader = self._backfill[0]
+        chunk = reader.read_chunk()
+        if chunk is None and reader.at_eof:
+            chunk = reader.flush_chunk()
+            reader.fp.close()
+            self._backfill.pop(0)
+        return chunk
+
+    def _check_rotation(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            # The file was moved away and hasn't been re-created yet, keep
+            # reading from the old file in case anything is still writing.
+            return
+
+        if (stat.st_ino, stat.st_dev) != (self._stat.st_ino, self._stat.st_dev):
+            # Drain whatever was written to the old file before it was rotated
+            while True:
+                chunk = self.reader.read_chunk()
+                if chunk is not None:
+                    self._pending.append(chunk)
+                elif self.reader.at_eof:
+                    break
+            chunk = self.reader.flush_chunk()
+            if chunk is not None:
+                self._pending.append(chunk)
+
+            _logger.info('Log file was rotated, re-opening %s', self.path)
+            try:
+                self._switch(open(self.path, 'rb'))
+            except FileNotFoundError:
+                pass
+
+        elif stat.st_size < self.reader.tell():
+            _logger.info('Log file was truncated, re-reading %s', self.path)
+            self.reader.seek(0)
+
+    def decode(self, chunk):
+        return self.reader.decode(chunk)
+
+    def flush(self):
+        return self.reader.flush()
+
+    def flush_chunk(self):
+        return self.reader.flush_chunk()
+
+    def selectable(self):
+        """
+        The inotify descriptor, or None if changes need to be polled. Call
+        wait(0) after it becomes readable to consume the events.
+        """
+        if self.watcher is None:
+            return None
+        return self.watcher.fileno()
+
+    def wait(self, timeout=1.0):
+        """
+        Block until the file changes, or the timeout expires.
+        """
+        if self._pending or self._backfill:
+            return
+        if self.watcher is None:
+            time.sleep(min(timeout, self.poll_interval))
+        else:
+            self.watcher.wait(timeout)
+
+    def close(self):
+        if self.watcher is not None:
+            self.watcher.close()
+        self.reader.fp.close()
+        for reader in self._backfill:
+            reader.fp.close()
+
+
+def open_reader(fp, chunk_size=1024 * 1024, backfill=False):
+    """
+    Wrap a log file in the best available reader. Regular files are followed
+    by their path so log rotation is handled, anything else (stdin, pipes)
+    is read as a plain stream.
+    """
+    name = getattr(fp, 'name', None)
+    if isinstance(name, str) and fp.seekable() and os.path.isfile(name):
+        return FileFollower(fp, chunk_size=chunk_size, backfill=backfill)
+    return ChunkedLineReader(fp, chunk_size=chunk_size)
+
+
+class LogFileSet:
+    """
+    Follows every log file that matches a list of paths and glob patterns,
+    including files that are created after startup.
+
+    All of the files share a single DirectoryWatcher, so an idle file costs
+    nothing until its directory reports a change to it.
+    """
+
+    def __init__(self, patterns, chunk_size=1024 * 1024, backfill=False):
+        """
+        Params:
+            patterns (list): File paths or glob patterns to follow.
+            chunk_size (int): The maximum number of bytes to read at once.
+            backfill (bool): Read the rotated copies of the files that exist
+                at startup, see FileFollower.
+        """
+        self.patterns = [os.path.abspath(p) for p in patterns]
+        self.chunk_size = chunk_size
+        self.backfill = backfill
+
+        # Followers for each path, in the order that they were found
+        self.followers = {}
+
+        self.watcher = DirectoryWatcher()
+        for pattern in self.patterns:
+            for directory in glob.glob(os.path.dirname(pattern)):
+                self.watcher.watch(directory)
+
+    @property
+    def name(self):
+        return ', '.join(self.patterns)
+
+    def fileno(self):
+        return self.watcher.fileno()
+
+    def matches(self, path):
+        """
+        Check if a path should be followed. Rotated copies of a log file
+        (access.log.1, access.log.2.gz) are skipped even if they match a
+        pattern, they're handled by the follower for the original file.
+        """
+        if FileFollower._rotated_suffix.search(path):
+            return path in self.patterns
+        return any(fnmatch.fnmatchcase(path, p) for p in self.patterns)
+
+    def discover(self, backfill=False):
+        """
+        Open any matching files that aren't being followed yet, and return
+        the list of new followers.
+        """
+        new_followers = []
+        for pattern in self.patterns:
+            for path in sorted(glob.glob(pattern)):
+                if path in self.followers or not self.matches(path):
+                    continue
+                if not os.path.isfile(path):
+                    continue
+                try:
+                    fp = open(path, 'rb')
+                except OSError as e:
+                    _logger.warning('Unable to open %s: %s', path, e)
+                    continue
+
+                follower = FileFollower(fp, chunk_size=self.chunk_size,
+                                        backfill=backfill, watch=False)
+                self.followers[path] = follower
+                new_followers.append(follower)
+        return new_followers
+
+    def read_changes(self):
+        """
+        Consume the pending directory events, returns the followers whose
+        files changed and a flag that's set if a file that isn't being
+        followed yet was created.
+        """
+        changed = []
+        unknown = False
+        for path in self.watcher.read_changes():
+            follower = self.followers.get(path)
+            if follower is not None:
+                changed.append(follower)
+            elif self.matches(path):
+                unknown = True
+        return changed, unknown
+
+    def close(self):
+        self.watcher.close()
+        for follower in self.followers.values():
+            follower.close()
@@ -0,0 +1,263 @@
+import json
+import time
+from collections import Counter
+
+from .logformat import create_parser
+from .reader import ChunkedLineReader
+from .metrics import AlertMetric, StatusCounts
+from .pipeline import ParallelParser
+
+
+class Replay:
+    """
+    Processes an entire log file from start to finish as fast as possible,
+    without the curses UI, and builds a summary report.
+
+    The metrics are driven in event time, so traffic is binned using the
+    timestamps in the log instead of the time that each line was read. This
+    makes the alerts behave the same way they would have if Akita had been
+    watching the file live.
+    """
+
+    def __init__(self, log_file, metrics, chunk_size=1024 * 1024, top=10,
+                 workers=0, log_format=None):
+        """
+        Params:
+            log_file (file): The log file, opened in binary mode.
+            metrics (MetricsAggregator): Must be configured in event time.
+            chunk_size (int): The maximum number of bytes to read at once.
+            top (int): The number of sections to include in the report.
+            workers (int): If set, parse the file using a pool of worker
+                processes instead of in the main process.
+            log_format (str): An Apache or nginx log format string, defaults
+                to the Combined Log Format.
+        """
+        self.log_file = log_file
+        self.metrics = metrics
+        self.top = top
+
+        self.reader = ChunkedLineReader(log_file, chunk_size=chunk_size)
+        self.http_parser = create_parser(metrics.fields, log_format)
+        self.pipeline = None
+        if workers:
+            self.pipeline = ParallelParser(
+                metrics.fields, workers, log_format=log_format)
+
+        self.n_lines = 0
+        self.sections = Counter()
+        self.per_second = Counter()
+        self.statuses = StatusCounts()
+        self.alerts = []
+        self.error_alerts = []
+
+        self.metrics.alert_listeners.append(self._on_alert)
+
+    def _on_alert(self, alert, alert_metric):
+        if alert_metric is self.metrics.error_alert:
+            alerts = self.error_alerts
+        else:
+            alerts = self.alerts
+
+        if alert == AlertMetric.ALERT_START:
+            alerts.append({
+                'start': alert_metric.triggered_at,
+                'start_rate': alert_metric.triggered_rate,
+                'end': None,
+                'end_rate': None,
+            })
+        elif alert == AlertMetric.ALERT_STOP and alerts:
+            alerts[-1]['end'] = alert_metric.triggered_at
+            alerts[-1]['end_rate'] = alert_metric.triggered_rate
+
+    def run(self):
+        """
+        Read the whole file and return the report as a dict.
+        """
+        start = time.perf_counter()
+        if self.pipeline:
+            self._run_pipeline()
+        else:
+            while True:
+                lines = self.reader.read_lines()
+                if lines:
+                    self.process_lines(lines)
+                elif self.reader.at_eof:
+                    break
+        self.process_lines(self.reader.flush())
+        elapsed = time.perf_counter() - start
+
+        return self.report(elapsed)
+
+    def _run_pipeline(self):
+        try:
+            while True:
+                chunk = self.reader.read_chunk()
+                if chunk is not None:
+                    summaries = self.pipeline.submit(chunk)
+                elif self.reader.at_eof:
+                    break
+                else:
+                    continue
+
+                for summary in summaries:
+                    self.add_summary(summary)
+
+            for summary in self.pipeline.drain():
+                self.add_summary(summary)
+        finally:
+            self.pipeline.close()
+
+    def add_summary(self, summary):
+        self.n_lines += summary.n_lines
+        self.metrics.add_summary(summary)
+        for window, hits, subpaths, statuses in summary.windows:
+            self.per_second[int(window)] += hits
+            self.sections.update(subpaths)
+            self.statuses.update(statuses)
+
+        # Counter ignores missing keys here
+        del self.sections[None]
+
+    def process_lines(self, lines):
+        """
+        Parse a batch of lines and add them to the metrics and the report.
+        """
+        self.n_lines += len(lines)
+
+        rejects = []
+        points, _ = self.http_parser.parse_batch(lines, rejects)
+        self.add_points(points)
+        if rejects:
+            self.metrics.add_rejects(rejects)
+
+    def add_points(self, points):
+        self.metrics.add_points(points)
+        self.sections.update([p['subpath'] for p in points])
+        self.statuses.add_codes([p['status'] for p in points])
+        self.per_second.update([int(p['timestamp']) for p in points])
+
+    def report(self, elapsed):
+        metrics = self.metrics
+        report = {
+            'file': getattr(self.log_file, 'name', None),
+            'lines': self.n_lines,
+            'parsed': metrics.hit_total,
+            'failed': metrics.miss_total,
+            'failed_reasons': metrics.error_reasons.most_common(),
+            'late': metrics.late_total,
+            'elapsed': elapsed,
+            'lines_per_sec': self.n_lines / elapsed if elapsed else None,
+            'sections': self.sections.most_common(self.top),
+            'status_classes': self._status_classes(),
+            'status_codes': sorted(self.statuses.items(),
+                                   key=lambda item: -item[1])[:self.top],
+            'alerts': self.alerts,
+            'error_alerts': self.error_alerts,
+        }
+        report.update(self._traffic_report())
+        return report
+
+    def _status_classes(self):
+        classes = self.statuses.classes()
+        report = {'{}xx'.format(i): count
+                  for i, count in enumerate(classes) if i}
+        report['other'] = classes[0]
+        return report
+
+    def _traffic_report(self):
+        """
+        Summarize the number of hits in each second of the log. Seconds that
+        didn't have any traffic are included in the histogram.
+        """
+        if not self.per_second:
+            return {'start': None, 'end': None, 'traffic': None}
+
+        start, end = min(self.per_second), max(self.per_second)
+        n_seconds = end - start + 1
+        hits = sum(self.per_second.values())
+
+        # Bucket the per-second hit counts by powers of two, 0, 1, 2-3, 4-7...
+        buckets = Counter(n.bit_length() for n in self.per_second.values())
+        buckets[0] = n_seconds - len(self.per_second)
+        histogram = []
+        for bucket in range(max(buckets) + 1):
+            low = 0 if bucket == 0 else 2 ** (bucket - 1)
+            high = 0 if bucket == 0 else 2 ** bucket - 1
+            histogram.append([low, high, buckets[bucket]])
+
+        traffic = {
+            'avg': hits / n_seconds,
+            'max': max(self.per_second.values()),
+            'histogram': histogram,
+        }
+        return {'start': start, 'end': end, 'traffic': traffic}
+
+
+def format_report(report, output='text'):
+    """
+    Render the replay report as either plain text or JSON.
+    """
+    if output == 'json':
+        return json.dumps(report, indent=2)
+
+    def fmt_time(timestamp):
+        if timestamp is None:
+            return '-'
+        return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(timestamp))
+
+    lines = [
+        'Akita replay of {}'.format(report['file']),
+        '',
+        'Lines        : {:,}'.format(report['lines']),
+        'Parsed Lines : {:,}'.format(report['parsed']),
+        'Failed Lines : {:,}'.format(report['failed']),
+        'Late Lines   : {:,}'.format(report['late']),
+        'Elapsed      : {:.2f}s'.format(report['elapsed']),
+        'Throughput   : {:,.0f} lines/s'.format(report['lines_per_sec'] or 0),
+        'Log Start    : {}'.format(fmt_time(report['start'])),
+        'Log End      : {}'.format(fmt_time(report['end'])),
+    ]
+
+    traffic = report['traffic']
+    if traffic:
+        lines += [
+            '',
+            'Traffic (avg {:.2f}/s, max {}/s)'.format(
+                traffic['avg'], traffic['max']),
+        ]
+        width = max(count for _, _, count in traffic['histogram'])
+        for low, high, count in traffic['histogram']:
+            label = str(low) if low == high else '{}-{}'.format(low, high)
+            bar = '#' * int(40 * count / width) if width else ''
+            lines.append('  {:>13}/s {:>8,}s {}'.format(label, count, bar))
+
+    lines += ['', 'Most Visited']
+    for path, count in report['sections']:
+        lines.append('  {:<15} {:,}'.format('/' + path, count))
+
+    lines += ['', 'Status Codes']
+    classes = report['status_classes']
+    for name in ('2xx', '3xx', '4xx', '5xx'):
+        lines.append('  {:<15} {:,}'.format(name, classes[name]))
+    for code, count in report['status_codes']:
+        if code >= 400:
+            lines.append('  {:<15} {:,}'.format(code, count))
+
+    if report['failed_reasons']:
+        lines += ['', 'Failed Lines']
+        for reason, count in report['failed_reasons']:
+            lines.append('  {:<15} {:,}'.format(reason, count))
+
+    lines += ['', 'Alerts']
+    for alert in report['alerts']:
+        lines.append('  {} - {}  hits = {:.2f}/s'.format(
+            fmt_time(alert['start']), fmt_time(alert['end']),
+            alert['start_rate']))
+    for alert in report['error_alerts']:
+        lines.append('  {} - {}  5xx = {:.1%}'.format(
+            fmt_time(alert['start']), fmt_time(alert['end']),
+            alert['start_rate']))
+    if not report['alerts'] and not report['error_alerts']:
+        lines.append('  (none)')
+
+    return '\n'.join(lines)
@@ -0,0 +1,99 @@
+import time
+
+
+class LoadShedder:
+    """
+    Decides how many lines to skip when Akita can't keep up with the log.
+
+    Once per interval the backlog is checked, both the bytes that haven't
+    been read yet and how far the newest log timestamp is behind the clock.
+    The lag only counts while there's unread data, a quiet log that's fully
+    read isn't behind no matter how old its last line is. While either one
+    is over its limit, the sampling step doubles, up to ``max_step``. Once
+    both have dropped well below their limits, it's halved again. The gap
+    between the two levels stops the step from flapping while the reader
+    catches up.
+
+    Sampling is deterministic, every N-th line is parsed and the rest are
+    skipped without being looked at. The offset carries over between
+    batches so the lines that are kept are evenly spaced no matter how the
+    file is chunked. Each parsed line then counts as N hits.
+    """
+
+    def __init__(self, max_lag=10.0, max_backlog=16 * 1024 * 1024,
+                 max_step=64, interval=1.0):
+        """
+        Params:
+            max_lag (float): Start sampling when the newest log timestamp is
+                more than this many seconds behind the clock.
+            max_backlog (int): Start sampling when more than this many bytes
+                of the log haven't been read yet.
+            max_step (int): Never skip more than ``max_step - 1`` of every
+                ``max_step`` lines, must be a power of 2.
+            interval (float): How often to check the backlog, in seconds.
+        """
+        self.max_lag = max_lag
+        self.max_backlog = max_backlog
+        self.max_step = max_step
+        self.interval = interval
+
+        # Parse 1 in every ``step`` lines
+        self.step = 1
+
+        self._offset = 0
+        self._last_check = time.monotonic()
+
+    def due(self):
+        """
+        Whether it's time to check the backlog again.
+        """
+        return time.monotonic() - self._last_check >= self.interval
+
+    def update(self, lag=None, bytes_behind=None):
+        """
+        Adjust the step for the current backlog, either value can be None
+        if it isn't known. Returns True if the step changed.
+        """
+        self._last_check = time.monotonic()
+        if bytes_behind == 0:
+            lag = None
+
+        behind = ((lag is not None and lag > self.max_lag) or
+                  (bytes_behind is not None and
+                   bytes_behind > self.max_backlog))
+        caught_up = ((lag is None or lag < self.max_lag / 2) and
+                     (bytes_behind is None or
+                      bytes_behind < self.max_backlog / 4))
+
+        step = self.step
+        if behind and step < self.max_step:
+            step *= 2
+        elif caught_up and step > 1:
+            step //= 2
+        if step == self.step:
+            return False
+
+        self.step = step
+        self._offset %= step
+        return True
+
+    def sample(self, lines):
+        """
+        Return the lines that should be parsed.
+        """
+        step = self.step
+        if step == 1:
+            return lines
+
+        return lines[self.advance(len(lines))::step]
+
+    def advance(self, n_lines):
+        """
+        Return the index of the first line to parse in a batch of
+        ``n_lines``, and carry the offset over to the next batch. This is
+        for batches that are sampled somewhere else, like in the worker
+        processes.
+        """
+        start = self._offset
+        self._offset = (start - n_lines) % self.step
+        return start
@@ -0,0 +1,125 @@
+import time
+from datetime import timedelta
+
+from .display import format_duration, format_bytes
+
+
+class PipelineStats:
+    """
+    Counters for each stage of the pipeline, to find out whether reading,
+    parsing, aggregating or drawing is the bottleneck.
+
+    Stages are timed once per batch rather than once per line, so the
+    overhead is a couple of perf_counter() calls and dict updates for every
+    chunk of the file. That's low enough to always leave on.
+
+    The items counted by each stage are:
+        read: bytes read from the log files and decoded into lines
+        parse: lines parsed, the time is CPU time when using workers
+        aggregate: points added to the metrics
+        draw: frames drawn to the terminal
+    """
+
+    stages = ('read', 'parse', 'aggregate', 'draw')
+
+    def __init__(self, interval=1.0):
+        """
+        Params:
+            interval (float): How often to re-calculate the rates, seconds.
+        """
+        self.interval = interval
+        self.start_time = time.time()
+
+        # The running totals since the start
+        self.calls = dict.fromkeys(self.stages, 0)
+        self.items = dict.fromkeys(self.stages, 0)
+        self.busy = dict.fromkeys(self.stages, 0.0)
+        self.max_time = dict.fromkeys(self.stages, 0.0)
+
+        # The slowest batch in the current interval
+        self._peak = dict.fromkeys(self.stages, 0.0)
+
+        # Each stage's (items/s, load, average batch time, slowest batch)
+        # over the last interval. The load is the fraction of the interval
+        # that was spent in the stage.
+        self.recent = {}
+
+        # How far behind the newest log timestamp is, in seconds, and the
+        # number of bytes that haven't been read yet
+        self.lag = None
+        self.bytes_behind = None
+
+        # Changes every time that the rates are re-calculated
+        self.version = 0
+
+        self._last_time = time.perf_counter()
+        self._last = self._totals()
+
+    def add(self, stage, elapsed, items=1):
+        """
+        Record a batch that took ``elapsed`` seconds.
+        """
+        self.calls[stage] += 1
+        self.items[stage] += items
+        self.busy[stage] += elapsed
+        if elapsed > self._peak[stage]:
+            self._peak[stage] = elapsed
+
+    def _totals(self):
+        return {stage: (self.calls[stage], self.items[stage],
+                        self.busy[stage]) for stage in self.stages}
+
+    def update(self, lag=None, bytes_behind=None):
+        """
+        Re-calculate the rates, at most once per interval. Returns the
+        version so it can be used as a display panel's state.
+        """
+        now = time.perf_counter()
+        elapsed = now - self._last_time
+        if elapsed < self.interval:
+            return self.version
+
+        totals = self._totals()
+        for stage in self.stages:
+            calls, items, busy = (
+                a - b for a, b in zip(totals[stage], self._last[stage]))
+            peak, self._peak[stage] = self._peak[stage], 0.0
+            self.max_time[stage] = max(self.max_time[stage], peak)
+            self.recent[stage] = (items / elapsed, busy / elapsed,
+                                  busy / calls if calls else None, peak)
+
+        self.lag = lag
+        self.bytes_behind = bytes_behind
+        self._last_time, self._last = now, totals
+        self.version += 1
+        return self.version
+
+
+def format_stats(stats):
+    """
+    Build the summary that's printed by --stats when Akita exits.
+    """
+    uptime = time.time() - stats.start_time
+    lines = [
+        'Akita pipeline stats (uptime {})'.format(
+            timedelta(seconds=int(uptime))),
+        '',
+        '{:<10} {:>14} {:>9} {:>9} {:>6} {:>8} {:>8}'.format(
+            'Stage', 'Items', 'Items/s', 'Time', 'Load', 'Avg', 'Max'),
+    ]
+    for stage in stats.stages:
+        calls, items = stats.calls[stage], stats.items[stage]
+        busy = stats.busy[stage]
+        lines.append(
+            '{:<10} {:>14,} {:>9,.0f} {:>9} {:>6.1%} {:>8} {:>8}'.format(
+                stage, items, items / uptime if uptime else 0,
+                format_duration(busy), busy / uptime if uptime else 0,
+                format_duration(busy / calls if calls else None),
+                format_duration(max(stats.max_time[stage],
+                                    stats._peak[stage]) or None)))
+
+    lines.append('')
+    lines.append('Log Lag      : {}'.format(
+        '-' if stats.lag is None else '{:.1f}s'.format(stats.lag)))
+    lines.append('Behind EOF   : {}'.format(format_bytes(stats.bytes_behind)))
+    return '\n'.join(lines)
@@ -0,0 +1,77 @@
+"""
+Compare the throughput of the JSON lines parser with the Combined Log Format
+parser, using the same requests written both ways.
+
+Usage:
+    $ env PYTHONPATH=. python benchmarks/bench_json.py
+"""
+import os
+import json
+import time
+
+from akita.parser import HTTPLogParser
+from akita.jsonlog import JSONLogParser
+
+
+LOG_FILE = os.path.join(
+    os.path.dirname(__file__), '..', 'tests', 'data', 'apache.log')
+
+
+def run(name, func, lines, repeat=5):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(lines)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print('{:<34} {:>12,.0f} lines/s'.format(name, len(lines) / best))
+
+
+def to_json(data):
+    """
+    Write a parsed CLF line the way a JSON access log would, with the ISO
+    8601 timestamp that most logging libraries use.
+    """
+    return json.dumps({
+        'time': data['datetime'].isoformat(),
+        'remote_addr': data['host'],
+        'remote_user': data['user'],
+        'method': data['method'],
+        'path': data['path'],
+        'protocol': data['version'],
+        'status': int(data['status']),
+        'size': 0 if data['size'] == '-' else int(data['size']),
+        'referrer': data['referrer'],
+        'user_agent': data['agent'],
+    })
+
+
+def main():
+    with open(LOG_FILE) as fp:
+        clf_lines = fp.read().splitlines() * 1000
+    parser = HTTPLogParser()
+    json_lines = [to_json(parser.extract(line)) for line in clf_lines]
+
+    # The same fields that the default metrics use
+    fields = ('subpath', 'status', 'timestamp')
+    run('CLF extract()', HTTPLogParser(fields).parse_batch, clf_lines)
+    run('CLF extract() subpath, status',
+        HTTPLogParser(('subpath', 'status')).parse_batch, clf_lines)
+    run('JSON json.loads() per line',
+        lambda lines: [json.loads(line) for line in lines], json_lines)
+    run('JSON json.loads() as one array',
+        lambda lines: json.loads('[' + ','.join(lines) + ']'), json_lines)
+
+    json_parser = JSONLogParser('json', fields)
+    run('JSON extract()', json_parser.parse_batch, json_lines)
+    run('JSON extract() subpath, status',
+        JSONLogParser('json', ('subpath', 'status')).parse_batch, json_lines)
+
+    # Force every line through the json.loads() fallback
+    json_parser._scan = lambda line: None
+    run('JSON extract() json.loads fallback', json_parser.parse_batch,
+        json_lines)
+
+
+if __name__ == '__main__':
+    main()
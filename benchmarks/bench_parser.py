@@ -0,0 +1,68 @@
+"""
+Compare the throughput of the different HTTPLogParser code paths, and the
+parsers that are compiled from a log format string.
+
+Usage:
+    $ env PYTHONPATH=. python benchmarks/bench_parser.py
+"""
+import os
+import time
+from datetime import datetime
+
+from akita.parser import HTTPLogParser, TimestampDecoder
+from akita.logformat import LogFormatParser
+
+
+LOG_FILE = os.path.join(
+    os.path.dirname(__file__), '..', 'tests', 'data', 'apache.log')
+
+
+def run(name, func, lines, repeat=5):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for line in lines:
+            func(line)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print('{:<30} {:>12,.0f} lines/s'.format(name, len(lines) / best))
+
+
+def main():
+    with open(LOG_FILE) as fp:
+        lines = fp.read().splitlines() * 1000
+
+    run('parse()', HTTPLogParser.parse, lines)
+    run('extract() all fields', HTTPLogParser().extract, lines)
+    run('extract() subpath', HTTPLogParser(['subpath']).extract, lines)
+    run('extract() subpath, status',
+        HTTPLogParser(['subpath', 'status']).extract, lines)
+    run('extract() timestamp',
+        HTTPLogParser(['timestamp']).extract, lines)
+
+    # The same fields that the default metrics use
+    fields = ('subpath', 'status', 'timestamp')
+    run('regex subpath, status, time',
+        lambda line: HTTPLogParser.pattern.match(line).groupdict(), lines)
+    run('extract() subpath, status, time',
+        HTTPLogParser(fields).extract, lines)
+    run('compiled subpath, status, time',
+        LogFormatParser('combined', fields).extract, lines)
+    run('compiled all fields', LogFormatParser('combined').extract, lines)
+
+    # Force every line through the generated regex fallback
+    parser = LogFormatParser('combined', fields)
+    run('compiled regex fallback',
+        lambda line: parser._from_groups(
+            line, parser.pattern.match(line).groupdict()), lines)
+
+    times = [HTTPLogParser.parse(line)['time'] for line in lines]
+    run('strptime()',
+        lambda text: datetime.strptime(text, TimestampDecoder.date_fmt),
+        times)
+    run('TimestampDecoder.to_timestamp()',
+        TimestampDecoder().to_timestamp, times)
+
+
+if __name__ == '__main__':
+    main()
@@ -12,7 +12,7 @@ setuptools.setup(
     license='MIT',
     keywords='http log apache nginx monitoring terminal console metrics',
     packages=['akita'],
-    python_requires='>=3.4',
+    python_requires='>=3.5',
     extras_require={'test': ['pytest']},  # "pip install akita[test]"
     entry_points={'console_scripts': ['akita=akita.__main__:main']},
     classifiers=[
@@ -21,7 +21,6 @@ setuptools.setup(
         'Operating System :: MacOS :: MacOS X',
         'Operating System :: POSIX',
         'Natural Language :: English',
-        'Programming Language :: Python :: 3.4',
         'Programming Language :: Python :: 3.5',
         'Programming Language :: Python :: 3.6',
         'Programming Language :: Python :: 3.7',
@@ -0,0 +1,89 @@
+import os
+import asyncio
+
+from akita.aio import follow, wait_readable
+from akita.reader import ChunkedLineReader, FileFollower
+
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+def test_wait_readable():
+    read_fd, write_fd = os.pipe()
+    try:
+        assert not run(wait_readable(read_fd, timeout=0.01))
+        os.write(write_fd, b'foo')
+        assert run(wait_readable(read_fd, timeout=1))
+    finally:
+        os.close(read_fd)
+        os.close(write_fd)
+
+
+def test_follow_pipe():
+    read_fd, write_fd = os.pipe()
+    reader = ChunkedLineReader(os.fdopen(read_fd, 'rb'))
+    assert reader.selectable() == read_fd
+
+    lines = []
+
+    async def on_chunk(chunk):
+        lines.extend(reader.decode(chunk))
+
+    async def write():
+        for data in (b'one\ntw', b'o\n', b'three'):
+            await asyncio.sleep(0.01)
+            os.write(write_fd, data)
+        os.close(write_fd)
+
+    async def main():
+        await asyncio.gather(follow(reader, on_chunk), write())
+
+    # The follower returns once the pipe is closed, including the last line
+    run(main())
+    assert lines == ['one', 'two', 'three']
+    assert reader.closed
+    reader.fp.close()
+
+
+def test_follow_files(tmpdir):
+    paths = [str(tmpdir.join(name)) for name in ('a.log', 'b.log')]
+    for path in paths:
+        open(path, 'wb').close()
+    followers = [FileFollower(open(path, 'rb')) for path in paths]
+
+    lines = []
+
+    def on_chunk(reader):
+        async def callback(chunk):
+            lines.extend(reader.decode(chunk))
+        return callback
+
+    async def write():
+        for path in paths:
+            await asyncio.sleep(0.01)
+            with open(path, 'ab') as fp:
+                fp.write(os.path.basename(path).encode() + b'\n')
+
+    async def main():
+        tasks = [asyncio.ensure_future(follow(f, on_chunk(f)))
+                 for f in followers]
+        await write()
+
+        # Files are followed forever, so stop once both lines are read
+        for _ in range(50):
+            if len(lines) == 2:
+                break
+            await asyncio.sleep(0.01)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    run(main())
+    assert sorted(lines) == ['a.log', 'b.log']
+    for follower in followers:
+        follower.close()
@@ -0,0 +1,335 @@
+import time
+import select
+import logging
+import threading
+from collections import Counter
+
+import pytest
+
+from akita.akita import Akita, MetricsAggregator, CursesLogHandler, Wakeup
+from akita.akita import parse_cmdline
+
+
+def make_points(timestamps):
+    return [{'subpath': 'foo', 'status': '200', 'timestamp': t}
+            for t in timestamps]
+
+
+def test_aggregator_add_points():
+    metrics = MetricsAggregator(alert_threshold=10, alert_window=10)
+    metrics.add_points(make_points([1, 2, 3]))
+    metrics.add_error(2)
+    assert metrics.hit_total == 3
+    assert metrics.miss_total == 2
+    assert metrics.traffic_counter.buffer == 3
+    assert metrics.subpath_counter.buffer['foo'] == 3
+
+
+def test_aggregator_event_time():
+    metrics = MetricsAggregator(
+        alert_threshold=6, alert_window=5, event_time=True)
+    assert 'timestamp' in metrics.fields
+
+    # 50 requests replayed at once over 10 seconds of log time should
+    # stay below the alert threshold of 6/s averaged over 5 seconds
+    timestamps = [100 + i / 5 for i in range(50)]
+    metrics.add_points(make_points(timestamps))
+    assert not metrics.alert_metric.triggered
+    assert metrics.traffic_counter.head == 109
+    assert list(metrics.traffic_counter.history)[:5] == [5, 5, 5, 5, 5]
+
+    # 20 requests in the same second will push the average over 6/s
+    metrics.add_points(make_points([110] * 20))
+    metrics.add_points(make_points([111]))
+    assert metrics.alert_metric.triggered
+    assert metrics.alert_metric.triggered_at == 111
+
+
+def test_aggregator_event_time_flush():
+    metrics = MetricsAggregator(
+        alert_threshold=10, alert_window=10, event_time=True)
+    metrics.add_points(make_points([time.time() - 7200]))
+
+    # The UI flushes once a second, which mustn't drop a log that's behind
+    # the wall clock
+    metrics.flush()
+    metrics.add_points(make_points([time.time() - 3600] * 100))
+    assert metrics.late_total == 0
+    assert metrics.traffic_counter.buffer == 100
+    assert metrics.alert_metric.buffer == 100
+
+
+def test_aggregator_lock():
+    metrics = MetricsAggregator(
+        alert_threshold=10, alert_window=10, event_time=True)
+    metrics.add_points(make_points([100]))
+
+    # The reader thread rolls the windows over in event time mode, so it
+    # has to wait while the UI is reading the metrics
+    thread = threading.Thread(
+        target=metrics.add_points, args=(make_points([200]),))
+    with metrics.lock:
+        thread.start()
+        thread.join(0.1)
+        assert thread.is_alive()
+        assert metrics.subpath_counter.head == 100
+    thread.join(1)
+    assert not thread.is_alive()
+    assert metrics.subpath_counter.head == 200
+
+
+def test_aggregator_follow_clock():
+    metrics = MetricsAggregator(
+        alert_threshold=1, alert_window=5, event_time=True,
+        allowed_lateness=2, follow_clock=True)
+    start = int(time.time()) - 30
+    metrics.add_points(make_points([start] * 100 + [start + 1]))
+    assert metrics.alert_metric.triggered
+
+    # The agents went quiet, the windows should keep up with the clock so
+    # that the alert can clear
+    metrics.flush()
+    assert metrics.alert_metric.head >= start + 26
+    assert not metrics.alert_metric.triggered
+
+
+def test_aggregator_late_points():
+    metrics = MetricsAggregator(
+        alert_threshold=10, alert_window=10, event_time=True,
+        allowed_lateness=2)
+    metrics.add_point({'subpath': 'foo', 'status': '200', 'timestamp': 100})
+    metrics.add_point({'subpath': 'foo', 'status': '200', 'timestamp': 95})
+    assert metrics.late_total == 1
+    assert metrics.alert_metric.dropped == 1
+    assert metrics.traffic_counter.buffer == 1
+
+
+def test_aggregator_snapshot_merge():
+    metrics_a = MetricsAggregator(
+        alert_threshold=10, alert_window=10, event_time=True)
+    metrics_b = MetricsAggregator(
+        alert_threshold=10, alert_window=10, event_time=True)
+    metrics_a.add_points(make_points([100, 101, 102]))
+    metrics_b.add_points(make_points([101, 102, 103]))
+    metrics_b.add_error()
+
+    restored = MetricsAggregator(alert_threshold=10, alert_window=10)
+    restored.restore(metrics_b.snapshot())
+    assert restored.snapshot() == metrics_b.snapshot()
+
+    metrics_a.merge(restored)
+    assert metrics_a.hit_total == 6
+    assert metrics_a.miss_total == 1
+    assert metrics_a.watermark == 103
+    assert metrics_a.traffic_counter.total == 5
+    assert metrics_a.traffic_counter.buffer == 1
+    assert metrics_a.subpath_counter.total['foo'] == 5
+
+
+def test_aggregator_time_to_next_window():
+    metrics = MetricsAggregator(alert_threshold=10, alert_window=120)
+    assert metrics.time_to_next_window(1000.25) == 0.75
+    assert metrics.time_to_next_window(1000.0) == 1.0
+
+
+def test_wakeup():
+    wakeup = Wakeup()
+    try:
+        readable, _, _ = select.select([wakeup], [], [], 0)
+        assert not readable
+
+        wakeup.set()
+        wakeup.set()
+        readable, _, _ = select.select([wakeup], [], [], 0)
+        assert readable == [wakeup]
+
+        wakeup.clear()
+        readable, _, _ = select.select([wakeup], [], [], 0)
+        assert not readable
+    finally:
+        wakeup.close()
+
+
+def test_log_handler_wakeup():
+    wakeup = Wakeup()
+    try:
+        message_queue = []
+        handler = CursesLogHandler(message_queue, wakeup)
+        handler.emit(logging.makeLogRecord({'msg': 'hello'}))
+        assert len(message_queue) == 1
+
+        readable, _, _ = select.select([wakeup], [], [], 0)
+        assert readable == [wakeup]
+    finally:
+        wakeup.close()
+
+
+def test_aggregator_sources():
+    metrics = MetricsAggregator(
+        alert_threshold=10, alert_window=10, sources=True)
+    assert 'source_counter' in metrics.metric_names
+
+    metrics.add_points(make_points([1, 2, 3]), source='a.log')
+    metrics.add_points(make_points([4]), source='b.log')
+    counter = metrics.source_counter.buffer
+    assert counter['a.log'] == 3
+    assert counter['b.log'] == 1
+    assert counter[None] == 4
+
+
+def test_parse_cmdline_files(tmpdir):
+    path = str(tmpdir.join('access.log'))
+    open(path, 'w').close()
+
+    args = parse_cmdline([path])
+    assert args.logfile.name == path
+    args.logfile.close()
+
+    args = parse_cmdline([str(tmpdir.join('*.log'))])
+    assert args.logfile is None
+    assert args.logfiles == [str(tmpdir.join('*.log'))]
+
+
+def test_aggregator_percentiles():
+    metrics = MetricsAggregator(
+        alert_threshold=10, alert_window=10, percentiles=True)
+    assert 'request_time' in metrics.fields
+
+    points = [
+        {'subpath': 'api', 'status': '200', 'size': '1000',
+         'request_time': '0.100'},
+        {'subpath': 'api', 'status': '200', 'size': '3000',
+         'request_time': '300000'},
+        {'subpath': 'img', 'status': '304', 'size': '-', 'request_time': None},
+        # int() can't convert every string that str.isdigit() accepts
+        {'subpath': 'img', 'status': '200', 'size': '\u00b92',
+         'request_time': None},
+    ]
+    metrics.add_points(points)
+
+    latency = metrics.latency_metric.buffer
+    assert latency.count == 2
+    assert latency.quantile(1) == pytest.approx(0.3, rel=0.02)
+    assert metrics.size_metric.buffer.count == 4
+    assert metrics.bytes_counter.buffer == Counter({'api': 4000, None: 4000})
+
+
+def test_aggregator_status_codes():
+    metrics = MetricsAggregator(
+        alert_threshold=10, alert_window=10, error_threshold=0.5,
+        error_window=5)
+    assert 'status' in metrics.fields
+
+    points = [{'subpath': 'api', 'status': code}
+              for code in ['200', '404'] + ['503'] * 20]
+    metrics.add_points(points)
+    assert metrics.status_counter.buffer.classes()[2:] == [1, 0, 1, 20]
+
+    metrics._flush_metrics(1000)
+    metrics._flush_metrics(1001)
+    assert metrics.error_alert.triggered
+
+
+def test_aggregator_rejects():
+    metrics = MetricsAggregator(alert_threshold=10, alert_window=10)
+    rejects = [('format', 'garbage')] * 30 + [('timestamp', 'x')]
+    metrics.add_rejects(rejects)
+    metrics.add_rejects([('format', 'more garbage')])
+
+    assert metrics.miss_total == 32
+    assert metrics.error_reasons == Counter({'format': 31, 'timestamp': 1})
+    assert len(metrics.error_samples) == metrics.n_error_samples
+    assert metrics.error_samples.seen == 32
+
+    restored = MetricsAggregator(alert_threshold=10, alert_window=10)
+    restored.restore(metrics.snapshot())
+    assert restored.error_reasons == metrics.error_reasons
+    restored.merge(metrics)
+    assert restored.error_reasons['format'] == 62
+
+
+def test_aggregator_sampled_points():
+    metrics = MetricsAggregator(alert_threshold=10, alert_window=10,
+                                event_time=True)
+    points = [{'subpath': 'api', 'status': '200', 'timestamp': 1000.5}] * 3
+    points.append({'subpath': 'img', 'status': '500', 'timestamp': 1000.5})
+    metrics.add_points(points, weight=8)
+    metrics.add_skipped(28)
+
+    assert metrics.hit_total == 4
+    assert metrics.skipped_total == 28
+    assert metrics.sample_step == 8
+    assert metrics.traffic_counter.buffer == 32
+    assert metrics.subpath_counter.buffer == Counter(
+        {'api': 24, 'img': 8, None: 32})
+    assert metrics.status_counter.buffer.classes()[2:] == [24, 0, 0, 8]
+
+    metrics._flush_metrics(1001)
+    # 4 points that each stand in for 8 hits, +/- 1.96 * sqrt(4 * 8 * 7)
+    assert metrics.sample_variance.total == 224
+    assert metrics.error_bound(32) == pytest.approx(29.3, abs=0.1)
+    assert metrics.error_bound(8) == pytest.approx(14.7, abs=0.1)
+
+    # Without sampling the counts are exact
+    metrics = MetricsAggregator(alert_threshold=10, alert_window=10)
+    metrics.add_points(points)
+    metrics._flush_metrics(1001)
+    assert metrics.error_bound(4) == 0
+
+
+def test_akita_backfill_with_flush(tmpdir):
+    def write_log(path, start, count):
+        with path.open('w') as fp:
+            for i in range(count):
+                stamp = time.strftime('%d/%b/%Y:%H:%M:%S %z',
+                                      time.localtime(start + i))
+                fp.write('127.0.0.1 - - [{}] "GET /a/b HTTP/1.0" 200 10 '
+                         '"-" "curl"\n'.format(stamp))
+
+    now = time.time()
+    write_log(tmpdir.join('access.log.1'), now - 7200, 300)
+    write_log(tmpdir.join('access.log'), now - 60, 30)
+
+    metrics = MetricsAggregator(100, 10, event_time=True)
+    fp = open(str(tmpdir.join('access.log')), 'rb')
+    akita = Akita(fp, metrics, chunk_size=1024, backfill=True)
+    try:
+        akita.reader.seek_end()
+        # The UI loop keeps flushing while the rotated file is being read
+        metrics.flush()
+        while not akita.reader.at_eof:
+            lines = akita._read_lines(akita.reader)
+            if lines:
+                akita._process_lines(lines)
+            metrics.flush()
+    finally:
+        logging.getLogger('akita').removeHandler(akita.logger.handlers[-1])
+        fp.close()
+
+    assert metrics.hit_total == 330
+    assert metrics.late_total == 0
+
+    with pytest.raises(ValueError):
+        Akita(None, MetricsAggregator(100, 10), backfill=True)
+
+
+def test_akita_process_lines_error(monkeypatch):
+    metrics = MetricsAggregator(100, 10)
+    akita = Akita(None, metrics)
+
+    def add_points(*args):
+        raise KeyError('status')
+
+    # The reader thread should keep going and count the lines as errors
+    monkeypatch.setattr(metrics, 'add_points', add_points)
+    try:
+        akita._process_lines([
+            '127.0.0.1 - - [01/Jan/2020:00:00:00 +0000] '
+            '"GET /a/b HTTP/1.0" 200 10',
+            'garbage'])
+    finally:
+        logging.getLogger('akita').removeHandler(akita.logger.handlers[-1])
+
+    assert metrics.miss_total == 2
+    assert metrics.error_reasons.most_common(1)[0][1] == 1
+    assert 'Unable to add 1 lines' in akita.message_queue[-1].getMessage()
@@ -0,0 +1,62 @@
+from akita.bench import LogGenerator, run_benchmarks, compare
+from akita.bench import parse_status_mix
+from akita.parser import HTTPLogParser
+from akita.jsonlog import JSONLogParser
+
+
+def test_generator_is_deterministic():
+    lines = LogGenerator(seed=1).take(500)
+    assert LogGenerator(seed=1).take(500) == lines
+    assert LogGenerator(seed=2).take(500) != lines
+
+    # The order that the status codes were given in doesn't matter
+    mix = [(200, 90), (404, 5), (500, 5)]
+    assert LogGenerator(status_mix=dict(mix), seed=1).take(500) == \
+        LogGenerator(status_mix=dict(reversed(mix)), seed=1).take(500)
+
+
+def test_generator_traffic():
+    generator = LogGenerator(rate=100, n_paths=5, status_mix={200: 1, 500: 1},
+                             burst_every=10, burst_length=2, burst_factor=3)
+    assert [generator.rate_at(s) for s in (0, 1, 10, 11, 12, 20)] == [
+        100, 100, 300, 300, 100, 300]
+
+    lines = generator.take(1000)
+    points, n_errors = HTTPLogParser(
+        ('subpath', 'status', 'timestamp')).parse_batch(lines)
+    assert n_errors == 0
+    assert {p['subpath'] for p in points} == {
+        'api', 'static', 'images', 'blog', 'search'}
+    assert {p['status'] for p in points} == {'200', '500'}
+    assert points[0]['timestamp'] == 1522160127
+    assert points[-1]['timestamp'] == 1522160136
+
+
+def test_generator_formats():
+    lines = LogGenerator(malformed=0.2).take(1000)
+    _, n_errors = HTTPLogParser(('subpath', 'status')).parse_batch(lines)
+    assert 100 < n_errors < 300
+
+    lines = LogGenerator(log_format='json').take(100)
+    points, n_errors = JSONLogParser(
+        'json', ('subpath', 'timestamp')).parse_batch(lines)
+    assert n_errors == 0
+    assert points[0]['timestamp'] == 1522160127
+
+    assert parse_status_mix('200=90,500') == {200: 90, 500: 1}
+
+
+def test_run_benchmarks():
+    results = run_benchmarks(n_lines=200, repeat=1)
+    assert 'ingest/replay' in results['results']
+    assert all(r['ops_per_sec'] > 0 for r in results['results'].values())
+
+    slower = {'results': {
+        name: dict(result, ops_per_sec=result['ops_per_sec'] * 0.5)
+        for name, result in results['results'].items()}}
+    rows, regressions = compare(slower, results)
+    assert len(rows) == len(results['results'])
+    assert regressions == [row[0] for row in rows]
+
+    rows, regressions = compare(results, slower)
+    assert not regressions
@@ -1,4 +1,6 @@
-from akita.display import Display
+import time
+
+from akita.display import Display, OutputMeter
 
 
 def test_display():
@@ -8,3 +10,20 @@ def test_display():
     At least make sure we can import and instantiate the class.
     """
     assert Display(None)
+
+
+def test_output_meter(tmpdir):
+    path = tmpdir.join('io')
+    path.write('rchar: 100\nwchar: 1000\n')
+
+    meter = OutputMeter(interval=0, path=str(path))
+    path.write('rchar: 100\nwchar: 3000\n')
+    time.sleep(0.01)
+    meter.update()
+    assert meter.rate > 0
+
+
+def test_output_meter_unavailable(tmpdir):
+    meter = OutputMeter(interval=0, path=str(tmpdir.join('missing')))
+    meter.update()
+    assert meter.rate is None
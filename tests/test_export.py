@@ -0,0 +1,96 @@
+import json
+import threading
+from urllib.request import urlopen
+from urllib.error import HTTPError
+
+import pytest
+
+from akita.akita import MetricsAggregator
+from akita.export import MetricsExporter, MetricsServer, parse_http_address
+
+
+def make_metrics():
+    metrics = MetricsAggregator(alert_threshold=10, alert_window=10)
+    metrics.flush()
+    metrics.add_points([{'subpath': 'api', 'status': '200'}] * 3 +
+                      [{'subpath': 'a"b', 'status': '503'}])
+    metrics.add_error(2)
+    metrics._flush_metrics(metrics.traffic_counter.head + 1)
+    return metrics
+
+
+def test_parse_http_address():
+    assert parse_http_address('127.0.0.1:9180') == ('127.0.0.1', 9180)
+    assert parse_http_address(':9180') == ('0.0.0.0', 9180)
+    with pytest.raises(ValueError):
+        parse_http_address('localhost')
+
+
+def test_exporter():
+    metrics = make_metrics()
+    exporter = MetricsExporter(metrics)
+    assert exporter.update()
+
+    data = json.loads(exporter.json.decode())
+    assert data['hits_total'] == 4
+    assert data['errors_total'] == 2
+    assert data['traffic']['current'] == 4
+    assert data['sections'] == [['api', 3], ['a"b', 1]]
+    assert data['alert']['triggered'] is False
+    assert data['status_classes']['5xx'] == 1
+    assert data['status_codes'] == [[200, 3], [503, 1]]
+
+    text = exporter.prometheus.decode()
+    assert 'akita_hits_total 4\n' in text
+    assert 'akita_section_hits{section="/api"} 3\n' in text
+    assert 'akita_section_hits{section="/a\\"b"} 1\n' in text
+    assert '# TYPE akita_alert_active gauge\n' in text
+    assert 'akita_responses{class="5xx"} 1\n' in text
+
+
+def test_exporter_cached_per_window():
+    metrics = make_metrics()
+    exporter = MetricsExporter(metrics)
+    exporter.update()
+    cached = exporter.json
+
+    # New points aren't exported until the window rolls over
+    metrics.add_points([{'subpath': 'api', 'status': '200'}])
+    assert not exporter.update()
+    assert exporter.json is cached
+
+    metrics._flush_metrics(metrics.traffic_counter.head + 1)
+    assert exporter.update()
+    assert json.loads(exporter.json.decode())['hits_total'] == 5
+
+
+def test_exporter_lock():
+    metrics = make_metrics()
+    exporter = MetricsExporter(metrics)
+
+    # The metrics are copied out while the reader thread is locked out
+    thread = threading.Thread(target=exporter.update)
+    with metrics.lock:
+        thread.start()
+        thread.join(0.1)
+        assert thread.is_alive()
+    thread.join(1)
+    assert json.loads(exporter.json.decode())['hits_total'] == 4
+
+
+def test_metrics_server():
+    exporter = MetricsExporter(make_metrics())
+    exporter.update()
+    server = MetricsServer('127.0.0.1:0', exporter)
+    server.start()
+    try:
+        url = 'http://{}'.format(server.address)
+        with urlopen(url + '/metrics') as response:
+            assert response.headers['Content-Type'].startswith('text/plain')
+            assert response.read() == exporter.prometheus
+        with urlopen(url + '/metrics.json') as response:
+            assert response.read() == exporter.json
+        with pytest.raises(HTTPError):
+            urlopen(url + '/missing')
+    finally:
+        server.stop()
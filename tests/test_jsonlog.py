@@ -0,0 +1,119 @@
+import json
+
+import pytest
+
+from akita.akita import MetricsAggregator
+from akita.logformat import create_parser
+from akita.jsonlog import JSONLogParser, ISOTimestampDecoder
+from akita.jsonlog import parse_json_format
+
+
+LINE = json.dumps({
+    'time': '2018-03-27T10:15:27.250-04:00',
+    'remote_addr': '10.0.0.1',
+    'method': 'GET',
+    'path': '/api/users?id=1',
+    'status': 502,
+    'size': 157,
+    'user_agent': 'curl/7.58.0',
+    'request_time': 0.25,
+})
+
+
+def test_iso_timestamps():
+    decoder = ISOTimestampDecoder()
+    assert decoder.to_timestamp('2018-03-27T14:15:27Z') == 1522160127.0
+    assert decoder.to_timestamp('2018-03-27T10:15:27-04:00') == 1522160127.0
+    assert decoder.to_timestamp('2018-03-27 19:45:27.5+0530') == 1522160127.5
+    assert decoder.to_timestamp('2018-03-27T14:15:27') == 1522160127.0
+    assert decoder.to_timestamp('2018-03-27T14:15') == 1522160100.0
+    assert len(decoder._cache) == 4
+
+    with pytest.raises(ValueError):
+        decoder.to_timestamp('2018-03-27T14:15:27 EST')
+
+
+def test_default_fields():
+    parser = JSONLogParser('json', fields=(
+        'subpath', 'status', 'timestamp', 'size', 'request_time', 'host',
+        'referrer'))
+    assert parser.extract(LINE) == {
+        'subpath': 'api',
+        'status': 502,
+        'timestamp': 1522160127.25,
+        'size': 157,
+        'request_time': 0.25,
+        'host': '10.0.0.1',
+        'referrer': None,
+    }
+
+
+def test_field_mapping():
+    parser = create_parser(
+        ('method', 'path', 'status', 'timestamp', 'request_time', 'host'),
+        'json:request=req,status=code,time=ts:ms,request_time=took:ms,'
+        'host=client.ip')
+    line = ('{"ts": 1522160127500, "req": "POST /x HTTP/1.0", "code": "201", '
+            '"took": 12, "client": {"ip": "1.2.3.4"}}')
+    assert parser.extract(line) == {
+        'method': 'POST', 'path': '/x', 'status': 201,
+        'timestamp': 1522160127.5, 'request_time': 0.012, 'host': '1.2.3.4'}
+
+    for log_format in ('json:foo=bar', 'json:status=code:ms', 'json:path='):
+        with pytest.raises(ValueError):
+            parse_json_format(log_format)
+
+
+def test_fast_path_fallbacks():
+    parser = JSONLogParser('json', fields=('path', 'status'))
+    assert parser._scan(LINE) == {'path': '/api/users?id=1', 'status': 502}
+
+    lines = [
+        # A nested key with the same name
+        '{"upstream": {"status": 200}, "path": "/", "status": 502}',
+        # The key's name used as a value first
+        '{"msg": "status", "path": "/", "status": 502}',
+        # No spaces and an escaped quote
+        '{"path":"/\\"status\\"","status":502}',
+    ]
+    for line in lines:
+        data = parser.extract(line)
+        assert data['status'] == 502
+        assert data == {'path': json.loads(line)['path'], 'status': 502}
+    assert parser._scan(lines[0]) is None
+    assert parser._scan(lines[1]) is None
+
+    points, n_errors = parser.parse_batch([
+        LINE, '', 'not json', '[1, 2]', '{"path": "/"}', '{"status": 200}'])
+    assert len(points) == 1
+    assert n_errors == 5
+
+
+def test_try_extract_reasons():
+    parser = JSONLogParser('json', fields=('path', 'status', 'timestamp'))
+    lines = {
+        ' ': 'empty',
+        LINE[:40]: 'format',
+        '{"path": "/", ': 'format',
+        '{"path": "/", "status": }': 'format',
+        '{"path": "/", "time": 0}': 'missing',
+        '{"path": "/", "status": "abc", "time": 0}': 'value',
+        '{"path": "/", "status": 200, "time": "yesterday"}': 'timestamp',
+    }
+    for line, reason in lines.items():
+        assert parser.try_extract(line) == (None, reason)
+    assert parser.try_extract(LINE)[1] is None
+
+
+def test_aggregator_json_points():
+    metrics = MetricsAggregator(alert_threshold=10, alert_window=10,
+                                event_time=True, percentiles=True)
+    parser = create_parser(metrics.fields, 'json')
+    points, n_errors = parser.parse_batch([LINE] * 3)
+    assert n_errors == 0
+
+    metrics.add_points(points)
+    assert metrics.subpath_counter.buffer['api'] == 3
+    assert metrics.status_counter.buffer.total() == 3
+    assert metrics.latency_metric.buffer.count == 3
+    assert metrics.bytes_counter.buffer[None] == 471
@@ -0,0 +1,117 @@
+import os
+
+import pytest
+
+from akita.parser import HTTPLogParser
+from akita.logformat import LogFormatParser, tokenize
+
+
+LOG_FILE = os.path.join(os.path.dirname(__file__), 'data', 'apache.log')
+
+NGINX_FORMAT = (
+    '$remote_addr - $remote_user [$time_local] "$request" $status '
+    '$body_bytes_sent "$http_referer" "$http_user_agent" $request_time '
+    '$upstream_response_time $host')
+
+NGINX_LINE = (
+    '10.0.0.1 - - [27/Mar/2018:10:15:27 -0400] "GET /api/users?id=1 '
+    'HTTP/1.1" 502 157 "-" "curl/7.58.0" 0.250 0.010, 0.200 example.com')
+
+
+@pytest.fixture()
+def log_lines():
+    with open(LOG_FILE) as fp:
+        return fp.read().splitlines()
+
+
+def test_tokenize():
+    assert tokenize('%h [%{%d/%b}t] \\"%r\\" %%') == [
+        '', ('host', None), ' [', (None, None), '] "', ('request', None),
+        '" %']
+    assert tokenize('$remote_addr ${status}x') == [
+        '', ('host', None), ' ', ('status', None), 'x']
+
+
+def test_combined_matches_default_parser(log_lines):
+    parser = LogFormatParser('combined')
+    default = HTTPLogParser(fields=parser.fields)
+    for line in log_lines:
+        assert parser.extract(line) == default.extract(line)
+
+
+def test_nginx_format():
+    parser = LogFormatParser(NGINX_FORMAT, fields=(
+        'subpath', 'status', 'timestamp', 'request_time', 'upstream_time',
+        'vhost', 'cookies'))
+    data = parser.extract(NGINX_LINE)
+    assert data['subpath'] == 'api'
+    assert data['status'] == '502'
+    assert data['timestamp'] == 1522160127.0
+    assert data['request_time'] == 0.25
+    assert data['upstream_time'] == pytest.approx(0.21)
+    assert data['vhost'] == 'example.com'
+    assert data['cookies'] is None
+
+
+def test_apache_request_time():
+    parser = LogFormatParser('%h %l %u %t "%r" %>s %b %D',
+                             fields=('request_time', 'method'))
+    line = ('1.2.3.4 - - [27/Mar/2018:10:15:27 -0400] "GET / HTTP/1.1" 200 '
+            '43 1500')
+    assert parser.extract(line) == {'request_time': 0.0015, 'method': 'GET'}
+
+
+def test_escaped_quotes_fallback():
+    parser = LogFormatParser('combined', fields=('agent', 'status'))
+    line = ('1.2.3.4 - - [27/Mar/2018:10:15:27 -0400] "GET / HTTP/1.1" 200 '
+            '43 "-" "Mozilla \\"quoted\\" agent"')
+    assert parser._split(line) is None
+    assert parser.extract(line) == {
+        'agent': 'Mozilla \\"quoted\\" agent', 'status': '200'}
+
+    points, n_errors = parser.parse_batch([line, 'garbage'])
+    assert len(points) == 1
+    assert n_errors == 1
+
+
+def test_try_extract_reasons():
+    parser = LogFormatParser(
+        '%h %l %u %t "%r" %>s %b %D', fields=('subpath', 'timestamp',
+                                               'request_time'))
+    line = ('1.2.3.4 - - [27/Mar/2018:10:15:27 -0400] "GET /a HTTP/1.1" 200 '
+            '43 1500')
+    assert parser.try_extract(line) == ({
+        'subpath': 'a', 'timestamp': 1522160127.0, 'request_time': 0.0015},
+        None)
+
+    lines = {
+        '': 'empty',
+        line[:50]: 'format',
+        line.replace('GET /a HTTP/1.1', 'GET'): 'request',
+        line.replace('Mar', 'Foo'): 'timestamp',
+        line.replace('1500', '1.5s'): 'value',
+        # str.isdigit() accepts superscripts, the regex doesn't
+        line.replace(' 200 ', ' \u00b200 '): 'format',
+    }
+    for bad_line, reason in lines.items():
+        assert parser.try_extract(bad_line) == (None, reason)
+
+    rejects = []
+    parser.parse_batch([line] + list(lines), rejects)
+    assert [reason for reason, _ in rejects] == list(lines.values())
+
+
+def test_converters():
+    parser = LogFormatParser('common', fields=('size',),
+                             converters={'size': int})
+    line = '1.2.3.4 - - [27/Mar/2018:10:15:27 -0400] "GET / HTTP/1.1" 200 43'
+    assert parser.extract(line) == {'size': 43}
+
+
+def test_invalid_formats():
+    with pytest.raises(ValueError):
+        LogFormatParser('%h %u %r', fields=('subpath', 'status'))
+    with pytest.raises(ValueError):
+        LogFormatParser('%h%u %t "%r" %>s')
+    with pytest.raises(ValueError):
+        LogFormatParser('combined', fields=('foo',))
@@ -1,6 +1,13 @@
 from collections import Counter
 
+import pytest
+
 from akita.metrics import CounterMetric, TaggedCounterMetric, AlertMetric
+from akita.metrics import HeavyHitters, TopKCounterMetric, RingBuffer
+from akita.metrics import LogHistogram, QuantileMetric
+from akita.metrics import StatusCounts, StatusMetric, ErrorRateAlertMetric
+from akita.metrics import ReservoirSample, RollupMetric
+from akita.metrics import encode_snapshot, decode_snapshot
 
 
 def test_counter_metric():
@@ -103,3 +110,434 @@ def test_alert_metric():
     assert alert == metric.ALERT_STOP
     assert not metric.triggered
     assert metric.triggered_at == 28
+
+
+def test_counter_metric_event_time():
+
+    metric = CounterMetric(window_size=1, n_windows=5)
+
+    # The first point initializes the head of the window
+    metric.add_point(timestamp=10.5)
+    assert metric.head == 10
+    assert metric.buffer == 1
+
+    # Newer points advance the head like a watermark
+    metric.add_point(timestamp=12.2)
+    assert metric.head == 12
+    assert metric.history == [0, 1, 0, 0, 0]
+    assert metric.buffer == 1
+
+    # Older points are placed into their matching window
+    metric.add_point(count=2, timestamp=11.9)
+    metric.add_point(timestamp=10.0)
+    assert metric.history == [2, 2, 0, 0, 0]
+    assert metric.total == 4
+    assert metric.max == 2
+
+    # Points that are older than the entire history are dropped
+    metric.add_point(timestamp=3)
+    assert metric.dropped == 1
+    assert metric.total == 4
+
+
+def test_counter_metric_allowed_lateness():
+
+    metric = CounterMetric(window_size=1, n_windows=5, allowed_lateness=1)
+    metric.add_point(timestamp=10)
+    metric.add_point(timestamp=9)
+    metric.add_point(timestamp=8)
+    assert metric.history == [1, 0, 0, 0, 0]
+    assert metric.dropped == 1
+
+
+def test_tagged_counter_metric_event_time():
+
+    metric = TaggedCounterMetric(window_size=1, n_windows=5)
+    metric.add_point(tags=['foo'], timestamp=10)
+    metric.add_points(['foo', 'bar'], timestamp=11)
+    metric.add_point(tags=['bar'], timestamp=10)
+
+    assert metric.buffer == Counter({'foo': 1, 'bar': 1, None: 2})
+    assert metric.history[0] == Counter({'foo': 1, 'bar': 1, None: 2})
+    assert metric.total == Counter({'foo': 1, 'bar': 1, None: 2})
+
+
+def test_counter_metric_merge():
+
+    metric_a = CounterMetric(window_size=1, n_windows=5)
+    metric_b = CounterMetric(window_size=1, n_windows=5)
+    for timestamp in [10, 11, 11, 12]:
+        metric_a.add_point(timestamp=timestamp)
+    for timestamp in [9, 11, 13, 13]:
+        metric_b.add_point(timestamp=timestamp)
+
+    metric_a.merge(metric_b)
+    assert metric_a.head == 13
+    assert metric_a.buffer == 2
+    assert metric_a.history == [1, 3, 1, 1, 0]
+    assert metric_a.total == 6
+    assert metric_a.max == 3
+
+
+def test_counter_metric_merge_mismatch():
+
+    metric_a = CounterMetric(window_size=1, n_windows=5)
+    metric_b = CounterMetric(window_size=2, n_windows=5)
+    with pytest.raises(ValueError):
+        metric_a.merge(metric_b)
+
+
+@pytest.mark.parametrize('metric_type', [
+    CounterMetric, TaggedCounterMetric, QuantileMetric, StatusMetric,
+    RollupMetric,
+])
+def test_merge_stale_snapshot(metric_type):
+    metric_a = metric_type(window_size=1, n_windows=10)
+    metric_b = metric_type(window_size=1, n_windows=10)
+    metric_a.flush(timestamp=1000)
+    metric_b.flush(timestamp=900)
+    for _ in range(5):
+        if metric_type is TaggedCounterMetric:
+            metric_b.add_point(tags=['foo'])
+        elif metric_type in (QuantileMetric, StatusMetric):
+            metric_b.add_point(200)
+        else:
+            metric_b.add_point()
+
+    # Everything in the other metric is older than the history
+    metric_a.merge(metric_b)
+    assert metric_a.head == 1000
+    assert metric_a.dropped == 5
+    assert metric_a.total == metric_type(window_size=1, n_windows=10).total
+
+
+def test_tagged_counter_metric_merge():
+
+    metric_a = TaggedCounterMetric(window_size=1, n_windows=5)
+    metric_b = TaggedCounterMetric(window_size=1, n_windows=5)
+    metric_a.add_point(tags=['foo'], timestamp=10)
+    metric_b.add_point(tags=['foo', 'bar'], timestamp=10)
+    metric_b.flush(timestamp=11)
+
+    metric_a.merge(metric_b)
+    assert metric_a.head == 11
+    assert metric_a.history[0] == Counter({'foo': 2, 'bar': 1, None: 2})
+    assert metric_a.total == Counter({'foo': 2, 'bar': 1, None: 2})
+
+
+@pytest.mark.parametrize('metric', [
+    CounterMetric(window_size=1, n_windows=5),
+    TaggedCounterMetric(window_size=1, n_windows=5),
+    AlertMetric(window_size=1, n_windows=5, threshold=1),
+    QuantileMetric(window_size=1, n_windows=5),
+    StatusMetric(window_size=1, n_windows=5),
+    ErrorRateAlertMetric(window_size=1, n_windows=5, threshold=0.5),
+    RollupMetric(window_size=1, n_windows=5, levels=((2, 3), (4, 2))),
+])
+def test_snapshot(metric):
+
+    for timestamp in [10, 11, 11, 12]:
+        if isinstance(metric, TaggedCounterMetric):
+            metric.add_point(tags=['foo'], timestamp=timestamp)
+        elif isinstance(metric, QuantileMetric):
+            metric.add_point(0.25, timestamp=timestamp)
+        elif isinstance(metric, StatusMetric):
+            metric.add_point(200, timestamp=timestamp)
+        else:
+            metric.add_point(timestamp=timestamp)
+    metric.flush(timestamp=12)
+
+    data = decode_snapshot(encode_snapshot(metric.snapshot()))
+    restored = type(metric).from_snapshot(data)
+    assert restored.snapshot() == metric.snapshot()
+    assert restored.head == metric.head
+    assert list(restored.history) == list(metric.history)
+    assert restored.total == metric.total
+
+
+def test_heavy_hitters():
+
+    sketch = HeavyHitters(capacity=10)
+    sketch.update(['foo'] * 10 + ['bar'] * 5)
+    assert sketch['foo'] == 10
+    assert sketch.error('foo') == 0
+
+    # Mix the frequent keys with a flood of unique keys
+    for i in range(1000):
+        sketch.update(['foo', 'foo', 'bar', 'unique-{}'.format(i)])
+        sketch[None] += 4
+
+    # Memory use stays bounded
+    assert len(sketch) <= 20
+    assert sketch[None] == 4000
+
+    # The frequent keys are found, and the true counts are within the bounds
+    (foo, foo_count), (bar, bar_count) = sketch.most_common(2)
+    assert (foo, bar) == ('foo', 'bar')
+    assert foo_count - sketch.error('foo') <= 2010 <= foo_count
+    assert bar_count - sketch.error('bar') <= 1005 <= bar_count
+
+    # New keys start counting from the floor
+    assert sketch.floor > 0
+    sketch['baz'] += 1
+    assert sketch['baz'] == sketch.floor + 1
+    assert sketch.error('baz') == sketch.floor
+
+
+def test_heavy_hitters_merge():
+
+    sketch_a = HeavyHitters(capacity=10)
+    sketch_b = HeavyHitters(capacity=10)
+    sketch_a.update({'foo': 3, 'bar': 1, None: 4})
+    sketch_b.update({'foo': 2, 'baz': 1, None: 3})
+
+    sketch_a += sketch_b
+    assert sketch_a.most_common() == [('foo', 5), ('bar', 1), ('baz', 1)]
+    assert sketch_a[None] == 7
+
+
+def test_top_k_counter_metric():
+
+    metric = TopKCounterMetric(window_size=1, n_windows=5, capacity=3)
+    metric.flush(timestamp=0)
+    for i in range(100):
+        metric.add_point(tags=['foo', 'unique-{}'.format(i)])
+    metric.add_points(['bar'] * 20)
+    metric.flush(timestamp=1)
+    metric.add_counter(Counter({'foo': 5, None: 5}), timestamp=1.5)
+    metric.flush(timestamp=2)
+
+    assert metric.total[None] == 125
+    assert [key for key, _ in metric.total.most_common(2)] == ['foo', 'bar']
+    assert metric.total['foo'] - metric.total.error('foo') <= 105
+    assert metric.total['bar'] - metric.total.error('bar') <= 20
+    assert all(len(value) <= 6 for value in metric.history)
+
+    data = decode_snapshot(encode_snapshot(metric.snapshot()))
+    restored = TopKCounterMetric.from_snapshot(data)
+    assert restored.total.most_common(2) == metric.total.most_common(2)
+    assert restored.capacity == 3
+
+
+def test_ring_buffer():
+
+    ring = RingBuffer(4, int, 'q')
+    assert ring == [0, 0, 0, 0]
+
+    for value in range(1, 7):
+        ring.push(value)
+    assert ring == [6, 5, 4, 3]
+    assert ring[0] == 6
+    assert ring[-1] == 3
+    assert ring[1:3] == [5, 4]
+    assert list(ring.chronological()) == [3, 4, 5, 6]
+    assert list(ring.chronological(2)) == [5, 6]
+
+    ring[1] += 10
+    assert ring == [6, 15, 4, 3]
+    assert ring.push(7) == 3
+
+    with pytest.raises(IndexError):
+        ring[4]
+
+
+def test_counter_metric_large_gap():
+
+    metric = CounterMetric(window_size=1, n_windows=5)
+    metric.flush(timestamp=0)
+    metric.add_point(count=3)
+
+    # A very long stall only needs to clear the history once
+    metric.flush(timestamp=1e9)
+    assert metric.history == [0, 0, 0, 0, 0]
+    assert metric.total == 0
+    assert metric.min == 0
+    assert metric.max == 3
+
+
+def test_metric_version():
+    metric = CounterMetric(window_size=1, n_windows=5)
+    metric.flush(timestamp=0)
+    version = metric.version
+
+    # Filling the buffer or flushing the same window isn't a change
+    metric.add_point(count=3)
+    metric.flush(timestamp=0.5)
+    assert metric.version == version
+
+    metric.flush(timestamp=1)
+    assert metric.version > version
+
+    # Late points that land in the history are a change
+    version = metric.version
+    metric.add_point(timestamp=0)
+    assert metric.version > version
+
+
+def test_log_histogram():
+    histogram = LogHistogram(accuracy=0.01)
+    for value in range(1, 1001):
+        histogram.add(value / 1000)
+    histogram.add(0)
+
+    assert histogram.count == 1001
+    assert histogram.quantile(0) == 0
+    for q in (0.5, 0.95, 0.99):
+        expected = q * 1000 / 1000
+        assert histogram.quantile(q) == pytest.approx(expected, rel=0.02)
+
+    # Values outside of the range are clamped
+    histogram.add(1e9)
+    assert histogram.quantile(1) == pytest.approx(1e6, rel=0.02)
+
+    assert LogHistogram().quantile(0.5) is None
+
+
+def test_log_histogram_merge():
+    a, b, both = LogHistogram(), LogHistogram(), LogHistogram()
+    for value in (0.1, 0.2, 0.3):
+        a.add(value)
+        both.add(value)
+    for value in (0.4, 5):
+        b.add(value)
+        both.add(value)
+
+    a += b
+    assert a == both
+    a -= b
+    assert a.count == 3
+    assert a.quantile(1) == pytest.approx(0.3, rel=0.02)
+
+    with pytest.raises(ValueError):
+        a += LogHistogram(max_value=10)
+
+
+def test_quantile_metric():
+    metric = QuantileMetric(window_size=1, n_windows=5)
+    metric.flush(timestamp=10)
+    metric.add_values([0.1, 0.2, 0.3], timestamp=10)
+    metric.add_values([1.0], timestamp=11)
+
+    # Late values are placed into the history
+    metric.add_values([0.4], timestamp=10)
+    assert metric.history[0].count == 4
+    assert metric.total.quantile(1) == pytest.approx(0.4, rel=0.02)
+
+    metric.flush(timestamp=16)
+    assert metric.total.count == 1
+    assert metric.total.quantile(0.5) == pytest.approx(1.0, rel=0.02)
+
+
+def test_status_counts():
+    counts = StatusCounts()
+    counts.add_codes(['200', '200', '404', '503'])
+    counts.add(999)
+    assert counts.items() == [(0, 1), (200, 2), (404, 1), (503, 1)]
+    assert counts.classes() == [1, 0, 2, 0, 1, 1]
+    assert counts.total() == 5
+
+    other = StatusCounts()
+    other.add(200, 3)
+    counts += other
+    assert counts.classes()[2] == 5
+    counts -= other
+    assert counts.classes()[2] == 2
+
+
+def test_error_rate_alert_metric():
+    metric = ErrorRateAlertMetric(
+        window_size=1, n_windows=10, threshold=0.1, min_requests=10)
+    metric.flush(timestamp=0)
+
+    # 50% errors, but not enough requests to trigger the alert
+    for code in (200, 500):
+        metric.add_point(code, timestamp=1)
+    assert metric.flush(timestamp=2) is None
+
+    metric.add_counts({'200': 16, '502': 2}, timestamp=2)
+    assert metric.flush(timestamp=3) == metric.ALERT_START
+    assert metric.triggered_rate == 0.15
+
+    # The errors drop out of the window
+    for timestamp in range(4, 14):
+        metric.add_point(200, timestamp=timestamp)
+    assert metric.flush(timestamp=14) == metric.ALERT_STOP
+    assert metric.triggered_rate == 0
+
+
+def test_reservoir_sample():
+    sample = ReservoirSample(10, seed=0)
+    sample.extend(range(5))
+    assert sample.items == [0, 1, 2, 3, 4]
+
+    sample.extend(range(5, 10000))
+    sample.add(10000)
+    assert len(sample) == 10
+    assert sample.seen == 10001
+    assert len(set(sample.items)) == 10
+    # Every item is equally likely to be kept, so most of the sample should
+    # come from the end of the stream
+    assert sum(item > 1000 for item in sample.items) > 5
+
+    sample.clear()
+    assert sample.items == [] and sample.seen == 0
+
+
+def test_rollup_metric():
+
+    metric = RollupMetric(window_size=1, n_windows=5,
+                          levels=((10, 3), (30, 2)))
+    tens, thirties = metric.levels
+    for timestamp in range(65):
+        metric.add_point(timestamp % 10, timestamp=timestamp)
+    metric.flush(timestamp=65)
+
+    # 0 + 1 + ... + 9 = 45 in every 10 seconds
+    assert list(tens.sums) == [45, 45, 45]
+    assert list(tens.mins) == [0, 0, 0]
+    assert list(tens.maxes) == [9, 9, 9]
+    assert list(thirties.sums) == [135, 0]
+    assert thirties.filled == 1
+    # The last item is the partial bucket from 60 to 64
+    assert tens.rates() == [(4.5, 0, 9)] * 3 + [(2.0, 0, 4)]
+    assert thirties.rates() == [(4.5, 0, 9), (4.5, 0, 9)]
+
+    # A gap longer than the history only leaves zeros behind
+    metric.flush(timestamp=1000)
+    assert list(tens.sums) == [0, 0, 0]
+    assert tens.head == 990
+    assert thirties.head == 960
+    assert thirties.rates()[0] == (0.0, 0, 0)
+
+
+def test_rollup_metric_late_points():
+
+    metric = RollupMetric(window_size=1, n_windows=30, levels=((10, 5),))
+    tens = metric.levels[0]
+    for timestamp in range(40):
+        metric.add_point(timestamp=timestamp)
+    assert list(tens.sums)[:3] == [10, 10, 10]
+
+    metric.add_point(5, timestamp=15)
+    assert list(tens.sums)[:3] == [10, 15, 10]
+    assert list(tens.maxes)[:3] == [1, 6, 1]
+    assert list(tens.mins)[:3] == [1, 1, 1]
+
+
+def test_rollup_metric_merge():
+
+    metric_a = RollupMetric(window_size=1, n_windows=5, levels=((10, 3),))
+    metric_b = RollupMetric(window_size=1, n_windows=5, levels=((10, 3),))
+    for timestamp in range(25):
+        metric_a.add_point(timestamp=timestamp)
+    for timestamp in range(32):
+        metric_b.add_point(2, timestamp=timestamp)
+
+    metric_a.merge(metric_b)
+    assert metric_a.head == 31
+    assert metric_a.history == [2, 2, 2, 2, 2]
+    assert list(metric_a.levels[0].sums) == [25, 30, 30]
+    assert metric_a.levels[0].rates()[-1] == (2.0, 0, 2)
+
+    with pytest.raises(ValueError):
+        metric_a.merge(RollupMetric(1, 5, levels=((60, 3),)))
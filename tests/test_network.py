@@ -0,0 +1,114 @@
+import io
+import os
+import socket
+import struct
+
+import pytest
+
+from akita.akita import Collector, MetricsAggregator
+from akita.network import Agent, DeltaReceiver, parse_address
+from akita.network import MAX_FRAME_SIZE
+
+
+LOG_FILE = os.path.join(os.path.dirname(__file__), 'data', 'apache.log')
+
+
+@pytest.fixture()
+def log_lines():
+    with open(LOG_FILE) as fp:
+        return fp.read().splitlines()
+
+
+def test_parse_address():
+    assert parse_address('udp://127.0.0.1:8125') == ('udp', ('127.0.0.1', 8125))
+    assert parse_address('tcp://:8125') == ('tcp', ('0.0.0.0', 8125))
+    assert parse_address('unix:///tmp/akita.sock') == ('unix', '/tmp/akita.sock')
+    with pytest.raises(ValueError):
+        parse_address('http://localhost:80')
+
+
+def test_agent_delta(log_lines):
+    agent = Agent(io.BytesIO(), 'udp://127.0.0.1:0', event_time=True,
+                  max_tags=1)
+    agent.process_lines(log_lines[:3] + ['garbage'])
+
+    delta = agent.delta()
+    assert delta['lines'] == 4
+    assert delta['errors'] == 1
+    assert [window[1] for window in delta['windows']] == [1, 1, 1]
+    assert delta['windows'][0][2] == [['item', 1]]
+    assert delta['windows'][0][3] == [[200, 1]]
+
+    # Publishing starts a new delta
+    agent.publish()
+    assert agent.seq == 1
+    assert agent.delta()['windows'] == []
+
+
+@pytest.mark.parametrize('scheme', ['udp', 'tcp', 'unix'])
+def test_collect_from_agents(scheme, log_lines, tmpdir):
+    if scheme == 'unix':
+        address = 'unix://' + str(tmpdir.join('akita.sock'))
+    else:
+        address = scheme + '://127.0.0.1:0'
+
+    metrics = MetricsAggregator(10, 10, event_time=True)
+    collector = Collector(address, metrics)
+    address = collector.receiver.address
+
+    agents = []
+    for i in range(3):
+        agent = Agent(io.BytesIO(), address, name='agent-{}'.format(i),
+                      event_time=True)
+        agent.process_lines(log_lines)
+        agents.append(agent)
+
+    try:
+        for agent in agents:
+            assert agent.publish()
+        received = 0
+        for _ in range(10):
+            received += collector.receiver.poll(timeout=1)
+            if received >= 3:
+                break
+    finally:
+        for agent in agents:
+            agent.sender.close()
+        collector.receiver.close()
+
+    assert sorted(collector.agents) == ['agent-0', 'agent-1', 'agent-2']
+    assert metrics.hit_total == 3 * len(log_lines)
+    assert metrics.subpath_counter.total['category'] > 0
+    assert collector.source_name.endswith('(3 agents)')
+
+
+def test_receiver_keeps_regular_file(tmpdir):
+    path = tmpdir.join('not-a-socket')
+    path.write('important')
+    with pytest.raises(OSError):
+        DeltaReceiver('unix://' + str(path), lambda delta: None)
+    assert path.read() == 'important'
+
+    # A socket left over from a previous run is replaced
+    address = 'unix://' + str(tmpdir.join('akita.sock'))
+    DeltaReceiver(address, lambda delta: None).close()
+    DeltaReceiver(address, lambda delta: None).close()
+
+
+def test_receiver_frame_too_large():
+    receiver = DeltaReceiver('tcp://127.0.0.1:0', lambda delta: None)
+    _, (host, port) = parse_address(receiver.address)
+    conn = socket.create_connection((host, port))
+    try:
+        receiver.poll(timeout=1)
+        assert len(receiver._buffers) == 1
+
+        conn.sendall(struct.pack('!I', MAX_FRAME_SIZE + 1) + b'x' * 100)
+        for _ in range(10):
+            receiver.poll(timeout=1)
+            if not receiver._buffers:
+                break
+        assert receiver._buffers == {}
+    finally:
+        conn.close()
+        receiver.close()
@@ -1,8 +1,11 @@
 import os
+import random
+from datetime import datetime
 
 import pytest
 
-from akita.parser import HTTPLogParser
+from akita.parser import HTTPLogParser, TimestampDecoder
+from akita.logformat import create_parser
 
 
 LOG_FILE = os.path.join(os.path.dirname(__file__), 'data', 'apache.log')
@@ -60,3 +63,181 @@ def test_parse_combined_log_format(parser):
     assert data['referrer'] == 'http://www.ibm.com/'
     assert data['agent'] == 'Mozilla/4.05 [en] (WinNT; I)'
     assert data['cookies'] == 'USERID=CustomerA;IMPID=01234'
+
+
+def test_extract_matches_parse(parser):
+    with open(LOG_FILE) as fp:
+        for line in fp:
+            assert parser.extract(line) == parser.parse(line)
+
+
+def test_extract_selected_fields():
+    parser = HTTPLogParser(fields=['subpath', 'status'])
+    data = parser.extract(LINE + ' "http://www.ibm.com/"')
+    assert data == {'subpath': 'index.html', 'status': '200'}
+
+
+def test_extract_fallback():
+    parser = HTTPLogParser(fields=['subpath', 'user'])
+
+    # Tab separators aren't handled by the fast path
+    line = LINE.replace(' - ', '\t-\t')
+    assert parser._split(line) is None
+    assert parser.extract(line) == {'subpath': 'index.html', 'user': 'dsmith'}
+
+    with pytest.raises(Exception):
+        parser.extract('not a log line')
+
+
+def test_extract_unknown_field():
+    with pytest.raises(ValueError):
+        HTTPLogParser(fields=['subpath', 'foo'])
+
+
+def test_parse_batch():
+    parser = HTTPLogParser(fields=['subpath'])
+    points, n_errors = parser.parse_batch([LINE, 'garbage', '', LINE])
+    assert points == [{'subpath': 'index.html'}, {'subpath': 'index.html'}]
+    assert n_errors == 2
+
+
+def test_try_extract_reasons():
+    parser = HTTPLogParser(fields=['subpath', 'timestamp'])
+    assert parser.try_extract(LINE) == (
+        {'subpath': 'index.html', 'timestamp': 939572105.0}, None)
+
+    lines = {
+        '': 'empty',
+        '  ': 'empty',
+        'garbage': 'format',
+        LINE[:60]: 'format',
+        LINE.replace('GET /index.html HTTP/1.0', 'GET'): 'request',
+        LINE.replace('Oct', 'Foo'): 'timestamp',
+        # The fallback regex finds the same problems
+        LINE.replace(' - ', '\t-\t').replace('Oct', 'Foo'): 'timestamp',
+    }
+    for line, reason in lines.items():
+        assert parser.try_extract(line) == (None, reason)
+
+    rejects = []
+    points, n_errors = parser.parse_batch(list(lines), rejects)
+    assert points == []
+    assert n_errors == len(lines)
+    assert rejects == list(zip(lines.values(), lines))
+
+    with pytest.raises(ValueError, match='request'):
+        parser.extract(LINE.replace('GET /index.html HTTP/1.0', 'GET'))
+
+
+def test_precheck_never_rejects_valid_lines():
+    parser = HTTPLogParser()
+    rand = random.Random(0)
+    with open(LOG_FILE) as fp:
+        lines = fp.read().splitlines()
+
+    for line in lines:
+        for _ in range(20):
+            truncated = line[:rand.randrange(len(line) + 1)]
+            if parser._precheck(truncated) is not None:
+                assert parser.pattern.match(truncated) is None
+
+
+def test_fast_path_matches_regex():
+    parser = HTTPLogParser()
+    rand = random.Random(0)
+    with open(LOG_FILE) as fp:
+        lines = fp.read().splitlines()
+    lines += [line + ' 0.25' for line in lines]
+
+    # Whitespace the regex treats as separators, and characters that the
+    # fast path looks for
+    chars = ' \t\x0b\x0c\r\xa0\u2003"[]0.-\u0663'
+    for _ in range(20000):
+        line = rand.choice(lines)
+        for _ in range(rand.randint(1, 3)):
+            i = rand.randrange(len(line) + 1)
+            if rand.random() < 0.7:
+                line = line[:i] + rand.choice(chars) + line[i:]
+            else:
+                line = line[:i] + line[i + 1:]
+
+        parts = parser._split(line)
+        if parts is not None:
+            match = parser.pattern.match(line)
+            assert match is not None, line
+            assert parts == parser._from_match(line, match), line
+
+    for line in [LINE.replace('125 -', '125\t-'),
+                 LINE.replace('dsmith', 'dsmith\t'),
+                 LINE.replace(' 200 ', ' \u0663\u0660\u0660 '),
+                 LINE + ' 5.', LINE + ' .5']:
+        assert parser._split(line) is None
+
+
+@pytest.mark.parametrize('text', [
+    '10/Oct/1999:21:15:05 +0500',
+    '10/Oct/1999:21:15:59 -0430',
+    '29/Feb/2020:00:00:00 +0000',
+    '31/Dec/1969:23:59:59 -0000',
+])
+def test_timestamp_decoder(text):
+    decoder = TimestampDecoder()
+    expected = datetime.strptime(text, HTTPLogParser.date_fmt)
+
+    # Once to populate the cache, and once to read from it
+    for _ in range(2):
+        assert decoder.to_datetime(text) == expected
+        assert decoder.to_datetime(text).utcoffset() == expected.utcoffset()
+        assert decoder.to_timestamp(text) == expected.timestamp()
+
+
+@pytest.mark.parametrize('text', [
+    '31/Feb/2020:00:00:00 +0000',
+    '10/Foo/1999:21:15:05 +0500',
+    '10/Oct/1999:21:15:65 +0500',
+    '10/Oct/1999:21:15:05',
+    '',
+])
+def test_timestamp_decoder_invalid(text):
+    decoder = TimestampDecoder()
+    with pytest.raises(ValueError):
+        decoder.to_timestamp(text)
+    with pytest.raises(ValueError):
+        decoder.to_datetime(text)
+
+
+def test_timestamp_decoder_cache_size():
+    decoder = TimestampDecoder(maxsize=2)
+    decoder.to_timestamp('10/Oct/1999:21:15:05 +0500')
+    decoder.to_timestamp('10/Oct/1999:21:15:06 +0500')
+    assert len(decoder._cache) == 1
+
+    decoder.to_timestamp('10/Oct/1999:21:16:05 +0500')
+    decoder.to_timestamp('10/Oct/1999:21:17:05 +0500')
+    assert len(decoder._cache) == 2
+
+
+def test_timestamp_decoder_per_parser():
+    # The caches aren't thread safe, so parsers never share a decoder
+    for log_format in (None, 'common', 'json'):
+        parser_a = create_parser(['timestamp'], log_format)
+        parser_b = create_parser(['timestamp'], log_format)
+        assert parser_a.timestamp_decoder is not parser_b.timestamp_decoder
+
+    for log_format in (None, 'common'):
+        parser = create_parser(['datetime', 'timestamp'], log_format)
+        data = parser.extract(LINE)
+        assert data['timestamp'] == data['datetime'].timestamp()
+        assert data['timestamp'] == 939572105.0
+
+
+@pytest.mark.parametrize('suffix, expected', [
+    ('', None),
+    (' 1234', '1234'),
+    (' "-" "curl/7.58.0" 0.015', '0.015'),
+])
+def test_extract_request_time(parser, suffix, expected):
+    line = LINE + suffix
+    assert parser.parse(line)['request_time'] == expected
+    assert parser.extract(line) == parser.parse(line)
+    assert parser._split(line) is not None
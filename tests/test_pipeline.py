@@ -0,0 +1,120 @@
+import os
+from collections import Counter
+
+from akita.akita import MetricsAggregator
+from akita.pipeline import BatchSummary, ParallelParser
+from akita.replay import Replay
+from akita.sampling import LoadShedder
+
+
+LOG_FILE = os.path.join(os.path.dirname(__file__), 'data', 'apache.log')
+
+
+def test_batch_summary():
+    points = [
+        {'subpath': 'foo', 'timestamp': 10.0, 'status': '200'},
+        {'subpath': 'bar', 'timestamp': 10.5, 'status': '503'},
+        {'subpath': 'foo', 'timestamp': 11.0, 'status': '200'},
+        {'subpath': 'foo', 'timestamp': 10.0, 'status': '200'},
+    ]
+    summary = BatchSummary.from_points(points, n_lines=5, n_errors=1)
+    assert summary.n_lines == 5
+    assert summary.n_errors == 1
+    assert summary.n_points == 4
+    assert [entry[:3] for entry in summary.windows] == [
+        [10.0, 3, Counter({'foo': 2, 'bar': 1, None: 3})],
+        [11.0, 1, Counter({'foo': 1, None: 1})],
+    ]
+    assert summary.windows[0][3] == Counter({'200': 2, '503': 1})
+    assert summary.windows[1][3] == Counter({'200': 1})
+
+
+def test_batch_summary_no_timestamps():
+    points = [{'subpath': 'foo'}, {'subpath': 'bar'}]
+    summary = BatchSummary.from_points(points)
+    assert summary.windows == [
+        [None, 2, Counter({'foo': 1, 'bar': 1, None: 2}), Counter()]]
+
+
+def test_parallel_parser():
+    with open(LOG_FILE, 'rb') as fp:
+        chunks = fp.read().rstrip(b'\n').split(b'\n')
+
+    pipeline = ParallelParser(('subpath', 'timestamp'), workers=2)
+    try:
+        summaries = []
+        for chunk in chunks + [b'garbage']:
+            summaries.extend(pipeline.submit(chunk))
+        summaries.extend(pipeline.drain())
+    finally:
+        pipeline.close()
+
+    assert len(summaries) == 39
+    assert sum(s.n_errors for s in summaries) == 1
+
+    # The summaries are returned in the same order as the chunks
+    windows = [s.windows[0][0] for s in summaries[:-1]]
+    assert windows == sorted(windows)
+
+
+def test_parallel_parser_sampling():
+    with open(LOG_FILE, 'rb') as fp:
+        chunk = fp.read().rstrip(b'\n')
+
+    pipeline = ParallelParser(('subpath', 'timestamp'), workers=1)
+    try:
+        pipeline.submit(chunk, step=4)
+        summary, = pipeline.drain()
+    finally:
+        pipeline.close()
+
+    assert summary.n_lines == 38
+    assert summary.n_skipped == 28
+    assert summary.n_points == 10
+    assert summary.weight == 4
+
+    metrics = MetricsAggregator(alert_threshold=10, alert_window=10,
+                                event_time=True)
+    metrics.add_summary(summary)
+    assert metrics.hit_total == 10
+    assert metrics.skipped_total == 28
+    assert metrics.traffic_counter.total + metrics.traffic_counter.buffer \
+        == 40
+
+
+def test_parallel_parser_sampling_offset():
+    with open(LOG_FILE, 'rb') as fp:
+        lines = fp.read().rstrip(b'\n').split(b'\n')
+
+    # The sample carries on across chunks instead of restarting at the
+    # first line of each one
+    shedder = LoadShedder()
+    shedder.step = 4
+    pipeline = ParallelParser(('subpath', 'timestamp'), workers=1)
+    summaries = []
+    try:
+        for start in range(0, len(lines), 5):
+            batch = lines[start:start + 5]
+            summaries += pipeline.submit(b'\n'.join(batch), 4,
+                                         shedder.advance(len(batch)))
+        summaries += pipeline.drain()
+    finally:
+        pipeline.close()
+
+    assert sum(s.n_lines for s in summaries) == 38
+    assert sum(s.n_points for s in summaries) == 10
+
+
+def test_replay_workers():
+    reports = []
+    for workers in (0, 2):
+        metrics = MetricsAggregator(
+            alert_threshold=1, alert_window=5, event_time=True)
+        with open(LOG_FILE, 'rb') as fp:
+            replay = Replay(fp, metrics, chunk_size=1000, workers=workers)
+            report = replay.run()
+            report.pop('elapsed')
+            report.pop('lines_per_sec')
+            reports.append(report)
+
+    assert reports[0] == reports[1]
@@ -0,0 +1,190 @@
+import io
+import os
+import sys
+import gzip
+
+import pytest
+
+from akita.reader import ChunkedLineReader, FileFollower, FileWatcher
+from akita.reader import open_reader, LogFileSet
+
+
+LOG_FILE = os.path.join(os.path.dirname(__file__), 'data', 'apache.log')
+
+
+def test_read_lines():
+    fp = io.BytesIO(b'foo\nbar\nbaz')
+    reader = ChunkedLineReader(fp)
+    assert reader.read_lines() == ['foo', 'bar']
+    assert reader.read_lines() == []
+    assert reader.flush() == ['baz']
+    assert reader.flush() == []
+
+
+def test_read_lines_partial_chunks():
+    fp = io.BytesIO(b'foo\nbar\nbaz\n')
+    reader = ChunkedLineReader(fp, chunk_size=5)
+
+    lines = []
+    for _ in range(10):
+        lines.extend(reader.read_lines())
+    assert lines == ['foo', 'bar', 'baz']
+
+
+def test_read_lines_split_unicode():
+    # The multi-byte character is split across two chunks
+    data = 'café\n'.encode('utf-8')
+    reader = ChunkedLineReader(io.BytesIO(data), chunk_size=4)
+    assert reader.read_lines() == []
+    assert reader.read_lines() == ['café']
+
+
+def test_read_log_file():
+    with open(LOG_FILE, 'rb') as fp:
+        reader = ChunkedLineReader(fp, chunk_size=1000)
+        lines = []
+        while True:
+            batch = reader.read_lines()
+            if not batch:
+                break
+            lines.extend(batch)
+
+    with open(LOG_FILE) as fp:
+        assert lines == fp.read().splitlines()
+
+
+def test_seek_end():
+    fp = io.BytesIO(b'foo\nbar\n')
+    reader = ChunkedLineReader(fp)
+    reader.seek_end()
+    assert reader.read_lines() == []
+    fp.write(b'baz\n')
+    fp.seek(-4, os.SEEK_END)
+    assert reader.read_lines() == ['baz']
+
+
+def read_all(reader):
+    lines = []
+    for _ in range(100):
+        lines.extend(reader.read_lines())
+        if reader.at_eof:
+            break
+    return lines
+
+
+@pytest.fixture()
+def log_path(tmpdir):
+    path = tmpdir.join('access.log')
+    path.write_binary(b'one\ntwo\n')
+    return str(path)
+
+
+def test_bytes_behind(log_path):
+    with open(log_path, 'rb') as fp:
+        reader = ChunkedLineReader(fp, chunk_size=4)
+        assert reader.bytes_behind() == 8
+        assert reader.read_lines() == ['one']
+        assert reader.bytes_behind() == 4
+
+    assert ChunkedLineReader(io.BytesIO(b'foo\n')).bytes_behind() is None
+
+
+def test_follower_rotation(log_path):
+    follower = FileFollower(open(log_path, 'rb'))
+    follower.seek_end()
+
+    with open(log_path, 'ab') as fp:
+        fp.write(b'three\nfour')
+    os.rename(log_path, log_path + '.1')
+    with open(log_path, 'wb') as fp:
+        fp.write(b'five\n')
+
+    # The tail of the old file, including the partial line, is read before
+    # switching over to the new file
+    assert read_all(follower) == ['three', 'four', 'five']
+    follower.close()
+
+
+def test_follower_truncation(log_path):
+    follower = FileFollower(open(log_path, 'rb'))
+    assert read_all(follower) == ['one', 'two']
+
+    with open(log_path, 'wb') as fp:
+        fp.write(b'3\n')
+    assert read_all(follower) == ['3']
+    follower.close()
+
+
+def test_follower_backfill(log_path):
+    with gzip.open(log_path + '.2.gz', 'wb') as fp:
+        fp.write(b'old\n')
+    with open(log_path + '.1', 'wb') as fp:
+        fp.write(b'older\nnewer')
+    with open(log_path + '.bak', 'wb') as fp:
+        fp.write(b'ignored\n')
+
+    follower = FileFollower(open(log_path, 'rb'), backfill=True)
+    assert follower.rotated_paths() == [log_path + '.2.gz', log_path + '.1']
+
+    # Backfilling doesn't skip to the end of the current file
+    follower.seek_end()
+    assert read_all(follower) == ['old', 'older', 'newer', 'one', 'two']
+    follower.close()
+
+
+def test_open_reader(log_path):
+    assert isinstance(open_reader(open(log_path, 'rb')), FileFollower)
+    assert isinstance(open_reader(io.BytesIO()), ChunkedLineReader)
+
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'),
+                    reason='inotify is only available on linux')
+def test_file_watcher(log_path, tmpdir):
+    watcher = FileWatcher(log_path)
+    assert watcher.fileno() is not None
+    assert not watcher.wait(timeout=0.01)
+
+    # Changes to other files in the directory are ignored
+    tmpdir.join('other.log').write('foo')
+    assert not watcher.wait(timeout=0.01)
+
+    with open(log_path, 'ab') as fp:
+        fp.write(b'three\n')
+    assert watcher.wait(timeout=1)
+    watcher.close()
+
+
+def test_log_file_set(tmpdir):
+    for name in ('a.log', 'b.log', 'a.log.1', 'other.txt'):
+        tmpdir.join(name).write('')
+
+    log_files = LogFileSet([str(tmpdir.join('*.log*'))])
+    followers = log_files.discover()
+
+    # Rotated copies are handled by the follower for the original file
+    paths = [os.path.basename(f.path) for f in followers]
+    assert paths == ['a.log', 'b.log']
+    assert log_files.discover() == []
+
+    tmpdir.join('c.log').write('')
+    assert len(log_files.discover()) == 1
+    log_files.close()
+
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'),
+                    reason='inotify is only available on linux')
+def test_log_file_set_changes(tmpdir):
+    tmpdir.join('a.log').write('')
+    tmpdir.join('b.log').write('')
+
+    log_files = LogFileSet([str(tmpdir.join('*.log'))])
+    followers = {os.path.basename(f.path): f for f in log_files.discover()}
+    assert log_files.fileno() is not None
+
+    tmpdir.join('b.log').write('foo\n', mode='a')
+    tmpdir.join('c.log').write('')
+    tmpdir.join('ignored.txt').write('')
+    changed, unknown = log_files.read_changes()
+    assert changed == [followers['b.log']]
+    assert unknown
+    log_files.close()
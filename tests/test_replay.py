@@ -0,0 +1,50 @@
+import os
+import json
+
+from akita.akita import MetricsAggregator
+from akita.replay import Replay, format_report
+
+
+LOG_FILE = os.path.join(os.path.dirname(__file__), 'data', 'apache.log')
+
+
+def run_replay(**kwargs):
+    metrics = MetricsAggregator(event_time=True, **kwargs)
+    with open(LOG_FILE, 'rb') as fp:
+        replay = Replay(fp, metrics, chunk_size=1000, top=2)
+        return replay.run()
+
+
+def test_replay():
+    report = run_replay(alert_threshold=10, alert_window=10)
+    assert report['lines'] == 38
+    assert report['parsed'] == 38
+    assert report['failed'] == 0
+    assert report['sections'] == [('category', 20), ('item', 13)]
+    assert report['end'] - report['start'] == 37
+    assert report['traffic']['max'] == 1
+    assert report['traffic']['histogram'] == [[0, 0, 0], [1, 1, 38]]
+    assert report['status_classes']['2xx'] == 38
+    assert report['status_codes'] == [(200, 38)]
+    assert report['alerts'] == []
+    assert report['error_alerts'] == []
+
+
+def test_replay_alerts():
+    # The log file has 1 request per second, so this will trigger an alert
+    # as soon as the 5 second window fills up
+    report = run_replay(alert_threshold=1, alert_window=5)
+    assert len(report['alerts']) == 1
+    assert report['alerts'][0]['start_rate'] == 1
+    assert report['alerts'][0]['end'] is None
+
+
+def test_format_report():
+    report = run_replay(alert_threshold=10, alert_window=10)
+
+    text = format_report(report)
+    assert 'Parsed Lines : 38' in text
+    assert '/category       20' in text
+
+    data = json.loads(format_report(report, 'json'))
+    assert data['lines'] == 38
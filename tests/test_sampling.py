@@ -0,0 +1,79 @@
+import time
+import logging
+
+from akita.akita import Akita, MetricsAggregator
+from akita.sampling import LoadShedder
+
+
+def test_load_shedder_step():
+    shedder = LoadShedder(max_lag=10, max_backlog=1000, max_step=4,
+                          interval=0)
+    assert shedder.due()
+    assert not shedder.update(lag=None, bytes_behind=0)
+    assert shedder.step == 1
+
+    # Doubles while either measure is over the limit, up to the max
+    assert shedder.update(lag=11, bytes_behind=10)
+    assert shedder.step == 2
+    assert shedder.update(lag=None, bytes_behind=2000)
+    assert shedder.step == 4
+    assert not shedder.update(lag=20, bytes_behind=2000)
+    assert shedder.step == 4
+
+    # Holds steady between the two levels, then backs off
+    assert not shedder.update(lag=8, bytes_behind=500)
+    assert shedder.update(lag=1, bytes_behind=100)
+    assert shedder.step == 2
+    assert shedder.update(lag=1, bytes_behind=100)
+    assert shedder.step == 1
+
+
+def test_load_shedder_sample():
+    shedder = LoadShedder()
+    lines = list(range(20))
+    assert shedder.sample(lines) is lines
+
+    # Every 4th line is kept, no matter how the lines are split up
+    shedder.step = 4
+    sampled = []
+    for size in (3, 1, 7, 2, 5, 2):
+        batch, lines = lines[:size], lines[size:]
+        sampled += shedder.sample(batch)
+    assert sampled == [0, 4, 8, 12, 16]
+
+
+def test_load_shedder_caught_up():
+    shedder = LoadShedder(max_lag=10, interval=0)
+
+    # Nothing left to read, so an old last line just means a quiet log
+    assert not shedder.update(lag=60, bytes_behind=0)
+    assert shedder.step == 1
+    assert shedder.update(lag=60, bytes_behind=None)
+    assert shedder.step == 2
+
+
+def test_akita_shed_load_idle_log(tmpdir):
+    path = tmpdir.join('access.log')
+    path.write('')
+    metrics = MetricsAggregator(100, 10, event_time=True)
+    shedder = LoadShedder(max_lag=10, interval=0)
+    fp = open(str(path), 'rb')
+    akita = Akita(fp, metrics, shedder=shedder)
+    try:
+        for _ in range(8):
+            # A handful of fresh lines after 30 seconds of silence
+            metrics.watermark = time.time() - 30
+            stamp = time.strftime('%d/%b/%Y:%H:%M:%S %z')
+            with path.open('a') as fp:
+                for _ in range(4):
+                    fp.write('127.0.0.1 - - [{}] "GET /a/b HTTP/1.0" 200 '
+                             '10 "-" "curl"\n'.format(stamp))
+            akita._process_lines(akita._read_lines(akita.reader))
+    finally:
+        logging.getLogger('akita').removeHandler(
+            akita.logger.handlers[-1])
+        fp.close()
+
+    assert shedder.step == 1
+    assert metrics.skipped_total == 0
+    assert metrics.hit_total == 32
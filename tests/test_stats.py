@@ -0,0 +1,28 @@
+from akita.stats import PipelineStats, format_stats
+
+
+def test_pipeline_stats():
+    stats = PipelineStats(interval=0)
+    stats.add('parse', 0.02, 1000)
+    stats.add('parse', 0.01, 500)
+    stats.add('draw', 0.005)
+    assert stats.calls['parse'] == 2
+    assert stats.items['parse'] == 1500
+
+    assert stats.update(lag=2.5, bytes_behind=1024) == 1
+    rate, load, average, peak = stats.recent['parse']
+    assert rate > 0
+    assert load > 0
+    assert average == 0.015
+    assert peak == 0.02
+    assert stats.recent['read'][2] is None
+
+    # The next interval starts from zero
+    stats.update()
+    assert stats.recent['parse'][0] == 0
+    assert stats.max_time['parse'] == 0.02
+
+    text = format_stats(stats)
+    assert 'parse' in text
+    assert '1,500' in text
+    assert 'Log Lag      : -' in text